@@ -14,7 +14,64 @@ def create_app():
 
     # Initialize database
     from app.models import Database
-    app.db = Database(app.config['DATABASE_PATH'])
+    from app.passwords import PasswordHasher
+    from app.metrics import Metrics, coverage_collector, database_collector, live_collector
+    # Slow-query logging works without the metrics endpoint; both need the timing wrappers
+    app.metrics = None
+    if app.config['METRICS_ENABLED'] or app.config['SLOW_QUERY_MS']:
+        app.metrics = Metrics(app.config['SLOW_QUERY_MS'])
+    hasher = PasswordHasher(
+        app.config['PASSWORD_HASH_METHOD'],
+        workers=app.config['PASSWORD_HASH_WORKERS'],
+        max_pending=app.config['PASSWORD_HASH_QUEUE']
+    )
+    app.db = Database(
+        app.config['DATABASE_PATH'],
+        pool_size=app.config['DB_POOL_SIZE'],
+        busy_timeout=app.config['DB_BUSY_TIMEOUT'],
+        synchronous=app.config['DB_SYNCHRONOUS'],
+        cache_size_kb=app.config['DB_CACHE_SIZE_KB'],
+        mmap_size=app.config['DB_MMAP_SIZE'],
+        lock_retries=app.config['DB_LOCK_RETRIES'],
+        hasher=hasher,
+        user_cache_ttl=app.config['USER_CACHE_TTL'],
+        user_cache_size=app.config['USER_CACHE_SIZE'],
+        dataset_cache_size=app.config['DATASET_CACHE_SIZE'],
+        blob_codec=app.config['BLOB_CODEC'],
+        blob_level=app.config['BLOB_LEVEL'],
+        render_html=app.config['RENDER_HTML'],
+        render_workers=app.config['RENDER_WORKERS'],
+        metrics=app.metrics
+    )
+    if app.config['RENDER_HTML'] and not app.db.render_html:
+        app.logger.warning('RENDER_HTML is set but markdown/nh3 are not installed; '
+                           'examples will be rendered in the browser')
+    app.teardown_appcontext(app.db.release_request_connection)
+
+    # Started per serving process (run.py), not here: threads do not survive fork
+    from app.jobs import JobRunner
+    app.jobs = JobRunner(
+        app.db,
+        app.config['JOB_ARTIFACT_DIR'],
+        workers=app.config['JOB_WORKERS'],
+        max_attempts=app.config['JOB_MAX_ATTEMPTS'],
+        retention_days=app.config['JOB_RETENTION_DAYS']
+    )
+    # The poller thread starts with the first dashboard subscribing in a process
+    from app.live import LiveFeed
+    app.live = LiveFeed(
+        app.db,
+        app.config['ASSIGNMENT_TARGET'],
+        interval=app.config['LIVE_INTERVAL'],
+        keepalive=app.config['LIVE_KEEPALIVE'],
+        max_ratings=app.config['LIVE_MAX_RATINGS'],
+        max_subscribers=app.config['LIVE_MAX_SUBSCRIBERS']
+    )
+    if app.config['METRICS_ENABLED']:
+        app.metrics.add_collector(database_collector(app.db))
+        app.metrics.add_collector(coverage_collector(app.db, app.config['ASSIGNMENT_TARGET']))
+        app.metrics.add_collector(live_collector(app.live))
+        app.metrics.init_app(app)
 
     # Register blueprints
     from app.routes import main_bp
@@ -1,88 +1,315 @@
-from flask import Blueprint, render_template, request, jsonify, current_app, send_file
+from flask import Blueprint, render_template, request, jsonify, current_app, Response, send_file, session, url_for
+from app import analytics, columnar, events
 from app.auth import admin_required
+from app.columnar import COLUMNAR_FORMATS
+from app.export import EXPORT_FORMATS, event_record, stream_events, stream_ratings
+from app.jobs import artifact_path
+import base64
+import hmac
 import json
-import csv
-import io
 import os
 from datetime import datetime
 
 admin_bp = Blueprint('admin', __name__)
 
+RATINGS_PAGE_SIZE = 50
+MAX_RATINGS_PAGE_SIZE = 500
+JOBS_PAGE_SIZE = 20
+
+
+def encode_cursor(cursor):
+    """Encode a (timestamp, id) keyset cursor as an opaque URL-safe token"""
+    if cursor is None:
+        return None
+    return base64.urlsafe_b64encode(json.dumps(cursor).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(token):
+    """Decode a cursor token; invalid tokens start from the first page"""
+    if not token:
+        return None
+    try:
+        timestamp, rating_id = json.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+        return str(timestamp), int(rating_id)
+    except (ValueError, TypeError):
+        return None
+
+
+def job_json(job):
+    """A job as returned by the jobs API, with its download URL once an export is ready"""
+    job = dict(job)
+    job['download_url'] = None
+    if job['status'] == 'succeeded' and job['artifact']:
+        job['download_url'] = url_for('admin.download_job_artifact', job_id=job['id'])
+    return job
+
+
+def enqueue_job(kind, params, message):
+    """Queue a background job for the current admin and wake this process's runner"""
+    job_id = current_app.db.enqueue_job(kind, params, session['user_id'])
+    current_app.jobs.wake()
+    return jsonify({'success': True, 'job_id': job_id, 'message': message}), 202
+
+
+def export_version():
+    """The ?version= of an export; (version, error response) with an error for unknown versions"""
+    version = request.args.get('version', type=int)
+    if version is not None and not any(
+            dataset['version'] == version for dataset in current_app.db.get_dataset_versions()):
+        return version, (jsonify({'success': False, 'message': '데이터셋 버전을 찾을 수 없습니다.'}), 404)
+    return version, None
+
+
+def event_cursor():
+    """The ?after= sequence number of an event feed request; (after, error response)"""
+    after = request.args.get('after', '0')
+    if not after.isdigit():
+        return None, (jsonify({'success': False, 'message': 'after는 0 이상의 정수여야 합니다.'}), 400)
+    return int(after), None
+
+
+def rating_filters():
+    """Read the model/category/evaluator filters from the query string"""
+    return {
+        'model': request.args.get('model') or None,
+        'category': request.args.get('category') or None,
+        'evaluator': request.args.get('evaluator') or None
+    }
+
+
 @admin_bp.route('/')
 @admin_required
 def dashboard():
     """Admin dashboard"""
     stats = current_app.db.get_aggregated_stats()
-    all_ratings = current_app.db.get_all_ratings()
+    filters = rating_filters()
+    ratings, next_cursor = current_app.db.get_ratings_page(
+        RATINGS_PAGE_SIZE, decode_cursor(request.args.get('cursor')), **filters)
+    total = current_app.db.count_ratings(**filters)
 
-    return render_template('admin.html', stats=stats, ratings=all_ratings)
+    return render_template('admin.html',
+                         stats=stats,
+                         leaderboard=current_app.db.get_leaderboard(),
+                         coverage=current_app.db.get_coverage(current_app.config['ASSIGNMENT_TARGET']),
+                         dataset_versions=current_app.db.get_dataset_versions(),
+                         columnar_formats=[format for format in COLUMNAR_FORMATS if columnar.available(format)],
+                         jobs=[job_json(job) for job in current_app.db.get_jobs(JOBS_PAGE_SIZE)],
+                         ratings=ratings,
+                         total=total,
+                         filters=filters,
+                         categories=current_app.db.get_categories(),
+                         next_cursor=encode_cursor(next_cursor),
+                         ratings_page_size=RATINGS_PAGE_SIZE)
+
+@admin_bp.route('/api/ratings')
+@admin_required
+def ratings_page():
+    """Paginated ratings API (keyset cursor on timestamp and id)"""
+    try:
+        limit = min(max(int(request.args.get('limit', RATINGS_PAGE_SIZE)), 1), MAX_RATINGS_PAGE_SIZE)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'limit은 숫자여야 합니다.'}), 400
+
+    filters = rating_filters()
+    ratings, next_cursor = current_app.db.get_ratings_page(
+        limit, decode_cursor(request.args.get('cursor')), **filters)
+
+    response = {
+        'success': True,
+        'ratings': ratings,
+        'next_cursor': encode_cursor(next_cursor)
+    }
+    if request.args.get('count', '').lower() in ('1', 'true'):
+        response['total'] = current_app.db.count_ratings(**filters)
+    return jsonify(response)
+
+@admin_bp.route('/api/events')
+@admin_required
+def rating_events():
+    """Rating change feed: events after the ?after= sequence number, oldest first
+
+    A client stores the returned cursor and passes it as `after` next time,
+    so each sync reads only the events written since the previous one.
+    """
+    after, error = event_cursor()
+    if error:
+        return error
+    try:
+        limit = min(max(int(request.args.get('limit', events.PAGE_SIZE)), 1), events.MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'limit은 숫자여야 합니다.'}), 400
+
+    rows, cursor = current_app.db.get_rating_events(after, limit)
+    return jsonify({
+        'success': True,
+        'events': [event_record(row) for row in rows],
+        'cursor': cursor,
+        'has_more': len(rows) == limit
+    })
+
+@admin_bp.route('/events/export')
+@admin_required
+def export_rating_events():
+    """Stream the rating events after ?after= as NDJSON, optionally gzipped
+
+    Ends at the newest event when the request arrived, whose sequence number
+    is sent in the X-Event-Cursor header for the next export.
+    """
+    after, error = event_cursor()
+    if error:
+        return error
+    until = current_app.db.get_last_event_seq()
+    compress = request.args.get('gzip', '').lower() in ('1', 'true')
+
+    filename = f'rating_events_{after + 1}-{until}.ndjson'
+    mimetype = 'application/x-ndjson'
+    if compress:
+        filename += '.gz'
+        mimetype = 'application/gzip'
+
+    body = stream_events(current_app.db.iter_rating_events(after, until), compress)
+    return Response(body, mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename={filename}',
+        'X-Event-Cursor': str(max(after, until))
+    })
+
+@admin_bp.route('/api/live')
+@admin_required
+def live_updates():
+    """Server-Sent Events stream of dashboard changes: a snapshot, then coalesced updates
+
+    A reconnecting browser sends the last rating event it saw as Last-Event-ID
+    and gets the ratings it missed with the new snapshot.
+    """
+    last_id = request.headers.get('Last-Event-ID', '')
+    subscriber, snapshot = current_app.live.subscribe(int(last_id) if last_id.isdigit() else None)
+    if subscriber is None:
+        return jsonify({'success': False, 'message': '실시간 대시보드 연결 수가 너무 많습니다. 잠시 후 다시 시도하세요.'}), 503
+
+    return Response(current_app.live.stream(subscriber, snapshot), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        # Stop nginx from buffering the stream
+        'X-Accel-Buffering': 'no'
+    })
+
+@admin_bp.route('/api/cache')
+@admin_required
+def cache_stats():
+    """Dataset cache size and hit/miss counters of the serving process"""
+    return jsonify({'success': True, 'pid': os.getpid(), 'dataset': current_app.db.get_dataset_cache_stats()})
+
+@admin_bp.route('/api/leaderboard')
+@admin_required
+def leaderboard():
+    """Ranked models with confidence bounds and pairwise win records"""
+    confidence = request.args.get('confidence', 0.95, type=float)
+    if not 0 < confidence < 1:
+        return jsonify({'success': False, 'message': '신뢰수준은 0과 1 사이여야 합니다.'}), 400
+    return jsonify({'success': True, 'leaderboard': current_app.db.get_leaderboard(confidence)})
+
+@admin_bp.route('/api/coverage')
+@admin_required
+def coverage():
+    """Rating coverage per category against the assignment target, and rating throughput"""
+    return jsonify({'success': True, 'coverage': current_app.db.get_coverage(current_app.config['ASSIGNMENT_TARGET'])})
+
+@admin_bp.route('/api/analytics')
+@admin_required
+def rating_analytics():
+    """Inter-annotator agreement, evaluator bias and bootstrap confidence intervals"""
+    if not analytics.available():
+        return jsonify({'success': False, 'message': '일치도 분석에는 numpy가 필요합니다. (pip install numpy)'}), 501
+    try:
+        result = current_app.db.get_rating_analytics(
+            reps=current_app.config['ANALYTICS_BOOTSTRAP'],
+            workers=current_app.config['ANALYTICS_WORKERS'],
+            max_cells=current_app.config['ANALYTICS_MAX_CELLS']
+        )
+    except analytics.AnalyticsError as e:
+        return jsonify({'success': False, 'message': str(e)}), 413
+    return jsonify({'success': True, 'analytics': result})
+
+def metrics_token_valid():
+    """Check the scraper bearer token (METRICS_TOKEN), if one is configured"""
+    token = current_app.config['METRICS_TOKEN']
+    header = request.headers.get('Authorization', '')
+    return bool(token) and hmac.compare_digest(header.encode('utf-8'), f'Bearer {token}'.encode('utf-8'))
+
+def render_metrics():
+    """Prometheus text exposition of the serving process"""
+    return Response(current_app.metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@admin_bp.route('/metrics')
+def metrics():
+    """Request and query metrics for an admin session or a scraper with METRICS_TOKEN"""
+    if not current_app.config['METRICS_ENABLED']:
+        return jsonify({'success': False, 'message': '메트릭이 비활성화되어 있습니다. (METRICS_ENABLED)'}), 404
+    if metrics_token_valid():
+        return render_metrics()
+    return admin_required(render_metrics)()
 
 @admin_bp.route('/export/<format>')
 @admin_required
 def export_ratings(format):
-    """Export ratings as CSV or JSON"""
-    all_ratings = current_app.db.get_all_ratings()
-
-    if format == 'csv':
-        # Create CSV
-        output = io.StringIO()
-        writer = csv.writer(output)
-
-        # Write header
-        writer.writerow(['example_id', 'category', 'model', 'evaluator_id', 'rating', 'timestamp'])
-
-        # Write data
-        for rating in all_ratings:
-            writer.writerow([
-                rating['example_id'],
-                rating['category'],
-                rating['model_name'],
-                rating['evaluator_username'],
-                rating['rating'],
-                rating['timestamp']
-            ])
-
-        # Create response
-        output.seek(0)
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f'ratings_export_{timestamp}.csv'
-
-        return send_file(
-            io.BytesIO(output.getvalue().encode('utf-8-sig')),  # UTF-8 BOM for Excel
-            mimetype='text/csv',
-            as_attachment=True,
-            download_name=filename
-        )
+    """Export a dataset version's ratings (default: the active one) as CSV, JSON or NDJSON
 
-    elif format == 'json':
-        # Create JSON
-        export_data = []
-        for rating in all_ratings:
-            export_data.append({
-                'example_id': rating['example_id'],
-                'category': rating['category'],
-                'model': rating['model_name'],
-                'evaluator_id': rating['evaluator_username'],
-                'rating': rating['rating'],
-                'timestamp': rating['timestamp']
-            })
-
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f'ratings_export_{timestamp}.json'
-
-        return send_file(
-            io.BytesIO(json.dumps(export_data, ensure_ascii=False, indent=2).encode('utf-8')),
-            mimetype='application/json',
-            as_attachment=True,
-            download_name=filename
-        )
+    Streamed in chunks, optionally gzipped.
+    """
+    if format in COLUMNAR_FORMATS:
+        return jsonify({'success': False, 'message': '컬럼 형식은 백그라운드 작업으로만 내보낼 수 있습니다. (POST)'}), 400
+    if format not in EXPORT_FORMATS:
+        return jsonify({'success': False, 'message': '지원하지 않는 형식입니다.'}), 400
+
+    version, error = export_version()
+    if error:
+        return error
+
+    mimetype, extension = EXPORT_FORMATS[format]
+    compress = request.args.get('gzip', '').lower() in ('1', 'true')
+
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    filename = f'ratings_export_{timestamp}.{extension}'
+    if version is not None:
+        filename = f'ratings_export_v{version}_{timestamp}.{extension}'
+    if compress:
+        filename += '.gz'
+        mimetype = 'application/gzip'
+
+    # The body is generated after the request context is gone, so each
+    # chunk borrows a pooled connection only while it is being read
+    body = stream_ratings(current_app.db.iter_all_ratings(version=version), format, compress)
+    return Response(body, mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename={filename}'
+    })
 
-    return jsonify({'success': False, 'message': '지원하지 않는 형식입니다.'}), 400
+@admin_bp.route('/export/<format>', methods=['POST'])
+@admin_required
+def queue_export(format):
+    """Queue an export job writing a dataset version's ratings to a file for later download
+
+    Columnar formats (arrow, parquet, npz) can join example metadata with ?metadata=1.
+    """
+    if format not in EXPORT_FORMATS and format not in COLUMNAR_FORMATS:
+        return jsonify({'success': False, 'message': '지원하지 않는 형식입니다.'}), 400
+    if format in COLUMNAR_FORMATS and not columnar.available(format):
+        library = 'numpy' if format == 'npz' else 'pyarrow'
+        return jsonify({'success': False, 'message': f'{format} 내보내기에는 {library}가 필요합니다.'}), 400
+
+    version, error = export_version()
+    if error:
+        return error
+
+    params = {'format': format, 'version': version}
+    if format in COLUMNAR_FORMATS:
+        params['metadata'] = request.args.get('metadata', '').lower() in ('1', 'true')
+    else:
+        params['gzip'] = request.args.get('gzip', '').lower() in ('1', 'true')
+    return enqueue_job('export_ratings', params, '내보내기 작업이 등록되었습니다.')
 
 @admin_bp.route('/load_dataset', methods=['POST'])
 @admin_required
 def load_dataset():
-    """Load a new dataset from JSON file"""
+    """Queue a job loading a new dataset from a JSON array or NDJSON file"""
     data = request.get_json()
     dataset_path = data.get('dataset_path')
 
@@ -93,62 +320,68 @@ def load_dataset():
     if not os.path.exists(dataset_path):
         return jsonify({'success': False, 'message': '파일을 찾을 수 없습니다.'}), 404
 
-    try:
-        # Load and validate JSON
-        with open(dataset_path, 'r', encoding='utf-8') as f:
-            dataset = json.load(f)
-
-        # Validate dataset format
-        if not isinstance(dataset, list):
-            return jsonify({'success': False, 'message': '데이터셋은 배열 형식이어야 합니다.'}), 400
-
-        for i, item in enumerate(dataset):
-            # Check required fields
-            required_fields = ['category', 'history', 'example_id', 'responses']
-            for field in required_fields:
-                if field not in item:
-                    return jsonify({
-                        'success': False,
-                        'message': f'항목 {i}: 필수 필드 "{field}"가 누락되었습니다.'
-                    }), 400
-
-            # Validate history
-            if not isinstance(item['history'], list):
-                return jsonify({
-                    'success': False,
-                    'message': f'항목 {i}: history는 배열이어야 합니다.'
-                }), 400
-
-            for turn in item['history']:
-                if 'role' not in turn or 'content' not in turn:
-                    return jsonify({
-                        'success': False,
-                        'message': f'항목 {i}: history의 각 항목은 role과 content를 포함해야 합니다.'
-                    }), 400
-
-            # Validate responses
-            if not isinstance(item['responses'], list) or len(item['responses']) == 0:
-                return jsonify({
-                    'success': False,
-                    'message': f'항목 {i}: responses는 비어있지 않은 배열이어야 합니다.'
-                }), 400
-
-            for response in item['responses']:
-                if 'model' not in response or 'output' not in response:
-                    return jsonify({
-                        'success': False,
-                        'message': f'항목 {i}: 각 response는 model과 output을 포함해야 합니다.'
-                    }), 400
-
-        # Load into database
-        current_app.db.load_dataset(dataset)
-
-        return jsonify({
-            'success': True,
-            'message': f'{len(dataset)}개의 예제가 성공적으로 로드되었습니다.'
-        })
-
-    except json.JSONDecodeError as e:
-        return jsonify({'success': False, 'message': f'JSON 파싱 오류: {str(e)}'}), 400
-    except Exception as e:
-        return jsonify({'success': False, 'message': f'오류 발생: {str(e)}'}), 500
+    # The job streams and validates into a new version, then swaps it in
+    return enqueue_job('load_dataset', {'path': os.path.abspath(dataset_path)},
+                       '데이터셋 로드 작업이 등록되었습니다.')
+
+@admin_bp.route('/api/jobs')
+@admin_required
+def list_jobs():
+    """Most recent background jobs with their progress"""
+    limit = min(max(request.args.get('limit', JOBS_PAGE_SIZE, type=int), 1), MAX_RATINGS_PAGE_SIZE)
+    return jsonify({'success': True, 'jobs': [job_json(job) for job in current_app.db.get_jobs(limit)]})
+
+@admin_bp.route('/api/jobs/<int:job_id>')
+@admin_required
+def job_status(job_id):
+    """A background job's status, progress and result"""
+    job = current_app.db.get_job(job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': '작업을 찾을 수 없습니다.'}), 404
+    return jsonify({'success': True, 'job': job_json(job)})
+
+@admin_bp.route('/api/jobs/<int:job_id>/cancel', methods=['POST'])
+@admin_required
+def cancel_job(job_id):
+    """Cancel a queued job, or ask a running one to stop at its next progress report"""
+    status = current_app.db.cancel_job(job_id)
+    if status is None:
+        return jsonify({'success': False, 'message': '작업을 찾을 수 없습니다.'}), 404
+    if status not in ('queued', 'running'):
+        return jsonify({'success': False, 'message': '이미 끝난 작업입니다.'}), 409
+    return jsonify({'success': True, 'message': '작업 취소를 요청했습니다.'})
+
+@admin_bp.route('/api/jobs/<int:job_id>', methods=['DELETE'])
+@admin_required
+def delete_job(job_id):
+    """Delete a finished job and its export file"""
+    job = current_app.db.delete_job(job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': '끝난 작업만 삭제할 수 있습니다.'}), 409
+    current_app.jobs.remove_artifact(job)
+    return jsonify({'success': True, 'message': '작업이 삭제되었습니다.'})
+
+@admin_bp.route('/jobs/<int:job_id>/download')
+@admin_required
+def download_job_artifact(job_id):
+    """Download the file written by a finished export job"""
+    job = current_app.db.get_job(job_id)
+    if job is None or job['status'] != 'succeeded' or not job['artifact']:
+        return jsonify({'success': False, 'message': '내려받을 파일이 없습니다.'}), 404
+    path = artifact_path(current_app.jobs.artifact_dir, job)
+    if not os.path.exists(path):
+        return jsonify({'success': False, 'message': '내보내기 파일이 삭제되었습니다.'}), 410
+
+    format = job['params']['format']
+    mimetype = (EXPORT_FORMATS.get(format) or COLUMNAR_FORMATS[format])[0]
+    if job['artifact'].endswith('.gz'):
+        mimetype = 'application/gzip'
+    return send_file(path, mimetype=mimetype, as_attachment=True, download_name=job['artifact'])
+
+@admin_bp.route('/datasets/<int:version>/activate', methods=['POST'])
+@admin_required
+def activate_dataset(version):
+    """Make a previously loaded dataset version the active one (e.g. to roll back a load)"""
+    if not current_app.db.activate_dataset(version):
+        return jsonify({'success': False, 'message': '활성화할 수 없는 데이터셋 버전입니다.'}), 404
+    return jsonify({'success': True, 'message': f'데이터셋 버전 {version}이 활성화되었습니다.'})
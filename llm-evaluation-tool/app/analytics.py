@@ -0,0 +1,365 @@
+"""
+Inter-annotator agreement and reliability analytics
+
+Ratings are loaded into a dense (example × model × evaluator) int8 array
+(0 = not rated); each (example, model) pair is one unit rated by several
+evaluators. Everything below works on whole arrays:
+
+- Krippendorff's alpha (nominal, ordinal, interval) from the coincidence
+  matrix of per-unit value counts
+- Fleiss' kappa generalized to a varying number of raters per unit
+- Cohen's kappa for every evaluator pair from one-hot contingency products
+- per-evaluator bias against the mean of the other raters of the same unit
+- cluster-bootstrap confidence intervals (examples resampled) for model and
+  (category, model) means, with resamples spread over worker processes
+
+Requires the optional `numpy` package.
+"""
+import itertools
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from app.datasets import ACTIVE_RATING, ACTIVE_VERSION
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+RATING_VALUES = (1, 2, 3, 4, 5)
+
+# Evaluator pairs need this many shared units for a Cohen's kappa
+MIN_PAIR_OVERLAP = 10
+
+# Units per block in the pairwise contingency product and the bias deviations
+PAIR_CHUNK = 20000
+
+# Bootstrap resamples drawn per vectorized step (bounds the index matrix size)
+BOOTSTRAP_CHUNK = 64
+
+# Below this many resampled examples a worker pool costs more than it saves
+PARALLEL_MIN_WORK = 5_000_000
+
+
+class AnalyticsError(ValueError):
+    """Raised when the ratings cannot be analyzed (e.g. the dense array would be too large)"""
+
+
+def available():
+    """Whether numpy is installed"""
+    return np is not None
+
+
+class RatingArray:
+    """Dense rating array with the labels of each axis"""
+
+    def __init__(self, ratings, example_ids, models, evaluators, categories, example_categories):
+        self.ratings = ratings                          # (examples, models, evaluators) int8, 0 = missing
+        self.example_ids = example_ids                  # example id per example index
+        self.models = models                            # model name per model index
+        self.evaluators = evaluators                    # username per evaluator index
+        self.categories = categories                    # category name per category index
+        self.example_categories = example_categories    # category index per example index
+
+    def units(self):
+        """(units × evaluators) view; unit = example * n_models + model"""
+        examples, models, evaluators = self.ratings.shape
+        return self.ratings.reshape(examples * models, evaluators)
+
+
+def load_ratings(conn, max_cells=20_000_000):
+    """Read the ratings of the active dataset version into a RatingArray"""
+    cursor = conn.cursor()
+    cursor.row_factory = None
+
+    # Integer columns only, one model at a time through the model index; string
+    # columns would dominate the load time
+    models = [row[0] for row in cursor.execute('SELECT DISTINCT model_name FROM ratings ORDER BY model_name')]
+    parts = []
+    for model_index, model in enumerate(models):
+        rows = cursor.execute(f'''
+            SELECT r.example_id, r.user_id, r.rating
+            FROM ratings r
+            JOIN dataset_examples m ON {ACTIVE_RATING}
+            WHERE r.model_name = ?
+        ''', (model,)).fetchall()
+        part = np.fromiter(itertools.chain.from_iterable(rows), dtype=np.int64, count=3 * len(rows))
+        parts.append(np.column_stack([part.reshape(-1, 3), np.full(len(rows), model_index)]))
+    data = np.concatenate(parts) if parts else np.zeros((0, 4), dtype=np.int64)
+
+    known = cursor.execute(
+        f'SELECT example_id, category FROM dataset_examples WHERE version = {ACTIVE_VERSION} ORDER BY example_id'
+    ).fetchall()
+    known_ids = np.array([row[0] for row in known], dtype=np.int64)
+    categories, known_categories = np.unique(np.array([row[1] for row in known], dtype=str), return_inverse=True)
+    position = np.searchsorted(known_ids, data[:, 0])
+
+    example_ids, example_index = np.unique(data[:, 0], return_inverse=True)
+    users, user_index = np.unique(data[:, 1], return_inverse=True)
+    shape = (len(example_ids), len(models), len(users))
+    if shape[0] * shape[1] * shape[2] > max_cells:
+        raise AnalyticsError(f'평가 배열이 너무 큽니다: {shape[0]} × {shape[1]} × {shape[2]} '
+                             f'(ANALYTICS_MAX_CELLS={max_cells})')
+
+    dense = np.zeros(shape, dtype=np.int8)
+    dense[example_index, data[:, 3], user_index] = data[:, 2]
+    example_categories = np.zeros(shape[0], dtype=np.int64)
+    example_categories[example_index] = known_categories[position]
+
+    usernames = dict(cursor.execute('SELECT id, username FROM users').fetchall())
+    return RatingArray(dense, example_ids, models,
+                       [usernames.get(int(user_id), str(user_id)) for user_id in users],
+                       categories.tolist(), example_categories)
+
+
+def value_counts(units):
+    """Per-unit count of each rating value (units × values)"""
+    return np.stack([(units == value).sum(1) for value in RATING_VALUES], axis=1).astype(np.float64)
+
+
+def _distances(metric, totals):
+    """Squared distance between every pair of rating values"""
+    values = np.array(RATING_VALUES, dtype=np.float64)
+    if metric == 'nominal':
+        return 1.0 - np.eye(len(values))
+    if metric == 'interval':
+        return np.subtract.outer(values, values) ** 2
+    if metric == 'ordinal':
+        index = np.arange(len(values))
+        low, high = np.minimum.outer(index, index), np.maximum.outer(index, index)
+        cumulative = np.concatenate([[0.0], np.cumsum(totals)])
+        between = cumulative[high + 1] - cumulative[low]
+        return (between - np.add.outer(totals, totals) / 2) ** 2
+    raise ValueError(f'unknown metric: {metric}')
+
+
+def krippendorff_alpha(counts, metric='interval'):
+    """Krippendorff's alpha from per-unit value counts; None without pairable values"""
+    pairable = counts.sum(1)
+    counts, pairable = counts[pairable >= 2], pairable[pairable >= 2]
+    if not len(counts):
+        return None
+
+    weighted = counts / (pairable - 1)[:, None]
+    coincidences = weighted.T @ counts - np.diag(weighted.sum(0))
+    totals = coincidences.sum(1)
+    n = totals.sum()
+    distances = _distances(metric, totals)
+
+    expected = (np.outer(totals, totals) * distances).sum()
+    if expected == 0:
+        return None
+    return float(1 - (n - 1) * (coincidences * distances).sum() / expected)
+
+
+def fleiss_kappa(counts):
+    """Fleiss' kappa over units with at least two ratings (raters per unit may vary)"""
+    raters = counts.sum(1)
+    counts, raters = counts[raters >= 2], raters[raters >= 2]
+    if not len(counts):
+        return None
+
+    observed = ((counts ** 2).sum(1) - raters) / (raters * (raters - 1))
+    shares = counts.sum(0) / counts.sum()
+    chance = (shares ** 2).sum()
+    if chance >= 1:
+        return None
+    return float((observed.mean() - chance) / (1 - chance))
+
+
+def pairwise_cohen_kappa(units, min_overlap=MIN_PAIR_OVERLAP):
+    """Cohen's kappa for every evaluator pair (NaN where pairs share too few units) and overlap counts"""
+    evaluators = units.shape[1]
+    size = evaluators * len(RATING_VALUES)
+    values = np.array(RATING_VALUES, dtype=np.int8)
+
+    # Contingency tables of all pairs at once: one-hot (unit, evaluator, value) blocks
+    tables = np.zeros((size, size))
+    for start in range(0, len(units), PAIR_CHUNK):
+        onehot = (units[start:start + PAIR_CHUNK, :, None] == values).reshape(-1, size).astype(np.float32)
+        tables += onehot.T @ onehot
+    tables = tables.reshape(evaluators, len(values), evaluators, len(values)).transpose(0, 2, 1, 3)
+
+    overlap = tables.sum((2, 3))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        observed = np.trace(tables, axis1=2, axis2=3) / overlap
+        rows = tables.sum(3) / overlap[..., None]
+        columns = tables.sum(2) / overlap[..., None]
+        chance = (rows * columns).sum(2)
+        kappa = (observed - chance) / (1 - chance)
+
+    kappa[(overlap < min_overlap) | (chance >= 1)] = np.nan
+    np.fill_diagonal(kappa, np.nan)
+    return kappa, overlap.astype(np.int64)
+
+
+def evaluator_bias(units):
+    """Per evaluator: mean deviation from the other raters' mean and number of shared units"""
+    deviation = np.zeros(units.shape[1])
+    count = np.zeros(units.shape[1], dtype=np.int64)
+    # Float copies are made per block of units, and only of units with two or more raters
+    for start in range(0, len(units), PAIR_CHUNK):
+        block = units[start:start + PAIR_CHUNK]
+        block = block[(block > 0).sum(1) >= 2]
+        rated = block > 0
+        values = block.astype(np.float64)
+        others = (values.sum(1)[:, None] - values) / (rated.sum(1) - 1)[:, None]
+        deviation += np.where(rated, values - others, 0.0).sum(0)
+        count += rated.sum(0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return deviation / count, count
+
+
+def _bootstrap_means(sums, counts, reps, seed):
+    """Means of `reps` cluster-bootstrap resamples of per-example sums and counts"""
+    rng = np.random.default_rng(seed)
+    size = len(sums)
+    # Sum in the high and count in the low 32 bits: one gather per resample instead of two
+    packed = (sums.astype(np.int64) << 32) | counts.astype(np.int64)
+    means = np.empty(reps)
+    for start in range(0, reps, BOOTSTRAP_CHUNK):
+        block = min(BOOTSTRAP_CHUNK, reps - start)
+        totals = packed[rng.integers(0, size, (block, size), dtype=np.int32)].sum(1)
+        means[start:start + block] = (totals >> 32) / (totals & 0xFFFFFFFF)
+    return means
+
+
+def _bootstrap_task(groups, reps, seeds):
+    """Bootstrap means for a list of (sums, counts) groups (runs in a worker process)"""
+    return [_bootstrap_means(sums, counts, reps, seed) for (sums, counts), seed in zip(groups, seeds)]
+
+
+def bootstrap_intervals(groups, reps=1000, confidence=0.95, workers=None, seed=0):
+    """Percentile confidence intervals of the mean for each (sums, counts) group
+
+    Examples are the resampling unit, so ratings of the same example stay
+    together. Seeds are fixed per group, so results do not depend on the
+    number of workers.
+    """
+    seeds = np.random.SeedSequence(seed).spawn(len(groups))
+    workers = multiprocessing.cpu_count() if workers is None else workers
+    work = sum(len(sums) for sums, _ in groups) * reps
+
+    if workers > 1 and len(groups) > 1 and work >= PARALLEL_MIN_WORK:
+        # Interleave groups so every worker gets a similar amount of work
+        order = sorted(range(len(groups)), key=lambda i: -len(groups[i][0]))
+        shares = [order[i::workers] for i in range(workers) if order[i::workers]]
+        # Started from a fresh interpreter: forking a threaded server worker
+        # copies locks its other threads may hold
+        method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        context = multiprocessing.get_context(method)
+        means = [None] * len(groups)
+        with ProcessPoolExecutor(max_workers=len(shares), mp_context=context) as executor:
+            futures = [
+                executor.submit(_bootstrap_task, [groups[i] for i in share], reps, [seeds[i] for i in share])
+                for share in shares
+            ]
+            for share, future in zip(shares, futures):
+                for i, result in zip(share, future.result()):
+                    means[i] = result
+    else:
+        means = _bootstrap_task(groups, reps, seeds)
+
+    tail = (1 - confidence) / 2 * 100
+    return [tuple(np.percentile(values, [tail, 100 - tail])) for values in means]
+
+
+def _number(value, digits=4):
+    """JSON-safe rounded float (None for missing values)"""
+    if value is None or not np.isfinite(value):
+        return None
+    return round(float(value), digits)
+
+
+def analyze(array, reps=1000, confidence=0.95, workers=None):
+    """Compute all agreement and reliability metrics of a RatingArray as a JSON-ready dict"""
+    start = time.perf_counter()
+    examples, models, evaluators = array.ratings.shape
+    units = array.units()
+    counts = value_counts(units)
+    unit_models = np.tile(np.arange(models), examples)
+    unit_categories = np.repeat(array.example_categories, models)
+    multi_rated = counts.sum(1) >= 2
+
+    result = {
+        'ratings': int(counts.sum()),
+        'examples': examples,
+        'evaluators': evaluators,
+        'units': int((counts.sum(1) > 0).sum()),
+        'multi_rated_units': int(multi_rated.sum()),
+        'bootstrap': {'reps': reps, 'confidence': confidence},
+        'agreement': {
+            'alpha_interval': _number(krippendorff_alpha(counts, 'interval')),
+            'alpha_ordinal': _number(krippendorff_alpha(counts, 'ordinal')),
+            'alpha_nominal': _number(krippendorff_alpha(counts, 'nominal')),
+            'fleiss_kappa': _number(fleiss_kappa(counts)),
+        },
+    }
+
+    # Evaluators: pairwise Cohen's kappa on units with at least two ratings
+    kappa, overlap = pairwise_cohen_kappa(units[multi_rated])
+    pair_kappas = kappa[np.triu_indices(evaluators, 1)]
+    pair_kappas = pair_kappas[np.isfinite(pair_kappas)]
+    result['agreement']['cohen_kappa_mean'] = _number(pair_kappas.mean()) if len(pair_kappas) else None
+    result['agreement']['cohen_kappa_pairs'] = len(pair_kappas)
+
+    bias, shared = evaluator_bias(units)
+    rated = units > 0
+    rating_counts = rated.sum(0)
+    rating_sums = units.sum(0, dtype=np.int64)
+    paired = np.isfinite(kappa)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_kappa = np.where(paired, kappa, 0.0).sum(1) / paired.sum(1)
+    result['by_evaluator'] = [{
+        'evaluator': array.evaluators[i],
+        'count': int(rating_counts[i]),
+        'mean': _number(rating_sums[i] / rating_counts[i]) if rating_counts[i] else None,
+        'bias': _number(bias[i]),
+        'shared_units': int(shared[i]),
+        'cohen_kappa': _number(mean_kappa[i]),
+    } for i in range(evaluators)]
+
+    # Per-example sums and counts feed both the point estimates and the bootstrap
+    example_sums = array.ratings.sum(2, dtype=np.int64)     # (examples, models)
+    example_counts = (array.ratings > 0).sum(2)
+    groups, labels = [], []
+    for model in range(models):
+        rated_examples = example_counts[:, model] > 0
+        if rated_examples.any():
+            groups.append((example_sums[rated_examples, model], example_counts[rated_examples, model]))
+            labels.append((None, model))
+    for category in range(len(array.categories)):
+        in_category = array.example_categories == category
+        for model in range(models):
+            rated_examples = in_category & (example_counts[:, model] > 0)
+            if rated_examples.any():
+                groups.append((example_sums[rated_examples, model], example_counts[rated_examples, model]))
+                labels.append((category, model))
+    intervals = bootstrap_intervals(groups, reps, confidence, workers) if groups else []
+
+    result['by_model'], result['by_category_model'] = [], []
+    for (category, model), (sums, group_counts), (low, high) in zip(labels, groups, intervals):
+        entry = {
+            'model_name': array.models[model],
+            'count': int(group_counts.sum()),
+            'examples': len(sums),
+            'mean': _number(sums.sum() / group_counts.sum()),
+            'ci_low': _number(low),
+            'ci_high': _number(high),
+        }
+        if category is None:
+            entry['alpha_interval'] = _number(krippendorff_alpha(counts[unit_models == model]))
+            result['by_model'].append(entry)
+        else:
+            entry['category'] = array.categories[category]
+            result['by_category_model'].append(entry)
+
+    result['by_category'] = [{
+        'category': name,
+        'units': int((multi_rated & (unit_categories == category)).sum()),
+        'alpha_interval': _number(krippendorff_alpha(counts[unit_categories == category])),
+        'fleiss_kappa': _number(fleiss_kappa(counts[unit_categories == category])),
+    } for category, name in enumerate(array.categories)]
+
+    result['elapsed'] = round(time.perf_counter() - start, 3)
+    return result
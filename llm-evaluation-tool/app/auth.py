@@ -19,7 +19,7 @@ def admin_required(f):
             flash('로그인이 필요합니다.', 'error')
             return redirect(url_for('main.login'))
 
-        user = current_app.db.get_user_by_id(session['user_id'])
+        user = current_app.db.get_user_identity(session['user_id'])
         if not user or user['role'] != 'admin':
             flash('관리자 권한이 필요합니다.', 'error')
             return redirect(url_for('main.select_category'))
@@ -0,0 +1,218 @@
+"""
+Content-addressed, compressed storage for example text
+
+History turn contents and response outputs are stored once per distinct text
+in the `blobs` table, compressed with zstd (if the optional `zstandard`
+package is installed) or zlib. The examples' history/responses JSON keeps the
+structure and references each text by blob id under an '@'-prefixed key, e.g.
+{"role": "user", "@content": 12, "@content_html": 13}.
+"""
+import hashlib
+import json
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# (example list, text fields stored as blobs)
+BLOB_FIELDS = (('history', ('content', 'content_html')), ('responses', ('output', 'output_html')))
+
+# Texts shorter than this are stored uncompressed
+MIN_COMPRESS_SIZE = 64
+
+# Bound on host parameters per IN (...) lookup
+LOOKUP_CHUNK = 500
+
+
+def resolve_codec(codec):
+    """Map 'auto' to the best available codec"""
+    if codec == 'auto':
+        return 'zstd' if zstandard else 'zlib'
+    if codec == 'zstd' and zstandard is None:
+        raise ValueError('zstd compression requires the zstandard package')
+    if codec not in ('zstd', 'zlib', 'raw'):
+        raise ValueError(f'unknown blob codec: {codec}')
+    return codec
+
+
+def compress(text, codec, level=None):
+    """Encode a text; returns (codec actually used, data)"""
+    raw = text.encode('utf-8')
+    if codec == 'raw' or len(raw) < MIN_COMPRESS_SIZE:
+        return 'raw', raw
+    if codec == 'zstd':
+        data = zstandard.ZstdCompressor(level=level or 3).compress(raw)
+    else:
+        data = zlib.compress(raw, level or 6)
+    # Incompressible text is kept as is
+    return (codec, data) if len(data) < len(raw) else ('raw', raw)
+
+
+def decompress(codec, data):
+    """Decode a stored blob to text"""
+    if codec == 'zstd':
+        data = zstandard.ZstdDecompressor().decompress(data)
+    elif codec == 'zlib':
+        data = zlib.decompress(data)
+    return bytes(data).decode('utf-8')
+
+
+def _is_ref(key, fields):
+    """Whether a stored entry key is a blob reference for one of `fields`"""
+    return key.startswith('@') and key[1:] in fields
+
+
+def _chunks(values, size=LOOKUP_CHUNK):
+    """Split a list into lists of at most `size` items"""
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def _texts(examples):
+    """Yield (digest, text) for every blob-stored text of a batch of examples, in pack order"""
+    for example in examples:
+        for key, fields in BLOB_FIELDS:
+            for entry in example[key]:
+                for k, v in entry.items():
+                    if k in fields and isinstance(v, str):
+                        yield hashlib.sha256(v.encode('utf-8')).digest(), v
+
+
+def compress_texts(examples, codec='auto', level=None):
+    """Compress a batch's texts ahead of BlobWriter.pack; returns {digest: (codec, data)}
+
+    Touches no database, so loaders can do the CPU-heavy part before taking
+    the write lock.
+    """
+    codec = resolve_codec(codec)
+    return {digest: compress(text, codec, level) for digest, text in _texts(examples)}
+
+
+class BlobWriter:
+    """Stores example texts for one write transaction, deduplicating by hash"""
+
+    def __init__(self, conn, codec='auto', level=None):
+        self.conn = conn
+        self.codec = resolve_codec(codec)
+        self.level = level
+        self._ids = {}
+
+    def _store(self, texts, compressed):
+        """Ensure every {digest: text} is stored and its id known"""
+        missing = [digest for digest in texts if digest not in self._ids]
+        for chunk in _chunks(missing):
+            rows = self.conn.execute(
+                f'SELECT id, hash FROM blobs WHERE hash IN ({", ".join("?" * len(chunk))})', chunk)
+            self._ids.update((bytes(row['hash']), row['id']) for row in rows)
+
+        new = [digest for digest in missing if digest not in self._ids]
+        for digest in new:
+            codec, data = compressed.get(digest) or compress(texts[digest], self.codec, self.level)
+            cursor = self.conn.execute(
+                'INSERT INTO blobs (hash, codec, size, data) VALUES (?, ?, ?, ?)',
+                (digest, codec, len(texts[digest].encode('utf-8')), data)
+            )
+            self._ids[digest] = cursor.lastrowid
+
+    def pack(self, examples, compressed=None):
+        """Replace texts by blob references in a batch of {'history', 'responses'} dicts
+
+        `compressed` may hold compress_texts output for the batch. Returns a
+        (history JSON, responses JSON) pair per example.
+        """
+        texts = {}
+        digests = []
+        for digest, text in _texts(examples):
+            texts[digest] = text
+            digests.append(digest)
+        self._store(texts, compressed or {})
+
+        refs = iter(digests)
+        packed = []
+        for example in examples:
+            columns = []
+            for key, fields in BLOB_FIELDS:
+                entries = [
+                    {('@' + k if k in fields and isinstance(v, str) else k):
+                     (self._ids[next(refs)] if k in fields and isinstance(v, str) else v)
+                     for k, v in entry.items()}
+                    for entry in example[key]
+                ]
+                columns.append(json.dumps(entries, ensure_ascii=False))
+            packed.append(tuple(columns))
+        return packed
+
+
+def unpack(conn, examples):
+    """Parse examples' history/responses JSON in place, resolving blob references"""
+    refs = set()
+    for example in examples:
+        for key, fields in BLOB_FIELDS:
+            example[key] = json.loads(example[key])
+            refs.update(v for entry in example[key] for k, v in entry.items() if _is_ref(k, fields))
+
+    texts = {}
+    for chunk in _chunks(list(refs)):
+        rows = conn.execute(
+            f'SELECT id, codec, data FROM blobs WHERE id IN ({", ".join("?" * len(chunk))})', chunk)
+        texts.update((row['id'], decompress(row['codec'], row['data'])) for row in rows)
+
+    for example in examples:
+        for key, fields in BLOB_FIELDS:
+            example[key] = [
+                {(k[1:] if _is_ref(k, fields) else k): (texts[v] if _is_ref(k, fields) else v)
+                 for k, v in entry.items()}
+                for entry in example[key]
+            ]
+    return examples
+
+
+def report(conn):
+    """Summarize example text storage: logical, deduplicated and stored bytes"""
+    sizes = {row['id']: row['size'] for row in conn.execute('SELECT id, size FROM blobs')}
+    summary = conn.execute('''
+        SELECT COUNT(*) AS blobs, COALESCE(SUM(size), 0) AS unique_bytes,
+               COALESCE(SUM(length(data)), 0) AS stored_bytes
+        FROM blobs
+    ''').fetchone()
+
+    references = 0
+    logical_bytes = 0
+    structure_bytes = 0
+    for row in conn.execute('SELECT history, responses FROM examples'):
+        for (_, fields), column in zip(BLOB_FIELDS, (row['history'], row['responses'])):
+            structure_bytes += len(column.encode('utf-8'))
+            for entry in json.loads(column):
+                for k, v in entry.items():
+                    if _is_ref(k, fields):
+                        references += 1
+                        logical_bytes += sizes[v]
+
+    page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+    return {
+        'references': references,
+        'blobs': summary['blobs'],
+        'logical_bytes': logical_bytes,
+        'unique_bytes': summary['unique_bytes'],
+        'stored_bytes': summary['stored_bytes'],
+        'structure_bytes': structure_bytes,
+        'file_bytes': conn.execute('PRAGMA page_count').fetchone()[0] * page_size,
+        'free_bytes': conn.execute('PRAGMA freelist_count').fetchone()[0] * page_size,
+        'codecs': dict(conn.execute('SELECT codec, COUNT(*) FROM blobs GROUP BY codec').fetchall())
+    }
+
+
+def collect_garbage(conn):
+    """Delete blobs that no example row references; returns the number deleted"""
+    referenced = set()
+    for row in conn.execute('SELECT history, responses FROM examples'):
+        for (_, fields), column in zip(BLOB_FIELDS, (row['history'], row['responses'])):
+            for entry in json.loads(column):
+                referenced.update(v for k, v in entry.items() if _is_ref(k, fields))
+
+    unreferenced = [row['id'] for row in conn.execute('SELECT id FROM blobs') if row['id'] not in referenced]
+    for chunk in _chunks(unreferenced):
+        conn.execute(f'DELETE FROM blobs WHERE id IN ({", ".join("?" * len(chunk))})', chunk)
+    return len(unreferenced)
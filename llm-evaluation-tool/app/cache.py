@@ -0,0 +1,116 @@
+"""
+In-process caches
+"""
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Thread-safe, size-bounded cache whose entries expire after `ttl` seconds
+
+    Entries are evicted least-recently-set first once `maxsize` is reached.
+    Each worker process has its own cache, so `ttl` bounds how long a change
+    made through another process can go unseen.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return a live entry or `default`"""
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                return default
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return default
+            return value
+
+    def set(self, key, value):
+        """Store an entry, evicting the oldest one if full"""
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        """Invalidate an entry"""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Invalidate every entry"""
+        with self._lock:
+            self._data.clear()
+
+
+class LRUCache:
+    """Thread-safe, size-bounded least-recently-used cache with hit/miss counters
+
+    Entries are tagged with the generation of the data they were built from.
+    `advance` moves the cache to a newer generation and drops older entries,
+    and an entry built from any other generation is neither stored nor served,
+    so a reader that raced a data change cannot put a stale entry back.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.generation = None
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def advance(self, generation):
+        """Move to `generation` if it is newer, dropping every entry"""
+        with self._lock:
+            if self.generation is None or generation > self.generation:
+                self._data.clear()
+                self.generation = generation
+
+    def get(self, key, default=None, generation=None):
+        """Return an entry of `generation` and mark it recently used, or `default`"""
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING or entry[0] != generation:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, generation=None):
+        """Store an entry built from `generation` unless the cache has moved on, evicting the least recently used one if full"""
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._data[key] = (generation, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        """Drop every entry (counters are kept)"""
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """Return size and hit/miss counters"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
@@ -0,0 +1,191 @@
+"""
+Columnar rating exports
+
+Ratings are written as typed columns for dataframe tools: Arrow IPC files
+(memory-mappable) and Parquet when pyarrow is installed, NumPy .npz as the
+fallback. Category, model, evaluator and source hash are dictionary-encoded
+(int32 codes plus the distinct strings), ratings and counts are small
+integers and timestamps are seconds, so readers skip text parsing entirely.
+
+Batches are read from the database and written one at a time. Dictionaries
+grow as new strings appear and earlier codes never change: Arrow writes the
+additions as dictionary deltas, Parquet stores a dictionary per row group, and
+the .npz archive stores each full dictionary once after the columns.
+"""
+import os
+import shutil
+import tempfile
+import zipfile
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pa = None
+
+BATCH_SIZE = 65536
+
+BUFFER_SIZE = 1024 * 1024
+
+COLUMNAR_FORMATS = {
+    'arrow': ('application/vnd.apache.arrow.file', 'arrow'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'npz': ('application/octet-stream', 'npz'),
+}
+
+# (name, type) in the order of the rows read by Database.iter_rating_batches;
+# 'dictionary' columns hold strings, 'timestamp' columns seconds since the epoch
+COLUMNS = [
+    ('rating_id', 'int64'),
+    ('example_id', 'int64'),
+    ('category', 'dictionary'),
+    ('model', 'dictionary'),
+    ('evaluator_id', 'dictionary'),
+    ('rating', 'int8'),
+    ('timestamp', 'timestamp'),
+]
+
+# Example metadata appended when the export joins examples
+METADATA_COLUMNS = [
+    ('source_hash', 'dictionary'),
+    ('num_responses', 'int16'),
+    ('history_turns', 'int16'),
+]
+
+
+def available(format):
+    """Whether the libraries needed to write a columnar format are installed"""
+    if format == 'npz':
+        return np is not None
+    return pa is not None and np is not None
+
+
+def columns(metadata=False):
+    """Exported columns, with the example metadata columns when `metadata` is set"""
+    return COLUMNS + METADATA_COLUMNS if metadata else COLUMNS
+
+
+class Dictionary:
+    """Strings of a dictionary-encoded column in first-seen order; codes never change"""
+
+    def __init__(self):
+        self.codes = {}
+        self.values = []
+
+    def _add(self, value):
+        """Append a new string and return its code"""
+        code = self.codes[value] = len(self.values)
+        self.values.append(value)
+        return code
+
+    def encode(self, values):
+        """int32 codes of a batch of strings"""
+        codes = self.codes
+        return np.fromiter(
+            (codes[value] if value in codes else self._add(value) for value in values),
+            dtype=np.int32, count=len(values)
+        )
+
+
+def _numpy_type(type):
+    """NumPy dtype of a column's values (codes for dictionary columns)"""
+    return {'dictionary': np.int32, 'timestamp': 'datetime64[s]'}.get(type, type)
+
+
+def _encode(spec, dictionaries, rows):
+    """Convert a batch of rows to one NumPy array per column"""
+    arrays = []
+    for (name, type), values in zip(spec, zip(*rows)):
+        if type == 'dictionary':
+            arrays.append(dictionaries[name].encode(values))
+        elif type == 'timestamp':
+            arrays.append(np.fromiter(values, dtype=np.int64, count=len(values)).view('datetime64[s]'))
+        else:
+            arrays.append(np.fromiter(values, dtype=type, count=len(values)))
+    return arrays
+
+
+def _arrow_schema(spec):
+    """Arrow schema of the exported columns"""
+    types = {
+        'dictionary': pa.dictionary(pa.int32(), pa.string()),
+        'timestamp': pa.timestamp('s'),
+    }
+    return pa.schema([(name, types.get(type) or pa.from_numpy_dtype(np.dtype(type))) for name, type in spec])
+
+
+def _arrow_batch(schema, spec, dictionaries, arrays):
+    """Arrow record batch of encoded column arrays"""
+    columns = []
+    for (name, type), array in zip(spec, arrays):
+        if type == 'dictionary':
+            array = pa.DictionaryArray.from_arrays(array, pa.array(dictionaries[name].values, pa.string()))
+        columns.append(array)
+    return pa.record_batch(columns, schema=schema)
+
+
+def _write_arrow(path, format, spec, batches):
+    """Write Arrow IPC or Parquet through pyarrow; returns the number of rows"""
+    schema = _arrow_schema(spec)
+    dictionaries = {name: Dictionary() for name, type in spec if type == 'dictionary'}
+    if format == 'arrow':
+        # Uncompressed so readers can memory-map the file
+        writer = pa.ipc.new_file(path, schema, options=pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True))
+    else:
+        writer = pa.parquet.ParquetWriter(path, schema, compression='zstd')
+    rows = 0
+    with writer:
+        for batch in batches:
+            writer.write_batch(_arrow_batch(schema, spec, dictionaries, _encode(spec, dictionaries, batch)))
+            rows += len(batch)
+    return rows
+
+
+def _write_npz(path, spec, batches):
+    """Write an uncompressed .npz archive; returns the number of rows
+
+    Each column is spooled to a temporary file as raw values and copied into
+    the archive behind a .npy header once the row count is known. Dictionary
+    columns hold int32 codes into `<name>_values`.
+    """
+    dictionaries = {name: Dictionary() for name, type in spec if type == 'dictionary'}
+    directory = os.path.dirname(os.path.abspath(path))
+    spools = [tempfile.TemporaryFile(dir=directory) for _ in spec]
+    rows = 0
+    try:
+        for batch in batches:
+            for spool, array in zip(spools, _encode(spec, dictionaries, batch)):
+                spool.write(array.tobytes())
+            rows += len(batch)
+
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED, allowZip64=True) as archive:
+            for (name, type), spool in zip(spec, spools):
+                spool.seek(0)
+                with archive.open(f'{name}.npy', 'w', force_zip64=True) as member:
+                    np.lib.format.write_array_header_1_0(member, {
+                        'descr': np.lib.format.dtype_to_descr(np.dtype(_numpy_type(type))),
+                        'fortran_order': False,
+                        'shape': (rows,),
+                    })
+                    shutil.copyfileobj(spool, member, BUFFER_SIZE)
+            for name, dictionary in dictionaries.items():
+                with archive.open(f'{name}_values.npy', 'w', force_zip64=True) as member:
+                    np.lib.format.write_array(member, np.array(dictionary.values, dtype=str))
+    finally:
+        for spool in spools:
+            spool.close()
+    return rows
+
+
+def write_ratings(path, format, batches, metadata=False):
+    """Write batches of rating rows to `path` in a columnar format; returns the number of rows"""
+    spec = columns(metadata)
+    if format == 'npz':
+        return _write_npz(path, spec, batches)
+    return _write_arrow(path, format, spec, batches)
@@ -0,0 +1,180 @@
+"""
+Versioned datasets
+
+Every dataset load builds a new version next to the one being served. Example
+contents are stored in `examples` (rows are immutable; a row is reused when the
+active version already holds identical content) and each version lists its
+examples in the `dataset_examples` manifest. Nothing reads a version until it
+is activated by swapping the `active_dataset` pointer in `meta`, so evaluators
+keep reading the previous version for the whole build and see the new one at
+once.
+
+Ratings are tied to the content they were given for by (example_id,
+source_hash): a rating counts in every version that contains that example
+unchanged, and ratings of content that later changed or disappeared remain
+queryable through the older versions.
+"""
+from datetime import datetime
+
+# Scalar subquery for the active version; SQLite evaluates it once per statement
+ACTIVE_VERSION = "(SELECT value FROM meta WHERE key = 'active_dataset')"
+
+
+def rating_in(rating='r', version=ACTIVE_VERSION):
+    """Join condition matching a version's manifest row `m` to the content a rating was given for"""
+    return (f'm.version = {version} AND m.example_id = {rating}.example_id '
+            f'AND m.source_hash = {rating}.source_hash')
+
+
+# Manifest row `m` of the active version for rating `r`
+ACTIVE_RATING = rating_in()
+
+
+def _now():
+    """Timestamp in the format used by every table"""
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def active_version(conn):
+    """The active version (0 before the first dataset is loaded)"""
+    return conn.execute("SELECT value FROM meta WHERE key = 'active_dataset'").fetchone()[0]
+
+
+def begin(conn, source=None):
+    """Register a version being built; returns its number"""
+    cursor = conn.execute(
+        "INSERT INTO datasets (status, source, created_at) VALUES ('building', ?, ?)",
+        (source, _now())
+    )
+    return cursor.lastrowid
+
+
+def current_rows(conn, version, example_ids):
+    """Map example ids to (examples.id, content_hash) of their content in a version"""
+    rows = {}
+    for i in range(0, len(example_ids), 500):
+        chunk = example_ids[i:i + 500]
+        rows.update(
+            (row['example_id'], (row['id'], row['content_hash'])) for row in conn.execute(f'''
+                SELECT m.example_id, e.id, e.content_hash
+                FROM dataset_examples m
+                JOIN examples e ON e.id = m.example_row
+                WHERE m.version = ? AND m.example_id IN ({", ".join("?" * len(chunk))})
+            ''', (version, *chunk))
+        )
+    return rows
+
+
+def finish(conn, version, examples, changed):
+    """Mark a built version ready to be activated"""
+    conn.execute(
+        "UPDATE datasets SET status = 'ready', examples = ?, changed = ? WHERE version = ?",
+        (examples, changed, version)
+    )
+
+
+def fail(conn, version):
+    """Mark a version whose build was aborted and drop what it wrote"""
+    _delete_rows(conn, version)
+    conn.execute("UPDATE datasets SET status = 'failed' WHERE version = ?", (version,))
+
+
+def abandon(conn, source):
+    """Fail the versions of `source` still marked as building; returns their numbers"""
+    versions = [row['version'] for row in conn.execute(
+        "SELECT version FROM datasets WHERE status = 'building' AND source = ?", (source,)
+    )]
+    for version in versions:
+        fail(conn, version)
+    return versions
+
+
+def last_load(conn, source):
+    """The newest ready version loaded from `source` with its file fingerprint (None if there is none)"""
+    row = conn.execute('''
+        SELECT version, examples, file_size, file_mtime_ns, file_hash
+        FROM datasets
+        WHERE source = ? AND status = 'ready'
+        ORDER BY version DESC
+        LIMIT 1
+    ''', (source,)).fetchone()
+    return dict(row) if row else None
+
+
+def record_file(conn, version, size, mtime_ns, digest):
+    """Record the size, mtime and SHA-256 of the file a version was loaded from"""
+    conn.execute(
+        'UPDATE datasets SET file_size = ?, file_mtime_ns = ?, file_hash = ? WHERE version = ?',
+        (size, mtime_ns, digest, version)
+    )
+
+
+def touch(conn, version, size, mtime_ns):
+    """Record the current size and mtime of a version's file whose content is unchanged"""
+    conn.execute('UPDATE datasets SET file_size = ?, file_mtime_ns = ? WHERE version = ?', (size, mtime_ns, version))
+
+
+def status(conn, version):
+    """A version's status (None if it does not exist)"""
+    row = conn.execute('SELECT status FROM datasets WHERE version = ?', (version,)).fetchone()
+    return row['status'] if row else None
+
+
+def diff(conn, old, new):
+    """Contents in version `old` but not in `new`, as (example_id, source_hash, category) rows"""
+    return conn.execute('''
+        SELECT o.example_id, o.source_hash, o.category
+        FROM dataset_examples o
+        WHERE o.version = ? AND NOT EXISTS (
+            SELECT 1 FROM dataset_examples n
+            WHERE n.version = ? AND n.example_id = o.example_id AND n.source_hash = o.source_hash
+        )
+    ''', (old, new)).fetchall()
+
+
+def ratings_of(conn, contents):
+    """(user_id, example_id, model_name, rating, category) of every rating of the given contents"""
+    ratings = []
+    for content in contents:
+        ratings.extend(
+            (row['user_id'], content['example_id'], row['model_name'], row['rating'], content['category'])
+            for row in conn.execute(
+                'SELECT user_id, model_name, rating FROM ratings WHERE example_id = ? AND source_hash = ?',
+                (content['example_id'], content['source_hash'])
+            )
+        )
+    return ratings
+
+
+def activate(conn, version):
+    """Point the active version at `version` and invalidate cached examples"""
+    conn.execute("UPDATE meta SET value = ? WHERE key = 'active_dataset'", (version,))
+    conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'dataset_generation'")
+    conn.execute('UPDATE datasets SET activated_at = ? WHERE version = ?', (_now(), version))
+
+
+def _delete_rows(conn, version):
+    """Delete a version's manifest and the example rows no other version uses"""
+    conn.execute('''
+        DELETE FROM examples
+        WHERE id IN (SELECT example_row FROM dataset_examples WHERE version = ?)
+          AND NOT EXISTS (
+              SELECT 1 FROM dataset_examples o WHERE o.example_row = examples.id AND o.version != ?
+          )
+    ''', (version, version))
+    conn.execute('DELETE FROM dataset_examples WHERE version = ?', (version,))
+
+
+def drop(conn, version):
+    """Delete an inactive version with its manifest and unshared example rows"""
+    _delete_rows(conn, version)
+    conn.execute('DELETE FROM datasets WHERE version = ?', (version,))
+
+
+def versions(conn):
+    """All versions, newest first, with an `active` flag"""
+    active = active_version(conn)
+    return [
+        dict(row, active=row['version'] == active)
+        for row in conn.execute('SELECT * FROM datasets ORDER BY version DESC')
+    ]
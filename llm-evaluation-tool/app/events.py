@@ -0,0 +1,47 @@
+"""
+Rating event log
+
+Every rating write appends an event in the same transaction, so the log holds
+each value a rating ever had while `ratings` keeps only the current one.
+Events are numbered by an AUTOINCREMENT sequence: writes are serialized by the
+database, so sequence order is commit order and a reader never sees a gap that
+is filled later. A consumer syncs by remembering the last sequence number it
+read and asking for the events after it, which reads only the new events
+through the primary key.
+"""
+
+# Default and maximum number of events per page of the feed
+PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 10000
+
+EVENT_COLUMNS = '''
+    e.seq, e.user_id, u.username AS evaluator_username, e.example_id, e.category,
+    e.source_hash, e.model_name, e.rating, e.previous_rating, e.timestamp
+'''
+
+
+def append(conn, user_id, example_id, category, source_hash, model_name, rating, previous_rating, timestamp):
+    """Record a rating write; returns its sequence number"""
+    cursor = conn.execute('''
+        INSERT INTO rating_events
+            (user_id, example_id, category, source_hash, model_name, rating, previous_rating, timestamp)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (user_id, example_id, category, source_hash, model_name, rating, previous_rating, timestamp))
+    return cursor.lastrowid
+
+
+def after(conn, seq, limit):
+    """Up to `limit` events with a sequence number above `seq`, in sequence order"""
+    return conn.execute(f'''
+        SELECT {EVENT_COLUMNS}
+        FROM rating_events e
+        CROSS JOIN users u ON u.id = e.user_id
+        WHERE e.seq > ?
+        ORDER BY e.seq
+        LIMIT ?
+    ''', (seq, limit)).fetchall()
+
+
+def last_seq(conn):
+    """Sequence number of the newest event (0 before the first)"""
+    return conn.execute('SELECT COALESCE(MAX(seq), 0) FROM rating_events').fetchone()[0]
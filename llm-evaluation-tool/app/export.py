@@ -0,0 +1,125 @@
+"""
+Streaming rating exports
+
+Every format is produced by a generator that consumes ratings one at a time and
+emits encoded chunks, so memory use does not grow with the number of ratings.
+"""
+import csv
+import json
+import zlib
+
+BUFFER_SIZE = 64 * 1024
+
+EXPORT_FIELDS = ['example_id', 'category', 'model', 'evaluator_id', 'rating', 'timestamp']
+
+EVENT_FIELDS = ['seq', 'example_id', 'category', 'source_hash', 'model', 'evaluator_id',
+                'rating', 'previous_rating', 'timestamp']
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'json': ('application/json', 'json'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+}
+
+
+class _Echo:
+    """File-like object whose write() returns the line instead of storing it"""
+
+    def write(self, value):
+        return value
+
+
+def export_record(rating):
+    """Map a joined rating row to the public export fields"""
+    return {
+        'example_id': rating['example_id'],
+        'category': rating['category'],
+        'model': rating['model_name'],
+        'evaluator_id': rating['evaluator_username'],
+        'rating': rating['rating'],
+        'timestamp': rating['timestamp']
+    }
+
+
+def event_record(event):
+    """Map a rating event row to the public event fields"""
+    return {
+        'seq': event['seq'],
+        'example_id': event['example_id'],
+        'category': event['category'],
+        'source_hash': event['source_hash'],
+        'model': event['model_name'],
+        'evaluator_id': event['evaluator_username'],
+        'rating': event['rating'],
+        'previous_rating': event['previous_rating'],
+        'timestamp': event['timestamp']
+    }
+
+
+def iter_csv(ratings):
+    """Yield CSV text, starting with a UTF-8 BOM for Excel"""
+    writer = csv.writer(_Echo())
+    yield '\ufeff' + writer.writerow(EXPORT_FIELDS)
+    for rating in ratings:
+        record = export_record(rating)
+        yield writer.writerow([record[field] for field in EXPORT_FIELDS])
+
+
+def iter_json(ratings):
+    """Yield a JSON array with one record per line"""
+    yield '['
+    separator = '\n  '
+    for rating in ratings:
+        yield separator + json.dumps(export_record(rating), ensure_ascii=False)
+        separator = ',\n  '
+    yield '\n]\n'
+
+
+def iter_ndjson(ratings):
+    """Yield newline-delimited JSON records"""
+    for rating in ratings:
+        yield json.dumps(export_record(rating), ensure_ascii=False) + '\n'
+
+
+def iter_event_ndjson(events):
+    """Yield newline-delimited JSON rating events"""
+    for event in events:
+        yield json.dumps(event_record(event), ensure_ascii=False) + '\n'
+
+
+def buffered(pieces, size=BUFFER_SIZE):
+    """Join small text pieces into UTF-8 encoded chunks of roughly `size` bytes"""
+    buf = []
+    length = 0
+    for piece in pieces:
+        buf.append(piece)
+        length += len(piece)
+        if length >= size:
+            yield ''.join(buf).encode('utf-8')
+            buf = []
+            length = 0
+    if buf:
+        yield ''.join(buf).encode('utf-8')
+
+
+def gzipped(chunks, level=6):
+    """Compress a byte stream into gzip format on the fly"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_ratings(ratings, format, compress=False):
+    """Stream ratings in the given export format as bytes"""
+    writers = {'csv': iter_csv, 'json': iter_json, 'ndjson': iter_ndjson}
+    chunks = buffered(writers[format](ratings))
+    return gzipped(chunks) if compress else chunks
+
+
+def stream_events(events, compress=False):
+    """Stream rating events as NDJSON bytes"""
+    chunks = buffered(iter_event_ndjson(events))
+    return gzipped(chunks) if compress else chunks
@@ -0,0 +1,244 @@
+"""
+Streaming dataset ingestion
+
+Datasets are parsed incrementally from a JSON array or NDJSON file, so memory
+use is bounded by the largest single example rather than the whole file.
+
+Every load records the file's size, mtime and SHA-256 with the version it
+built. At startup the configured file is only loaded again if it differs from
+its last successful load: a matching size and mtime skip it without reading
+the file, and a matching hash skips it after one sequential read.
+"""
+import hashlib
+import json
+import os
+import re
+import time
+from app.render import RENDER_FIELDS
+
+CHUNK_SIZE = 64 * 1024
+HASH_CHUNK_SIZE = 1024 * 1024
+BATCH_SIZE = 1000
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_decoder = json.JSONDecoder()
+
+
+class DatasetError(ValueError):
+    """Raised when a dataset is malformed or an item fails validation"""
+
+
+class _StreamReader:
+    """Incremental JSON value reader over a text file"""
+
+    def __init__(self, f, chunk_size):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def more(self, size=None):
+        """Append the next chunk to the buffer, dropping consumed text"""
+        data = self.f.read(size or self.chunk_size)
+        if not data:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Return the next non-whitespace character ('' at end of file)"""
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.more():
+                return ''
+
+    def decode(self):
+        """Decode the next JSON value, reading more input until it is complete"""
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                # Grow geometrically so one huge example is not re-parsed per chunk
+                if not self.more(max(self.chunk_size, len(self.buf) - self.pos)):
+                    raise
+                continue
+
+            # A scalar ending at the buffer edge may have been cut short
+            if end == len(self.buf) and not isinstance(value, (dict, list)) and self.more():
+                continue
+
+            self.pos = end
+            return value
+
+
+def iter_json_items(f, chunk_size=CHUNK_SIZE):
+    """Yield items from a JSON array or NDJSON stream one at a time"""
+    reader = _StreamReader(f, chunk_size)
+    first = reader.peek()
+
+    if first == '{':
+        # NDJSON (or concatenated objects)
+        while reader.peek():
+            yield reader.decode()
+        return
+
+    if first != '[':
+        raise DatasetError('데이터셋은 배열 또는 NDJSON 형식이어야 합니다.')
+
+    reader.pos += 1
+    if reader.peek() == ']':
+        reader.pos += 1
+    else:
+        while True:
+            yield reader.decode()
+            separator = reader.peek()
+            reader.pos += 1
+            if separator == ']':
+                break
+            if separator != ',':
+                raise DatasetError('데이터셋 배열 형식이 올바르지 않습니다.')
+
+    if reader.peek():
+        raise DatasetError('데이터셋 배열 뒤에 잘못된 내용이 있습니다.')
+
+
+def iter_dataset(path, chunk_size=CHUNK_SIZE):
+    """Yield items from a dataset file"""
+    with open(path, 'r', encoding='utf-8') as f:
+        yield from iter_json_items(f, chunk_size)
+
+
+def validate_item(i, item):
+    """Validate a single dataset item, raising DatasetError on the first problem"""
+    if not isinstance(item, dict):
+        raise DatasetError(f'항목 {i}: 객체 형식이어야 합니다.')
+
+    # Check required fields
+    required_fields = ['category', 'history', 'example_id', 'responses']
+    for field in required_fields:
+        if field not in item:
+            raise DatasetError(f'항목 {i}: 필수 필드 "{field}"가 누락되었습니다.')
+
+    # Validate history
+    if not isinstance(item['history'], list):
+        raise DatasetError(f'항목 {i}: history는 배열이어야 합니다.')
+
+    for turn in item['history']:
+        if 'role' not in turn or 'content' not in turn:
+            raise DatasetError(f'항목 {i}: history의 각 항목은 role과 content를 포함해야 합니다.')
+
+    # Validate responses
+    if not isinstance(item['responses'], list) or len(item['responses']) == 0:
+        raise DatasetError(f'항목 {i}: responses는 비어있지 않은 배열이어야 합니다.')
+
+    for response in item['responses']:
+        if 'model' not in response or 'output' not in response:
+            raise DatasetError(f'항목 {i}: 각 response는 model과 output을 포함해야 합니다.')
+
+
+def validated(items):
+    """Validate items as they stream past"""
+    for i, item in enumerate(items):
+        validate_item(i, item)
+        yield item
+
+
+def content_hash(category, history, responses):
+    """Hash an example's serialized content; used for ETags and change detection"""
+    digest = hashlib.sha256()
+    for part in (category, history, responses):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()[:32]
+
+
+def serialize_example(item):
+    """Serialize a validated item to an examples row (without the surrogate id)"""
+    history = json.dumps(item['history'], ensure_ascii=False)
+    responses = json.dumps(item['responses'], ensure_ascii=False)
+    return (
+        item['example_id'],
+        item['category'],
+        history,
+        responses,
+        len(item['responses']),
+        content_hash(item['category'], history, responses)
+    )
+
+
+def source_hash(item, digest=None):
+    """Hash an item's dataset content, ignoring pre-rendered HTML
+
+    Identifies an example's content across dataset versions whether or not it
+    was rendered. `digest` (the item's content_hash) is reused when the item
+    carries no rendered HTML.
+    """
+    source = dict(item)
+    rendered = False
+    for key, _, html_field in RENDER_FIELDS:
+        if any(html_field in entry for entry in item[key]):
+            source[key] = [{k: v for k, v in entry.items() if k != html_field} for entry in item[key]]
+            rendered = True
+    if digest and not rendered:
+        return digest
+    return serialize_example(source)[5]
+
+
+def file_hash(path):
+    """SHA-256 of a file's bytes"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_fingerprint(path):
+    """(size, mtime_ns, sha256) identifying a dataset file's content"""
+    # Stat first: if the file changes while it is hashed, the next check sees a new mtime
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns, file_hash(path)
+
+
+def load_dataset_file(db, path, batch_size=BATCH_SIZE, progress=None, fingerprint=None):
+    """Stream, validate and load a dataset file; returns (count, seconds)"""
+    start = time.perf_counter()
+
+    def report(count):
+        if progress:
+            progress(count, time.perf_counter() - start)
+
+    count = db.load_dataset(validated(iter_dataset(path)), batch_size=batch_size, progress=report,
+                            source=os.path.abspath(path), fingerprint=fingerprint or file_fingerprint(path))
+    return count, time.perf_counter() - start
+
+
+def sync_dataset_file(db, path, batch_size=BATCH_SIZE, progress=None):
+    """Load a dataset file unless its content matches its last successful load
+
+    Returns (count, seconds, version): `version` is the dataset version the
+    unchanged file was loaded into, or None when the file was loaded now.
+    """
+    start = time.perf_counter()
+    last = db.get_dataset_fingerprint(os.path.abspath(path))
+    if last is not None:
+        stat = os.stat(path)
+        if (stat.st_size, stat.st_mtime_ns) == (last['file_size'], last['file_mtime_ns']):
+            return last['examples'], time.perf_counter() - start, last['version']
+        if stat.st_size == last['file_size']:
+            digest = file_hash(path)
+            if digest == last['file_hash']:
+                # Same content with a new mtime (e.g. copied into a new image)
+                db.touch_dataset_fingerprint(last['version'], stat.st_size, stat.st_mtime_ns)
+                return last['examples'], time.perf_counter() - start, last['version']
+            count, _ = load_dataset_file(db, path, batch_size, progress, (stat.st_size, stat.st_mtime_ns, digest))
+            return count, time.perf_counter() - start, None
+
+    count, _ = load_dataset_file(db, path, batch_size, progress)
+    return count, time.perf_counter() - start, None
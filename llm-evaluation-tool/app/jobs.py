@@ -0,0 +1,445 @@
+"""
+Background jobs
+
+Dataset loads and rating exports run as jobs rather than inside the HTTP
+request that asked for them. A job is a row in the `jobs` table, so it
+outlives the process that queued it: every server process (and `manage.py
+worker`) runs a JobRunner whose threads claim queued jobs, report progress and
+heartbeat while they run. A process that stops cleanly puts its running jobs
+back in the queue; the jobs of one that died are queued again once their
+heartbeat goes stale, up to a retry limit.
+
+Cancellation is a flag the running job sees the next time it reports
+progress. Exports are written to the artifact directory and downloaded once
+the job has finished.
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from app import columnar
+from app.columnar import COLUMNAR_FORMATS
+from app.export import EXPORT_FORMATS, stream_ratings
+from app.ingest import load_dataset_file
+
+logger = logging.getLogger(__name__)
+
+FINISHED = ('succeeded', 'failed', 'cancelled')
+
+# Seconds between progress writes of a running job, between heartbeats, and
+# without a heartbeat before a running job is considered abandoned
+PROGRESS_INTERVAL = 0.5
+HEARTBEAT_INTERVAL = 10.0
+STALE_AFTER = 60.0
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+class JobCancelled(Exception):
+    """Raised inside a job when an admin cancelled it"""
+
+
+class JobInterrupted(Exception):
+    """Raised inside a job when its runner is shutting down; the job is queued again"""
+
+
+def _now(offset=0):
+    """Timestamp in the format used by every table, `offset` seconds from now"""
+    return (datetime.now() + timedelta(seconds=offset)).strftime(TIMESTAMP_FORMAT)
+
+
+def _job(row):
+    """Job row as a dict with decoded params and result"""
+    if row is None:
+        return None
+    job = dict(row)
+    job['params'] = json.loads(job['params'])
+    job['result'] = json.loads(job['result']) if job['result'] else None
+    job['cancel_requested'] = bool(job['cancel_requested'])
+    return job
+
+
+def enqueue(conn, kind, params, user_id=None):
+    """Queue a job; returns its id"""
+    cursor = conn.execute(
+        "INSERT INTO jobs (kind, params, status, created_by, created_at) VALUES (?, ?, 'queued', ?, ?)",
+        (kind, json.dumps(params, ensure_ascii=False), user_id, _now())
+    )
+    return cursor.lastrowid
+
+
+def has_queued(conn):
+    """Whether any job is waiting (read without taking the write lock)"""
+    return conn.execute("SELECT 1 FROM jobs WHERE status = 'queued' LIMIT 1").fetchone() is not None
+
+
+def claim(conn, worker, max_running):
+    """Mark the oldest queued job as running on `worker`; None if none is queued or enough are running"""
+    running = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'running'").fetchone()[0]
+    if running >= max_running:
+        return None
+    row = conn.execute("SELECT id FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1").fetchone()
+    if row is None:
+        return None
+    now = _now()
+    conn.execute('''
+        UPDATE jobs SET status = 'running', worker = ?, attempts = attempts + 1,
+                        started_at = ?, heartbeat_at = ?
+        WHERE id = ?
+    ''', (worker, now, now, row['id']))
+    return get(conn, row['id'])
+
+
+def report(conn, job_id, progress, total=None):
+    """Record a running job's progress; returns whether it was asked to cancel"""
+    conn.execute(
+        'UPDATE jobs SET progress = ?, total = COALESCE(?, total), heartbeat_at = ? WHERE id = ?',
+        (progress, total, _now(), job_id)
+    )
+    row = conn.execute('SELECT cancel_requested FROM jobs WHERE id = ?', (job_id,)).fetchone()
+    return bool(row['cancel_requested'])
+
+
+def heartbeat(conn, worker, job_ids):
+    """Refresh the heartbeat of the jobs `job_ids` still running on `worker`"""
+    conn.execute(f'''
+        UPDATE jobs SET heartbeat_at = ?
+        WHERE status = 'running' AND worker = ? AND id IN ({', '.join('?' * len(job_ids))})
+    ''', (_now(), worker, *job_ids))
+
+
+def finish(conn, job_id, status, message=None, result=None, artifact=None):
+    """Record a job's outcome"""
+    conn.execute('''
+        UPDATE jobs SET status = ?, message = ?, result = ?, artifact = ?, finished_at = ?, worker = NULL
+        WHERE id = ?
+    ''', (status, message, json.dumps(result, ensure_ascii=False) if result is not None else None,
+          artifact, _now(), job_id))
+
+
+def requeue(conn, job_id):
+    """Put a running job back in the queue (its runner is stopping)"""
+    conn.execute('''
+        UPDATE jobs SET status = 'queued', worker = NULL, progress = 0, total = NULL, attempts = attempts - 1
+        WHERE id = ? AND status = 'running'
+    ''', (job_id,))
+
+
+def stale(conn):
+    """Running jobs whose runner stopped heartbeating"""
+    return conn.execute(
+        "SELECT id, attempts, cancel_requested FROM jobs WHERE status = 'running' AND heartbeat_at < ?",
+        (_now(-STALE_AFTER),)
+    ).fetchall()
+
+
+def recover(conn, max_attempts):
+    """Requeue, fail or cancel running jobs whose runner stopped heartbeating; returns their ids"""
+    rows = stale(conn)
+    for row in rows:
+        if row['cancel_requested']:
+            finish(conn, row['id'], 'cancelled', '작업이 취소되었습니다.')
+        elif row['attempts'] >= max_attempts:
+            finish(conn, row['id'], 'failed', f'작업 프로세스가 {row["attempts"]}회 중단되었습니다.')
+        else:
+            conn.execute('''
+                UPDATE jobs SET status = 'queued', worker = NULL, progress = 0, total = NULL
+                WHERE id = ?
+            ''', (row['id'],))
+    return [row['id'] for row in rows]
+
+
+def cancel(conn, job_id):
+    """Cancel a queued job now or flag a running one; returns its prior status (None if unknown)"""
+    row = conn.execute('SELECT status FROM jobs WHERE id = ?', (job_id,)).fetchone()
+    if row is None:
+        return None
+    if row['status'] == 'queued':
+        finish(conn, job_id, 'cancelled', '작업이 취소되었습니다.')
+    elif row['status'] == 'running':
+        conn.execute('UPDATE jobs SET cancel_requested = 1 WHERE id = ?', (job_id,))
+    return row['status']
+
+
+def get(conn, job_id):
+    """A job as a dict (None if it does not exist)"""
+    return _job(conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone())
+
+
+def recent(conn, limit=20):
+    """The most recent jobs, newest first"""
+    return [_job(row) for row in conn.execute('SELECT * FROM jobs ORDER BY id DESC LIMIT ?', (limit,))]
+
+
+def delete(conn, job_id):
+    """Delete a finished job; returns it (None if unknown or not finished)"""
+    job = get(conn, job_id)
+    if job is None or job['status'] not in FINISHED:
+        return None
+    conn.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+    return job
+
+
+def expired(conn, days):
+    """Jobs finished more than `days` ago"""
+    return [_job(row) for row in conn.execute(
+        f"SELECT * FROM jobs WHERE status IN ({', '.join(repr(status) for status in FINISHED)}) "
+        'AND finished_at < ?', (_now(-days * 86400),)
+    )]
+
+
+def prune(conn, days):
+    """Delete jobs finished more than `days` ago; returns them"""
+    rows = expired(conn, days)
+    conn.executemany('DELETE FROM jobs WHERE id = ?', [(row['id'],) for row in rows])
+    return rows
+
+
+def artifact_path(directory, job):
+    """File holding a job's artifact"""
+    return os.path.join(directory, f"job_{job['id']}_{job['artifact']}")
+
+
+class JobContext:
+    """What a running job sees: its params, progress reporting and artifact files"""
+
+    def __init__(self, runner, job):
+        self.runner = runner
+        self.job = job
+        self.params = job['params']
+        self.attempts = job['attempts']
+        self._reported = 0.0
+
+    def progress(self, done, total=None, force=False):
+        """Report progress (throttled); raises JobCancelled or JobInterrupted when the job should stop"""
+        if self.runner.stopping.is_set():
+            raise JobInterrupted()
+        now = time.monotonic()
+        if not force and now - self._reported < PROGRESS_INTERVAL:
+            return
+        self._reported = now
+        if self.runner.db.report_job_progress(self.job['id'], done, total):
+            raise JobCancelled()
+
+    def artifact(self, filename):
+        """Path to write the artifact `filename` to (a temporary name until the job succeeds)"""
+        self.job['artifact'] = filename
+        return artifact_path(self.runner.artifact_dir, self.job) + '.part'
+
+
+def load_dataset_job(db, job):
+    """Stream, validate and load a dataset file into a new version and activate it"""
+    path = job.params['path']
+    if job.attempts > 1:
+        # The previous attempt's process died mid-build
+        db.abandon_dataset_builds(os.path.abspath(path))
+
+    count, elapsed = load_dataset_file(db, path, progress=lambda count, elapsed: job.progress(count))
+    return (f'{count}개의 예제가 성공적으로 로드되었습니다. ({elapsed:.1f}초, {count / max(elapsed, 1e-9):.0f}개/초)',
+            {'examples': count, 'seconds': round(elapsed, 3)})
+
+
+def export_ratings_job(db, job):
+    """Write a dataset version's ratings to an export file"""
+    format = job.params['format']
+    version = job.params.get('version')
+    compress = job.params.get('gzip', False)
+    if format in COLUMNAR_FORMATS:
+        return export_columnar(db, job)
+
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    filename = f'ratings_export_{timestamp}.{EXPORT_FORMATS[format][1]}'
+    if version is not None:
+        filename = f'ratings_export_v{version}_{timestamp}.{EXPORT_FORMATS[format][1]}'
+    if compress:
+        filename += '.gz'
+    path = job.artifact(filename)
+
+    total = db.count_ratings() if version is None else None
+    exported = 0
+
+    def counted(ratings):
+        nonlocal exported
+        for rating in ratings:
+            exported += 1
+            if exported % 1000 == 0:
+                job.progress(exported, total)
+            yield rating
+
+    try:
+        with open(path, 'wb') as f:
+            for chunk in stream_ratings(counted(db.iter_all_ratings(version=version)), format, compress):
+                f.write(chunk)
+        os.replace(path, path[:-len('.part')])
+    except BaseException:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    job.progress(exported, exported, force=True)
+    return f'평가 {exported}개를 내보냈습니다.', {'ratings': exported}
+
+
+def export_columnar(db, job):
+    """Write a dataset version's ratings to an Arrow, Parquet or .npz file in record batches"""
+    format = job.params['format']
+    version = job.params.get('version')
+    metadata = job.params.get('metadata', False)
+    if not columnar.available(format):
+        raise RuntimeError(f'{format} 내보내기에 필요한 라이브러리가 설치되어 있지 않습니다.')
+
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    filename = f'ratings_export_{timestamp}.{COLUMNAR_FORMATS[format][1]}'
+    if version is not None:
+        filename = f'ratings_export_v{version}_{timestamp}.{COLUMNAR_FORMATS[format][1]}'
+    path = job.artifact(filename)
+
+    total = db.count_ratings() if version is None else None
+    exported = 0
+
+    def counted(batches):
+        nonlocal exported
+        for batch in batches:
+            yield batch
+            exported += len(batch)
+            job.progress(exported, total)
+
+    try:
+        batches = db.iter_rating_batches(columnar.BATCH_SIZE, version=version, metadata=metadata)
+        columnar.write_ratings(path, format, counted(batches), metadata)
+        os.replace(path, path[:-len('.part')])
+    except BaseException:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    job.progress(exported, exported, force=True)
+    return f'평가 {exported}개를 내보냈습니다.', {'ratings': exported}
+
+
+HANDLERS = {
+    'load_dataset': load_dataset_job,
+    'export_ratings': export_ratings_job,
+}
+
+
+class JobRunner:
+    """Threads that claim and run queued jobs in this process
+
+    At most `workers` jobs run at once across all processes sharing the
+    database; with `workers=0` this process runs none (a separate `manage.py
+    worker` can). Threads are started lazily per process, like the password
+    hashing pool, so the runner is safe to create before forking server
+    workers.
+    """
+
+    def __init__(self, db, artifact_dir, workers=1, max_attempts=3, retention_days=7, poll_interval=1.0):
+        self.db = db
+        self.artifact_dir = artifact_dir
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retention_days = retention_days
+        self.poll_interval = poll_interval
+        self.stopping = threading.Event()
+        self._wake = threading.Event()
+        self._threads = []
+        self._pid = None
+        self._lock = threading.Lock()
+        self._running = set()
+        self.worker_id = None
+
+    def start(self):
+        """Start the runner threads in this process (no-op if already running here or disabled)"""
+        with self._lock:
+            if self.workers <= 0 or self._pid == os.getpid():
+                return
+            os.makedirs(self.artifact_dir, exist_ok=True)
+            self._pid = os.getpid()
+            self.worker_id = f'{socket.gethostname()}:{self._pid}:{uuid.uuid4().hex[:8]}'
+            self.stopping.clear()
+            self._threads = [threading.Thread(target=self._heartbeat_loop, name='jobs-heartbeat', daemon=True)]
+            self._threads += [
+                threading.Thread(target=self._work_loop, name=f'jobs-{i}', daemon=True) for i in range(self.workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+
+    def stop(self, timeout=10.0):
+        """Stop the threads; running jobs stop at their next progress report and are queued again"""
+        with self._lock:
+            if self._pid != os.getpid():
+                return
+            self.stopping.set()
+            self._wake.set()
+            deadline = time.monotonic() + timeout
+            for thread in self._threads:
+                thread.join(max(deadline - time.monotonic(), 0))
+            self._threads = []
+            self._pid = None
+
+    def wake(self):
+        """Check the queue now instead of at the next poll"""
+        self._wake.set()
+
+    def _work_loop(self):
+        """Claim and run jobs until stopped"""
+        while not self.stopping.is_set():
+            try:
+                job = self.db.claim_job(self.worker_id, self.workers)
+            except Exception:
+                logger.exception('claiming a job failed')
+                job = None
+            if job is None:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+                continue
+            try:
+                self._run(job)
+            except Exception:
+                # Recording the outcome failed (e.g. the database stayed locked);
+                # the job stops being heartbeated and recover_jobs requeues it
+                logger.exception('recording the outcome of job %s (%s) failed', job['id'], job['kind'])
+
+    def _run(self, job):
+        """Run one claimed job and record its outcome"""
+        context = JobContext(self, job)
+        handler = HANDLERS.get(job['kind'])
+        self._running.add(job['id'])
+        try:
+            if handler is None:
+                raise ValueError(f"unknown job kind {job['kind']!r}")
+            message, result = handler(self.db, context)
+        except JobInterrupted:
+            self.db.requeue_job(job['id'])
+        except JobCancelled:
+            self.db.finish_job(job['id'], 'cancelled', '작업이 취소되었습니다.')
+        except Exception as e:
+            logger.exception('job %s (%s) failed', job['id'], job['kind'])
+            self.db.finish_job(job['id'], 'failed', str(e) or type(e).__name__)
+        else:
+            self.db.finish_job(job['id'], 'succeeded', message, result, job['artifact'])
+        finally:
+            self._running.discard(job['id'])
+
+    def _heartbeat_loop(self):
+        """Keep this process's jobs alive, recover abandoned ones and prune old ones"""
+        while not self.stopping.wait(HEARTBEAT_INTERVAL):
+            try:
+                running = sorted(self._running.copy())
+                if running:
+                    self.db.heartbeat_jobs(self.worker_id, running)
+                if self.db.recover_jobs(self.max_attempts):
+                    self.wake()
+                for job in self.db.prune_jobs(self.retention_days):
+                    self.remove_artifact(job)
+            except Exception:
+                logger.exception('job heartbeat failed')
+
+    def remove_artifact(self, job):
+        """Delete a job's artifact file, if it has one"""
+        if job['artifact']:
+            path = artifact_path(self.artifact_dir, job)
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,301 @@
+"""
+Incrementally maintained model leaderboard
+
+Every rating write updates, in the same transaction:
+
+- per-model Welford mean and sum of squared deviations (M2) plus a rating
+  histogram, with O(1) insert/replace updates
+- per-pair win/loss/tie counts between models that the same evaluator rated
+  on the same example, touching only that evaluator's other ratings of the
+  example (O(models per example))
+
+Like the rating aggregates, the tables cover the ratings of the active dataset
+version. Reading the leaderboard touches only these tables, so its cost
+depends on the number of models, not ratings.
+"""
+import math
+from statistics import NormalDist
+from app.datasets import rating_in
+
+RATING_VALUES = (1, 2, 3, 4, 5)
+
+HISTOGRAM_COLUMNS = ', '.join(f'rating_{value}' for value in RATING_VALUES)
+
+# Incremental floating-point updates drift slightly from a full recompute
+TOLERANCE = 1e-6
+
+
+def _welford(count, mean, m2, old_rating, new_rating):
+    """Welford state after inserting new_rating (old_rating None) or replacing old_rating"""
+    if old_rating is None:
+        count += 1
+        delta = new_rating - mean
+        mean += delta / count
+        m2 += delta * (new_rating - mean)
+    else:
+        new_mean = mean + (new_rating - old_rating) / count
+        m2 += (new_rating - old_rating) * (new_rating - new_mean + old_rating - mean)
+        mean = new_mean
+    return count, mean, max(m2, 0.0)
+
+
+def _update_model(conn, model_name, old_rating, new_rating):
+    """Apply one rating insert or replacement to a model's running statistics"""
+    row = conn.execute(
+        'SELECT count, mean, m2 FROM leaderboard_models WHERE model_name = ?', (model_name,)
+    ).fetchone()
+    count, mean, m2 = _welford(*(tuple(row) if row else (0, 0.0, 0.0)), old_rating, new_rating)
+
+    histogram = [f'rating_{new_rating} = rating_{new_rating} + 1']
+    if old_rating is not None:
+        histogram.append(f'rating_{old_rating} = rating_{old_rating} - 1')
+    conn.execute(
+        'INSERT OR IGNORE INTO leaderboard_models (model_name) VALUES (?)', (model_name,)
+    )
+    conn.execute(f'''
+        UPDATE leaderboard_models SET count = ?, mean = ?, m2 = ?, {', '.join(histogram)}
+        WHERE model_name = ?
+    ''', (count, mean, m2, model_name))
+
+
+def _outcome(rating, other):
+    """(wins, losses, ties) of one comparison"""
+    return (int(rating > other), int(rating < other), int(rating == other))
+
+
+def _add_pair(conn, model_name, other_name, wins, losses, ties):
+    """Add outcome counts of `model_name` against `other_name` to their pair row"""
+    if model_name < other_name:
+        pair = (model_name, other_name)
+    else:
+        pair, wins, losses = (other_name, model_name), losses, wins
+    conn.execute('''
+        INSERT INTO leaderboard_pairs (model_a, model_b, wins, losses, ties)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(model_a, model_b) DO UPDATE SET
+            wins = wins + excluded.wins,
+            losses = losses + excluded.losses,
+            ties = ties + excluded.ties
+    ''', (*pair, wins, losses, ties))
+
+
+def _update_pairs(conn, user_id, example_id, source_hash, model_name, old_rating, new_rating):
+    """Move the evaluator's comparisons on this example from the old to the new rating"""
+    others = conn.execute('''
+        SELECT model_name, rating FROM ratings
+        WHERE user_id = ? AND example_id = ? AND source_hash = ? AND model_name != ?
+    ''', (user_id, example_id, source_hash, model_name)).fetchall()
+
+    for other in others:
+        outcome = _outcome(new_rating, other['rating'])
+        if old_rating is not None:
+            outcome = tuple(new - old for new, old in zip(outcome, _outcome(old_rating, other['rating'])))
+            if not any(outcome):
+                continue
+        _add_pair(conn, model_name, other['model_name'], *outcome)
+
+
+def apply_rating(conn, user_id, example_id, source_hash, model_name, old_rating, new_rating):
+    """Apply a rating insert (old_rating None) or replacement to the leaderboard"""
+    if old_rating == new_rating:
+        return
+    _update_model(conn, model_name, old_rating, new_rating)
+    _update_pairs(conn, user_id, example_id, source_hash, model_name, old_rating, new_rating)
+
+
+def _merge(count, mean, m2, other_count, other_mean, other_m2, sign):
+    """Welford state after adding (sign 1) or removing (sign -1) a group with its own state"""
+    if sign < 0:
+        count -= other_count
+        if count <= 0:
+            return 0, 0.0, 0.0
+        # Recover the remaining group's mean, then undo the combination below
+        mean = (mean * (count + other_count) - other_mean * other_count) / count
+        delta = other_mean - mean
+        m2 -= other_m2 + delta * delta * count * other_count / (count + other_count)
+        return count, mean, max(m2, 0.0)
+
+    total = count + other_count
+    delta = other_mean - mean
+    mean += delta * other_count / total
+    m2 += other_m2 + delta * delta * count * other_count / total
+    return total, mean, m2
+
+
+def apply_ratings(conn, ratings, sign=1):
+    """Add (sign 1) or remove (sign -1) every rating of a set of example contents
+
+    `ratings` are (user_id, example_id, model_name, rating) rows and must hold
+    all ratings of each content, so that every comparison between them is
+    counted exactly once.
+    """
+    by_model = {}
+    by_example = {}
+    for user_id, example_id, model_name, rating in ratings:
+        by_model.setdefault(model_name, []).append(rating)
+        by_example.setdefault((user_id, example_id), []).append((model_name, rating))
+
+    for model_name, values in by_model.items():
+        count = len(values)
+        mean = sum(values) / count
+        m2 = sum((value - mean) ** 2 for value in values)
+        row = conn.execute(
+            'SELECT count, mean, m2 FROM leaderboard_models WHERE model_name = ?', (model_name,)
+        ).fetchone()
+        state = _merge(*(tuple(row) if row else (0, 0.0, 0.0)), count, mean, m2, sign)
+
+        histogram = [f'rating_{value} = rating_{value} + ?' for value in RATING_VALUES]
+        conn.execute(
+            'INSERT OR IGNORE INTO leaderboard_models (model_name) VALUES (?)', (model_name,)
+        )
+        conn.execute(f'''
+            UPDATE leaderboard_models SET count = ?, mean = ?, m2 = ?, {', '.join(histogram)}
+            WHERE model_name = ?
+        ''', (*state, *(sign * values.count(value) for value in RATING_VALUES), model_name))
+
+    for rated in by_example.values():
+        for i, (model_name, rating) in enumerate(rated):
+            for other_name, other in rated[i + 1:]:
+                _add_pair(conn, model_name, other_name, *(sign * n for n in _outcome(rating, other)))
+
+
+MODELS_QUERY = f'''
+    SELECT r.model_name, COUNT(*),
+           AVG(r.rating),
+           SUM(r.rating * r.rating) - SUM(r.rating) * 1.0 * SUM(r.rating) / COUNT(*),
+           {', '.join(f'SUM(r.rating = {value})' for value in RATING_VALUES)}
+    FROM ratings r
+    JOIN dataset_examples m ON {rating_in('r')}
+    GROUP BY r.model_name
+'''
+
+PAIRS_QUERY = f'''
+    SELECT a.model_name, b.model_name,
+           SUM(a.rating > b.rating), SUM(a.rating < b.rating), SUM(a.rating = b.rating)
+    FROM ratings a
+    JOIN dataset_examples m ON {rating_in('a')}
+    JOIN ratings b ON b.user_id = a.user_id AND b.example_id = a.example_id
+                  AND b.source_hash = a.source_hash AND b.model_name > a.model_name
+    GROUP BY a.model_name, b.model_name
+'''
+
+
+def recompute(conn):
+    """Compute the leaderboard tables from the ratings table"""
+    return {
+        'leaderboard_models': {row[0]: tuple(row[1:]) for row in conn.execute(MODELS_QUERY)},
+        'leaderboard_pairs': {tuple(row[:2]): tuple(row[2:]) for row in conn.execute(PAIRS_QUERY)},
+    }
+
+
+def stored(conn):
+    """Read the leaderboard tables"""
+    return {
+        'leaderboard_models': {
+            row[0]: tuple(row[1:]) for row in conn.execute(
+                f'SELECT model_name, count, mean, m2, {HISTOGRAM_COLUMNS} FROM leaderboard_models WHERE count > 0')
+        },
+        'leaderboard_pairs': {
+            tuple(row[:2]): tuple(row[2:]) for row in conn.execute(
+                'SELECT model_a, model_b, wins, losses, ties FROM leaderboard_pairs '
+                'WHERE wins > 0 OR losses > 0 OR ties > 0')
+        },
+    }
+
+
+def _same(expected, actual):
+    """Compare stored and recomputed rows, allowing float drift in mean and m2"""
+    if expected is None or actual is None:
+        return expected == actual
+    return all(
+        math.isclose(e, a, rel_tol=TOLERANCE, abs_tol=TOLERANCE) if isinstance(e, float) or isinstance(a, float)
+        else e == a
+        for e, a in zip(expected, actual)
+    )
+
+
+def compare(expected, actual):
+    """List (table, group, expected, actual) for every group that differs"""
+    mismatches = []
+    for table, groups in expected.items():
+        for key in groups.keys() | actual[table].keys():
+            if not _same(groups.get(key), actual[table].get(key)):
+                mismatches.append((table, key, groups.get(key), actual[table].get(key)))
+    return mismatches
+
+
+def rebuild(conn):
+    """Replace the leaderboard tables with a full recompute"""
+    conn.execute('DELETE FROM leaderboard_models')
+    conn.execute(f'''
+        INSERT INTO leaderboard_models (model_name, count, mean, m2, {HISTOGRAM_COLUMNS})
+        {MODELS_QUERY}
+    ''')
+    conn.execute('DELETE FROM leaderboard_pairs')
+    conn.execute(f'''
+        INSERT INTO leaderboard_pairs (model_a, model_b, wins, losses, ties)
+        {PAIRS_QUERY}
+    ''')
+
+
+def _wilson(successes, total, z):
+    """Wilson score interval of a proportion"""
+    if not total:
+        return None, None
+    share = successes / total
+    center = (share + z * z / (2 * total)) / (1 + z * z / total)
+    margin = z * math.sqrt(share * (1 - share) / total + z * z / (4 * total * total)) / (1 + z * z / total)
+    return center - margin, center + margin
+
+
+def read(conn, confidence=0.95):
+    """Ranked leaderboard with confidence bounds and pairwise records
+
+    Models are ordered by mean rating. A model's rank is one plus the number
+    of models whose interval lies entirely above its own, so models that are
+    not separable share a rank.
+    """
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    models = []
+    for row in conn.execute(
+            f'SELECT model_name, count, mean, m2, {HISTOGRAM_COLUMNS} FROM leaderboard_models WHERE count > 0'):
+        count, mean = row['count'], row['mean']
+        variance = row['m2'] / (count - 1) if count > 1 else 0.0
+        margin = z * math.sqrt(variance / count)
+        models.append({
+            'model_name': row['model_name'],
+            'count': count,
+            'mean': mean,
+            'stddev': math.sqrt(variance),
+            'ci_low': mean - margin,
+            'ci_high': mean + margin,
+            'histogram': {value: row[f'rating_{value}'] for value in RATING_VALUES},
+            'wins': 0, 'losses': 0, 'ties': 0,
+        })
+
+    by_name = {model['model_name']: model for model in models}
+    pairs = []
+    for row in conn.execute('''
+            SELECT model_a, model_b, wins, losses, ties FROM leaderboard_pairs
+            WHERE wins > 0 OR losses > 0 OR ties > 0
+            ORDER BY model_a, model_b'''):
+        pair = dict(row)
+        games = pair['wins'] + pair['losses'] + pair['ties']
+        # Ties count as half a win
+        pair['win_rate'] = (pair['wins'] + pair['ties'] / 2) / games
+        pair['win_rate_low'], pair['win_rate_high'] = _wilson(pair['wins'] + pair['ties'] / 2, games, z)
+        pairs.append(pair)
+        for name, wins, losses in ((pair['model_a'], pair['wins'], pair['losses']),
+                                   (pair['model_b'], pair['losses'], pair['wins'])):
+            if name in by_name:
+                by_name[name]['wins'] += wins
+                by_name[name]['losses'] += losses
+                by_name[name]['ties'] += pair['ties']
+
+    for model in models:
+        games = model['wins'] + model['losses'] + model['ties']
+        model['win_rate'] = (model['wins'] + model['ties'] / 2) / games if games else None
+        model['rank'] = 1 + sum(other['ci_low'] > model['ci_high'] for other in models)
+    models.sort(key=lambda model: (model['rank'], -model['mean'], model['model_name']))
+
+    return {'confidence': confidence, 'models': models, 'pairs': pairs}
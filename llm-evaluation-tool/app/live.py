@@ -0,0 +1,193 @@
+"""
+Live admin dashboard feed
+
+Dashboards in live mode hold one Server-Sent Events connection instead of
+reloading the page. Each server process runs a single poller thread, only
+while it has subscribers, that checks once per interval whether a rating was
+written (the newest rating event) or another dataset version was activated
+(the dataset generation). Both are read through a primary key, so an idle
+campaign costs one tiny query per interval and process.
+
+When something changed, the poller reads the materialized statistics,
+leaderboard and coverage summary and coalesces the whole interval into one
+message: the statistics rows that changed, the leaderboard and coverage if
+they changed, and the newest ratings. The message is encoded once and handed
+to every subscriber of the process, so the database work does not grow with
+the number of admins watching.
+
+A subscriber starts from the poller's current state, so the snapshot it
+receives and the messages that follow are consistent. One that falls too far
+behind is disconnected; its browser reconnects and starts from a new snapshot.
+"""
+import contextlib
+import json
+import logging
+import queue
+import threading
+from app.export import event_record
+from app.stats import AGGREGATES, STAT_NAMES
+
+logger = logging.getLogger(__name__)
+
+# Group columns of each statistics table, identifying its rows
+STAT_KEYS = {name: keys for name, (_, keys, _) in zip(STAT_NAMES, AGGREGATES)}
+
+# Milliseconds the browser waits before reconnecting a dropped stream
+RECONNECT_MS = 2000
+
+
+def sse(event, data, id=None):
+    """Encode one Server-Sent Event with a JSON payload"""
+    lines = [] if id is None else [f'id: {id}']
+    lines.append(f'event: {event}')
+    lines.append('data: ' + json.dumps(data, ensure_ascii=False, separators=(',', ':')))
+    return '\n'.join(lines) + '\n\n'
+
+
+def stat_deltas(old, new):
+    """Per statistics table, the rows added or changed since `old` and the keys of removed rows"""
+    deltas = {}
+    for name, keys in STAT_KEYS.items():
+        before = {tuple(row[key] for key in keys): row for row in old[name]}
+        after = {tuple(row[key] for key in keys): row for row in new[name]}
+        upsert = [row for key, row in after.items() if before.get(key) != row]
+        remove = [list(key) for key in before if key not in after]
+        if upsert or remove:
+            deltas[name] = {'upsert': upsert, 'remove': remove}
+    return deltas
+
+
+class LiveFeed:
+    """Per-process poller fanning coalesced dashboard updates out to SSE subscribers"""
+
+    def __init__(self, db, coverage_target, interval=1.0, keepalive=15.0, max_ratings=50,
+                 max_subscribers=2, queue_size=32):
+        self.db = db
+        self.coverage_target = coverage_target
+        self.interval = interval
+        self.keepalive = keepalive
+        self.max_ratings = max_ratings
+        self.max_subscribers = max_subscribers
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._state = None
+        self._thread = None
+        self._stopping = threading.Event()
+
+    def subscribers(self):
+        """Number of open streams in this process"""
+        with self._lock:
+            return len(self._subscribers)
+
+    def subscribe(self, after=None):
+        """Open a stream; returns (queue, snapshot), or (None, None) at the subscriber limit
+
+        `after` is the last rating event the browser saw (its Last-Event-ID);
+        the snapshot then includes the ratings it missed, up to max_ratings.
+        """
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                return None, None
+            if self._thread is None:
+                self._state = self.db.get_live_state(self.coverage_target)
+                self._stopping.clear()
+                self._thread = threading.Thread(target=self._poll_loop, name='live-feed', daemon=True)
+                self._thread.start()
+            subscriber = queue.Queue(self.queue_size)
+            self._subscribers.add(subscriber)
+            state = self._state
+
+        snapshot = {key: state[key] for key in ('seq', 'stats', 'leaderboard', 'coverage')}
+        snapshot['ratings'] = []
+        if after is not None and after < state['seq']:
+            snapshot['ratings'] = self._ratings(after, state['seq'])
+        return subscriber, snapshot
+
+    def unsubscribe(self, subscriber):
+        """Close a stream; the poller stops with the last one"""
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def stream(self, subscriber, snapshot):
+        """Yield the encoded events of one subscriber until it disconnects or the feed stops"""
+        try:
+            yield f'retry: {RECONNECT_MS}\n' + sse('snapshot', snapshot, snapshot['seq'])
+            while True:
+                try:
+                    message = subscriber.get(timeout=self.keepalive)
+                except queue.Empty:
+                    # Comment line: keeps proxies from closing an idle stream
+                    yield ': keepalive\n\n'
+                    continue
+                if message is None:
+                    return
+                yield message
+        finally:
+            self.unsubscribe(subscriber)
+
+    def stop(self):
+        """End every stream and the poller (server process shutting down)"""
+        self._stopping.set()
+        with self._lock:
+            for subscriber in self._subscribers:
+                self._close(subscriber)
+            self._subscribers.clear()
+
+    def _ratings(self, after, until):
+        """The newest rating events in (after, until], at most max_ratings, oldest first"""
+        rows, _ = self.db.get_rating_events(max(after, until - self.max_ratings), self.max_ratings)
+        return [event_record(row) for row in rows if row['seq'] <= until]
+
+    def _poll_loop(self):
+        """Publish what changed every interval while there are subscribers"""
+        while not self._stopping.wait(self.interval):
+            with self._lock:
+                if not self._subscribers:
+                    self._thread = None
+                    return
+            try:
+                self._poll()
+            except Exception:
+                logger.exception('live feed poll failed')
+        with self._lock:
+            self._thread = None
+
+    def _poll(self):
+        """Read the changes since the last published state and broadcast them as one message"""
+        state = self._state
+        if self.db.get_live_version() == (state['seq'], state['generation']):
+            return
+        new = self.db.get_live_state(self.coverage_target)
+        update = {'seq': new['seq'], 'stats': stat_deltas(state['stats'], new['stats'])}
+        if new['leaderboard'] != state['leaderboard']:
+            update['leaderboard'] = new['leaderboard']
+        if new['coverage'] != state['coverage']:
+            update['coverage'] = new['coverage']
+        update['ratings'] = self._ratings(state['seq'], new['seq']) if new['seq'] > state['seq'] else []
+        update['skipped'] = max(new['seq'] - state['seq'] - len(update['ratings']), 0)
+        if new['generation'] != state['generation']:
+            # Another dataset version: the ratings shown may no longer count
+            update['dataset_changed'] = True
+
+        message = sse('update', update, new['seq'])
+        with self._lock:
+            self._state = new
+            for subscriber in list(self._subscribers):
+                try:
+                    subscriber.put_nowait(message)
+                except queue.Full:
+                    # Too far behind: drop it; the browser reconnects from a fresh snapshot
+                    self._subscribers.discard(subscriber)
+                    self._close(subscriber)
+
+    @staticmethod
+    def _close(subscriber):
+        """Make a subscriber's stream end, dropping its oldest message if its queue is full"""
+        try:
+            subscriber.put_nowait(None)
+        except queue.Full:
+            with contextlib.suppress(queue.Empty):
+                subscriber.get_nowait()
+            with contextlib.suppress(queue.Full):
+                subscriber.put_nowait(None)
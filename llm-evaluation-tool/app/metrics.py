@@ -0,0 +1,285 @@
+"""
+Request and query instrumentation exposed in Prometheus text format
+
+When enabled, every request is timed per route and every public `Database`
+method is timed as a named query, together with the rows it returned,
+connection waits, write-lock waits and lock retries. Queries slower than a
+threshold are logged. When disabled, nothing is wrapped and no hooks are
+registered.
+
+Counts are per process: behind gunicorn each worker keeps its own registry.
+"""
+import functools
+import inspect
+import logging
+import reprlib
+import threading
+import time
+from flask import g, request
+
+logger = logging.getLogger(__name__)
+
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0, 5.0)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000)
+
+# Public Database methods that are plumbing rather than queries
+UNINSTRUMENTED = {
+    'connection', 'transaction', 'get_connection', 'release_request_connection',
+    'close', 'init_db', 'get_dataset_cache_stats'
+}
+
+# Arguments of these methods carry passwords and are left out of the slow-query log
+UNLOGGED_ARGUMENTS = {'create_user', 'verify_user', 'update_user'}
+
+# Short argument summaries for log lines (a whole dataset can be an argument)
+ARGUMENT_REPR = reprlib.Repr()
+ARGUMENT_REPR.maxlevel = 3
+ARGUMENT_REPR.maxlist = ARGUMENT_REPR.maxtuple = ARGUMENT_REPR.maxdict = 4
+ARGUMENT_REPR.maxstring = ARGUMENT_REPR.maxother = 40
+
+
+def _escape(value):
+    """Escape a label value for the text exposition format"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    """Render {name="value",...} for a sample"""
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{_escape(value)}"' for name, value in extra]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    """Render a sample value"""
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter with labels"""
+
+    kind = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        """Add `amount` to the counter for a label tuple"""
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        """Exposition lines for all label sets"""
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f'{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}'
+                for labels, value in values]
+
+
+class Histogram:
+    """Cumulative-bucket histogram with labels"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=QUERY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        """Record one observation for a label tuple"""
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # Per-bucket counts (made cumulative when rendered), then sum
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            else:
+                series[len(self.buckets)] += 1
+            series[-1] += value
+
+    def render(self):
+        """Exposition lines for all label sets"""
+        with self._lock:
+            series = sorted((labels, list(values)) for labels, values in self._series.items())
+        lines = []
+        for labels, values in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), values):
+                cumulative += count
+                bucket_labels = _format_labels(self.labelnames, labels, [('le', _format_value(bound))])
+                lines.append(f'{self.name}_bucket{bucket_labels} {cumulative}')
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f'{self.name}_sum{label_text} {_format_value(values[-1])}')
+            lines.append(f'{self.name}_count{label_text} {cumulative}')
+        return lines
+
+
+class Metrics:
+    """Registry of the tool's request and database metrics"""
+
+    def __init__(self, slow_query_ms=0):
+        self.slow_query_seconds = slow_query_ms / 1000 if slow_query_ms else None
+        self.requests = Histogram('llm_eval_request_seconds', 'Request latency by route',
+                                  ('method', 'route', 'status'), REQUEST_BUCKETS)
+        self.queries = Histogram('llm_eval_query_seconds', 'Database method latency',
+                                 ('query',), QUERY_BUCKETS)
+        self.query_rows = Histogram('llm_eval_query_rows', 'Rows returned by database methods',
+                                    ('query',), ROW_BUCKETS)
+        self.query_errors = Counter('llm_eval_query_errors_total', 'Database methods that raised',
+                                    ('query', 'error'))
+        self.slow_queries = Counter('llm_eval_slow_queries_total', 'Database methods over the slow-query threshold',
+                                    ('query',))
+        self.connection_waits = Histogram('llm_eval_connection_wait_seconds',
+                                          'Time to take a connection from the pool (or open one)')
+        self.lock_waits = Histogram('llm_eval_lock_wait_seconds', 'Time to acquire the SQLite write lock')
+        self.lock_retries = Counter('llm_eval_lock_retries_total', 'Operations retried after lock contention',
+                                    ('operation',))
+        self._metrics = [self.requests, self.queries, self.query_rows, self.query_errors, self.slow_queries,
+                         self.connection_waits, self.lock_waits, self.lock_retries]
+        self._collectors = []
+
+    def add_collector(self, collect):
+        """Register a callable returning [(name, type, help, value)] samples read at scrape time"""
+        self._collectors.append(collect)
+
+    def render(self):
+        """All metrics in Prometheus text exposition format"""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.render())
+        for collect in self._collectors:
+            for name, kind, help, value in collect():
+                lines.append(f'# HELP {name} {help}')
+                lines.append(f'# TYPE {name} {kind}')
+                lines.append(f'{name} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+    def record_query(self, name, elapsed, result, args):
+        """Record a finished database method and log it when slow"""
+        self.queries.observe((name,), elapsed)
+        rows = _row_count(result)
+        if rows is not None:
+            self.query_rows.observe((name,), rows)
+        if self.slow_query_seconds is not None and elapsed >= self.slow_query_seconds:
+            self.slow_queries.inc((name,))
+            detail = '' if name in UNLOGGED_ARGUMENTS else f' args={ARGUMENT_REPR.repr(args)}'
+            logger.warning('slow query %s: %.1f ms, %s rows%s', name, elapsed * 1000,
+                           '?' if rows is None else rows, detail)
+
+    def instrument_database(self, db):
+        """Shadow the public query methods of a Database instance with timed wrappers"""
+        for name, function in inspect.getmembers(type(db), inspect.isfunction):
+            if name.startswith('_') or name in UNINSTRUMENTED:
+                continue
+            method = getattr(db, name)
+            wrap = self._wrap_generator if inspect.isgeneratorfunction(function) else self._wrap
+            setattr(db, name, wrap(name, method))
+
+    def _wrap(self, name, method):
+        """Time a method call"""
+        @functools.wraps(method)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = method(*args, **kwargs)
+            except Exception as e:
+                self.query_errors.inc((name, type(e).__name__))
+                raise
+            self.record_query(name, time.perf_counter() - start, result, args)
+            return result
+        return timed
+
+    def _wrap_generator(self, name, method):
+        """Time a generator method from the first to the last item, counting items as rows"""
+        @functools.wraps(method)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            rows = 0
+            try:
+                for item in method(*args, **kwargs):
+                    rows += 1
+                    yield item
+            except Exception as e:
+                self.query_errors.inc((name, type(e).__name__))
+                raise
+            self.record_query(name, time.perf_counter() - start, range(rows), args)
+        return timed
+
+    def init_app(self, app):
+        """Time every request by route and status"""
+        @app.before_request
+        def start_request_timer():
+            g._request_start = time.perf_counter()
+
+        @app.after_request
+        def record_request(response):
+            start = g.pop('_request_start', None)
+            if start is not None:
+                route = request.url_rule.rule if request.url_rule is not None else '<unmatched>'
+                self.requests.observe((request.method, route, str(response.status_code)),
+                                      time.perf_counter() - start)
+            return response
+
+
+def database_collector(db):
+    """Connection pool and dataset cache samples of a Database"""
+    def collect():
+        cache = db.get_dataset_cache_stats()
+        return [
+            ('llm_eval_pool_idle_connections', 'gauge', 'Idle pooled connections', db.pool.idle_count()),
+            ('llm_eval_dataset_cache_entries', 'gauge', 'Entries in the dataset cache', cache['size']),
+            ('llm_eval_dataset_cache_hits_total', 'counter', 'Dataset cache hits', cache['hits']),
+            ('llm_eval_dataset_cache_misses_total', 'counter', 'Dataset cache misses', cache['misses']),
+        ]
+    return collect
+
+
+def coverage_collector(db, target):
+    """Work assignment coverage samples of the active dataset"""
+    def collect():
+        coverage = db.get_coverage_summary(target)
+        return [
+            ('llm_eval_coverage_examples', 'gauge', 'Examples in the active dataset', coverage['examples']),
+            ('llm_eval_coverage_complete_examples', 'gauge',
+             'Examples whose every model reached the rating target', coverage['complete']),
+            ('llm_eval_assignment_leases', 'gauge', 'Examples currently assigned to evaluators', coverage['leases']),
+        ]
+    return collect
+
+
+def live_collector(feed):
+    """Open live dashboard streams of this process"""
+    def collect():
+        return [
+            ('llm_eval_live_subscribers', 'gauge', 'Open live dashboard streams in this process', feed.subscribers()),
+        ]
+    return collect
+
+
+def _row_count(result):
+    """Rows in a database method result: list length, first list in a tuple, 1 per dict"""
+    if result is None:
+        return 0
+    if isinstance(result, (list, range)):
+        return len(result)
+    if isinstance(result, tuple):
+        return next((len(part) for part in result if isinstance(part, list)), None)
+    if isinstance(result, dict):
+        return 1
+    return None
@@ -0,0 +1,732 @@
+"""
+Versioned schema migrations
+
+Migrations run in order at startup, each in its own write transaction, and the
+applied versions are recorded in the `schema_version` table. Databases created
+before versioning existed are brought up to date by the idempotent early
+migrations. New schema changes must be appended as a new migration, never
+edited into an already released one.
+
+Each migration carries its own copy of the SQL it runs, as of the schema it
+was written for, so later changes to the modules that own those tables cannot
+change what an old migration does. Only the content hashes and the blob codec
+are shared with the running code, since the data they produce must match what
+it reads.
+"""
+import json
+import os
+import shutil
+import tempfile
+from datetime import datetime
+from app import blobs
+from app.ingest import content_hash, source_hash
+
+# Manifest row `m` of the active dataset version holding the content rating `r` was given for
+ACTIVE_RATING = '''
+    m.version = (SELECT value FROM meta WHERE key = 'active_dataset')
+    AND m.example_id = r.example_id AND m.source_hash = r.source_hash
+'''
+
+
+def _now():
+    """Timestamp in the format used by every table"""
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _initial_schema(conn):
+    """Users, examples and ratings tables"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            role TEXT NOT NULL CHECK(role IN ('evaluator', 'admin'))
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS examples (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            example_id INTEGER UNIQUE NOT NULL,
+            category TEXT NOT NULL,
+            history TEXT NOT NULL,
+            responses TEXT NOT NULL
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS ratings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            example_id INTEGER NOT NULL,
+            model_name TEXT NOT NULL,
+            rating INTEGER NOT NULL CHECK(rating >= 1 AND rating <= 5),
+            timestamp TEXT NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users(id),
+            FOREIGN KEY (example_id) REFERENCES examples(example_id),
+            UNIQUE(user_id, example_id, model_name)
+        )
+    ''')
+
+
+def _ratings_browser_indexes(conn):
+    """Indexes for category lookups and the admin ratings browser"""
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_examples_category ON examples(category, example_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_ratings_timestamp ON ratings(timestamp, id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_ratings_model_timestamp ON ratings(model_name, timestamp, id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_ratings_user_timestamp ON ratings(user_id, timestamp, id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_ratings_example ON ratings(example_id)')
+
+
+def _rating_aggregates(conn):
+    """Materialized rating aggregates, backfilled from existing ratings"""
+    for table, keys in (('stats_model', 'model_name'), ('stats_category', 'category'),
+                        ('stats_category_model', 'category, model_name')):
+        columns = ', '.join(f'{key} TEXT NOT NULL' for key in keys.split(', '))
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                {columns},
+                count INTEGER NOT NULL DEFAULT 0,
+                rating_sum INTEGER NOT NULL DEFAULT 0,
+                rating_sumsq INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY ({keys})
+            )
+        ''')
+
+    conn.execute('DELETE FROM stats_model')
+    conn.execute('''
+        INSERT INTO stats_model (model_name, count, rating_sum, rating_sumsq)
+        SELECT model_name, COUNT(*), SUM(rating), SUM(rating * rating)
+        FROM ratings
+        GROUP BY model_name
+    ''')
+    conn.execute('DELETE FROM stats_category')
+    conn.execute('''
+        INSERT INTO stats_category (category, count, rating_sum, rating_sumsq)
+        SELECT e.category, COUNT(*), SUM(r.rating), SUM(r.rating * r.rating)
+        FROM ratings r
+        JOIN examples e ON r.example_id = e.example_id
+        GROUP BY e.category
+    ''')
+    conn.execute('DELETE FROM stats_category_model')
+    conn.execute('''
+        INSERT INTO stats_category_model (category, model_name, count, rating_sum, rating_sumsq)
+        SELECT e.category, r.model_name, COUNT(*), SUM(r.rating), SUM(r.rating * r.rating)
+        FROM ratings r
+        JOIN examples e ON r.example_id = e.example_id
+        GROUP BY e.category, r.model_name
+    ''')
+
+
+def _covering_indexes(conn):
+    """Covering indexes for evaluator progress and rating lookups"""
+    # Progress and per-user rating lookups are answered from the index alone
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_ratings_user_example
+        ON ratings(user_id, example_id, model_name, rating)
+    ''')
+    # Category checks in rating joins avoid touching the large example rows
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_examples_id_category ON examples(example_id, category)')
+
+
+def _example_index_columns(conn):
+    """Response counts and content hashes for lazy example loading"""
+    conn.execute('ALTER TABLE examples ADD COLUMN num_responses INTEGER NOT NULL DEFAULT 0')
+    conn.execute('ALTER TABLE examples ADD COLUMN content_hash TEXT')
+
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            'SELECT id, category, history, responses FROM examples WHERE id > ? ORDER BY id LIMIT 500',
+            (last_id,)
+        ).fetchall()
+        if not rows:
+            break
+        conn.executemany(
+            'UPDATE examples SET num_responses = ?, content_hash = ? WHERE id = ?',
+            [(len(json.loads(row['responses'])),
+              content_hash(row['category'], row['history'], row['responses']),
+              row['id']) for row in rows]
+        )
+        last_id = rows[-1]['id']
+
+    # Appended columns sit after the large JSON text, so serve them from
+    # covering indexes instead of the table rows
+    conn.execute('DROP INDEX IF EXISTS idx_examples_category')
+    conn.execute('DROP INDEX IF EXISTS idx_examples_id_category')
+    conn.execute('''
+        CREATE INDEX idx_examples_category
+        ON examples(category, example_id, num_responses)
+    ''')
+    conn.execute('''
+        CREATE INDEX idx_examples_id_category
+        ON examples(example_id, category, content_hash)
+    ''')
+
+
+def _progress_versions(conn):
+    """Per-user progress version counter stamped on every rating write"""
+    conn.execute('ALTER TABLE users ADD COLUMN progress_version INTEGER NOT NULL DEFAULT 0')
+    conn.execute('ALTER TABLE ratings ADD COLUMN user_seq INTEGER NOT NULL DEFAULT 0')
+    conn.execute('CREATE INDEX idx_ratings_user_seq ON ratings(user_id, user_seq)')
+
+
+def _dataset_generation(conn):
+    """Counter bumped by every dataset load, used to key example caches"""
+    conn.execute('''
+        CREATE TABLE meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        )
+    ''')
+    conn.execute("INSERT INTO meta (key, value) VALUES ('dataset_generation', 1)")
+
+
+def _blob_store(conn):
+    """Move example texts into the deduplicated, compressed blob store"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS blobs (
+            id INTEGER PRIMARY KEY,
+            hash BLOB NOT NULL UNIQUE,
+            codec TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            data BLOB NOT NULL
+        )
+    ''')
+    writer = blobs.BlobWriter(conn)
+
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            'SELECT id, history, responses FROM examples WHERE id > ? ORDER BY id LIMIT 500',
+            (last_id,)
+        ).fetchall()
+        if not rows:
+            break
+        packed = writer.pack([
+            {'history': json.loads(row['history']), 'responses': json.loads(row['responses'])}
+            for row in rows
+        ])
+        conn.executemany(
+            'UPDATE examples SET history = ?, responses = ? WHERE id = ?',
+            [(history, responses, row['id']) for (history, responses), row in zip(packed, rows)]
+        )
+        last_id = rows[-1]['id']
+
+    # Cached examples were parsed from the old layout
+    conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'dataset_generation'")
+
+
+def _leaderboard(conn):
+    """Incremental leaderboard tables, backfilled from existing ratings"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS leaderboard_models (
+            model_name TEXT PRIMARY KEY,
+            count INTEGER NOT NULL DEFAULT 0,
+            mean REAL NOT NULL DEFAULT 0,
+            m2 REAL NOT NULL DEFAULT 0,
+            rating_1 INTEGER NOT NULL DEFAULT 0, rating_2 INTEGER NOT NULL DEFAULT 0,
+            rating_3 INTEGER NOT NULL DEFAULT 0, rating_4 INTEGER NOT NULL DEFAULT 0,
+            rating_5 INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    # model_a < model_b; wins count ratings where model_a scored higher
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS leaderboard_pairs (
+            model_a TEXT NOT NULL,
+            model_b TEXT NOT NULL,
+            wins INTEGER NOT NULL DEFAULT 0,
+            losses INTEGER NOT NULL DEFAULT 0,
+            ties INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (model_a, model_b)
+        )
+    ''')
+
+    conn.execute('DELETE FROM leaderboard_models')
+    conn.execute('''
+        INSERT INTO leaderboard_models
+            (model_name, count, mean, m2, rating_1, rating_2, rating_3, rating_4, rating_5)
+        SELECT model_name, COUNT(*),
+               AVG(rating),
+               SUM(rating * rating) - SUM(rating) * 1.0 * SUM(rating) / COUNT(*),
+               SUM(rating = 1), SUM(rating = 2), SUM(rating = 3), SUM(rating = 4), SUM(rating = 5)
+        FROM ratings
+        GROUP BY model_name
+    ''')
+    conn.execute('DELETE FROM leaderboard_pairs')
+    conn.execute('''
+        INSERT INTO leaderboard_pairs (model_a, model_b, wins, losses, ties)
+        SELECT a.model_name, b.model_name,
+               SUM(a.rating > b.rating), SUM(a.rating < b.rating), SUM(a.rating = b.rating)
+        FROM ratings a
+        JOIN ratings b ON b.user_id = a.user_id AND b.example_id = a.example_id
+                      AND b.model_name > a.model_name
+        GROUP BY a.model_name, b.model_name
+    ''')
+
+
+def _versioned_datasets(conn):
+    """Dataset versions and manifests; ratings keyed by the content they were given for"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS datasets (
+            version INTEGER PRIMARY KEY AUTOINCREMENT,
+            status TEXT NOT NULL CHECK(status IN ('building', 'ready', 'failed')),
+            source TEXT,
+            examples INTEGER NOT NULL DEFAULT 0,
+            changed INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT NOT NULL,
+            activated_at TEXT
+        )
+    ''')
+    # example_row is the examples.id holding this version's content of the example
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS dataset_examples (
+            version INTEGER NOT NULL,
+            example_id INTEGER NOT NULL,
+            category TEXT NOT NULL,
+            source_hash TEXT NOT NULL,
+            example_row INTEGER NOT NULL,
+            PRIMARY KEY (version, example_id)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_dataset_examples_category
+        ON dataset_examples(version, category, example_id)
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_dataset_examples_row ON dataset_examples(example_row)')
+    conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('active_dataset', 0)")
+
+    # Example rows become immutable contents shared between versions, so
+    # example_id is no longer unique; the tables are rebuilt to drop the
+    # constraints
+    conn.execute('''
+        CREATE TABLE examples_versioned (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            example_id INTEGER NOT NULL,
+            category TEXT NOT NULL,
+            history TEXT NOT NULL,
+            responses TEXT NOT NULL,
+            num_responses INTEGER NOT NULL DEFAULT 0,
+            content_hash TEXT NOT NULL,
+            source_hash TEXT NOT NULL
+        )
+    ''')
+    last_id = 0
+    while True:
+        rows = [dict(row) for row in conn.execute(
+            'SELECT * FROM examples WHERE id > ? ORDER BY id LIMIT 500', (last_id,)
+        )]
+        if not rows:
+            break
+        parsed = blobs.unpack(conn, [dict(row) for row in rows])
+        conn.executemany(
+            '''INSERT INTO examples_versioned
+               (id, example_id, category, history, responses, num_responses, content_hash, source_hash)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+            [(row['id'], row['example_id'], row['category'], row['history'], row['responses'],
+              row['num_responses'], row['content_hash'], source_hash(example, row['content_hash']))
+             for row, example in zip(rows, parsed)]
+        )
+        last_id = rows[-1]['id']
+
+    # Ratings of examples missing from the dataset keep a NULL source hash and
+    # match no version
+    conn.execute('''
+        CREATE TABLE ratings_versioned (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            example_id INTEGER NOT NULL,
+            source_hash TEXT,
+            model_name TEXT NOT NULL,
+            rating INTEGER NOT NULL CHECK(rating >= 1 AND rating <= 5),
+            timestamp TEXT NOT NULL,
+            user_seq INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY (user_id) REFERENCES users(id),
+            UNIQUE(user_id, example_id, source_hash, model_name)
+        )
+    ''')
+    conn.execute('''
+        INSERT INTO ratings_versioned
+        (id, user_id, example_id, source_hash, model_name, rating, timestamp, user_seq)
+        SELECT r.id, r.user_id, r.example_id, e.source_hash, r.model_name, r.rating, r.timestamp, r.user_seq
+        FROM ratings r
+        LEFT JOIN examples o ON o.example_id = r.example_id
+        LEFT JOIN examples_versioned e ON e.id = o.id
+    ''')
+
+    conn.execute('DROP TABLE ratings')
+    conn.execute('ALTER TABLE ratings_versioned RENAME TO ratings')
+    conn.execute('DROP TABLE examples')
+    conn.execute('ALTER TABLE examples_versioned RENAME TO examples')
+
+    conn.execute('CREATE INDEX idx_ratings_timestamp ON ratings(timestamp, id)')
+    conn.execute('CREATE INDEX idx_ratings_model_timestamp ON ratings(model_name, timestamp, id)')
+    conn.execute('CREATE INDEX idx_ratings_user_timestamp ON ratings(user_id, timestamp, id)')
+    conn.execute('CREATE INDEX idx_ratings_example ON ratings(example_id, source_hash)')
+    conn.execute('''
+        CREATE INDEX idx_ratings_user_example
+        ON ratings(user_id, example_id, source_hash, model_name, rating)
+    ''')
+    conn.execute('CREATE INDEX idx_ratings_user_seq ON ratings(user_id, user_seq)')
+
+    # The loaded examples become version 1
+    count = conn.execute('SELECT COUNT(*) FROM examples').fetchone()[0]
+    if count:
+        now = _now()
+        version = conn.execute('''
+            INSERT INTO datasets (status, examples, changed, created_at, activated_at)
+            VALUES ('ready', ?, ?, ?, ?)
+        ''', (count, count, now, now)).lastrowid
+        conn.execute('''
+            INSERT INTO dataset_examples (version, example_id, category, source_hash, example_row)
+            SELECT ?, example_id, category, source_hash, id FROM examples
+        ''', (version,))
+        conn.execute("UPDATE meta SET value = ? WHERE key = 'active_dataset'", (version,))
+        conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'dataset_generation'")
+
+    # Aggregates and the leaderboard now count only ratings of the active version's contents
+    for table, keys, group in (('stats_model', 'model_name', 'r.model_name'),
+                               ('stats_category', 'category', 'm.category'),
+                               ('stats_category_model', 'category, model_name', 'm.category, r.model_name')):
+        conn.execute(f'DELETE FROM {table}')
+        conn.execute(f'''
+            INSERT INTO {table} ({keys}, count, rating_sum, rating_sumsq)
+            SELECT {group}, COUNT(*), SUM(r.rating), SUM(r.rating * r.rating)
+            FROM ratings r
+            JOIN dataset_examples m ON {ACTIVE_RATING}
+            GROUP BY {group}
+        ''')
+    conn.execute('DELETE FROM leaderboard_models')
+    conn.execute(f'''
+        INSERT INTO leaderboard_models
+            (model_name, count, mean, m2, rating_1, rating_2, rating_3, rating_4, rating_5)
+        SELECT r.model_name, COUNT(*),
+               AVG(r.rating),
+               SUM(r.rating * r.rating) - SUM(r.rating) * 1.0 * SUM(r.rating) / COUNT(*),
+               SUM(r.rating = 1), SUM(r.rating = 2), SUM(r.rating = 3), SUM(r.rating = 4), SUM(r.rating = 5)
+        FROM ratings r
+        JOIN dataset_examples m ON {ACTIVE_RATING}
+        GROUP BY r.model_name
+    ''')
+    conn.execute('DELETE FROM leaderboard_pairs')
+    conn.execute(f'''
+        INSERT INTO leaderboard_pairs (model_a, model_b, wins, losses, ties)
+        SELECT r.model_name, b.model_name,
+               SUM(r.rating > b.rating), SUM(r.rating < b.rating), SUM(r.rating = b.rating)
+        FROM ratings r
+        JOIN dataset_examples m ON {ACTIVE_RATING}
+        JOIN ratings b ON b.user_id = r.user_id AND b.example_id = r.example_id
+                      AND b.source_hash = r.source_hash AND b.model_name > r.model_name
+        GROUP BY r.model_name, b.model_name
+    ''')
+
+
+def _background_jobs(conn):
+    """Persistent background job queue"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            params TEXT NOT NULL,
+            status TEXT NOT NULL CHECK(status IN ('queued', 'running', 'succeeded', 'failed', 'cancelled')),
+            progress INTEGER NOT NULL DEFAULT 0,
+            total INTEGER,
+            message TEXT,
+            result TEXT,
+            artifact TEXT,
+            cancel_requested INTEGER NOT NULL DEFAULT 0,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            worker TEXT,
+            created_by INTEGER,
+            created_at TEXT NOT NULL,
+            started_at TEXT,
+            finished_at TEXT,
+            heartbeat_at TEXT,
+            FOREIGN KEY (created_by) REFERENCES users(id)
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, id)')
+
+
+def _work_assignment(conn):
+    """Coverage and lease tables of the work assignment scheduler"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS coverage (
+            example_id INTEGER PRIMARY KEY,
+            category TEXT NOT NULL,
+            source_hash TEXT NOT NULL,
+            num_responses INTEGER NOT NULL,
+            ratings INTEGER NOT NULL DEFAULT 0,
+            leases INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_coverage_priority
+        ON coverage(category, ratings, leases, example_id)
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS coverage_models (
+            example_id INTEGER NOT NULL,
+            model_name TEXT NOT NULL,
+            ratings INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (example_id, model_name)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS assignment_leases (
+            user_id INTEGER NOT NULL,
+            example_id INTEGER NOT NULL,
+            expires_at TEXT NOT NULL,
+            PRIMARY KEY (user_id, example_id)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_assignment_leases_expires ON assignment_leases(expires_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_assignment_leases_example ON assignment_leases(example_id)')
+
+    conn.execute(f'''
+        INSERT INTO coverage_models (example_id, model_name, ratings)
+        SELECT r.example_id, r.model_name, COUNT(*)
+        FROM ratings r
+        JOIN dataset_examples m ON {ACTIVE_RATING}
+        GROUP BY r.example_id, r.model_name
+    ''')
+    conn.execute('''
+        INSERT INTO coverage (example_id, category, source_hash, num_responses)
+        SELECT m.example_id, m.category, m.source_hash, e.num_responses
+        FROM dataset_examples m
+        JOIN examples e ON e.id = m.example_row
+        WHERE m.version = (SELECT value FROM meta WHERE key = 'active_dataset')
+    ''')
+    # The minimum over an example's models, 0 while some model has no rating
+    conn.execute('''
+        UPDATE coverage SET ratings =
+            CASE WHEN (SELECT COUNT(*) FROM coverage_models cm WHERE cm.example_id = coverage.example_id)
+                      < coverage.num_responses THEN 0
+                 ELSE (SELECT MIN(cm.ratings) FROM coverage_models cm WHERE cm.example_id = coverage.example_id)
+            END
+    ''')
+
+
+def _rating_events(conn):
+    """Append-only rating event log, started from the current ratings"""
+    # previous_rating is NULL for a first rating
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS rating_events (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            example_id INTEGER NOT NULL,
+            category TEXT NOT NULL,
+            source_hash TEXT,
+            model_name TEXT NOT NULL,
+            rating INTEGER NOT NULL,
+            previous_rating INTEGER,
+            timestamp TEXT NOT NULL
+        )
+    ''')
+    # One event per existing rating, oldest first (earlier values are not known)
+    conn.execute('''
+        INSERT INTO rating_events
+            (user_id, example_id, category, source_hash, model_name, rating, previous_rating, timestamp)
+        SELECT r.user_id, r.example_id,
+               COALESCE((SELECT e.category FROM examples e
+                         WHERE e.example_id = r.example_id AND e.source_hash = r.source_hash LIMIT 1), ''),
+               r.source_hash, r.model_name, r.rating, NULL, r.timestamp
+        FROM ratings r
+        ORDER BY r.timestamp, r.id
+    ''')
+
+
+def _dataset_fingerprints(conn):
+    """Size, mtime and content hash of the file each dataset version was loaded from"""
+    conn.execute('ALTER TABLE datasets ADD COLUMN file_size INTEGER')
+    conn.execute('ALTER TABLE datasets ADD COLUMN file_mtime_ns INTEGER')
+    conn.execute('ALTER TABLE datasets ADD COLUMN file_hash TEXT')
+
+
+def _user_coverage(conn):
+    """Ratings per (evaluator, example) of the active dataset version"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS coverage_users (
+            user_id INTEGER NOT NULL,
+            example_id INTEGER NOT NULL,
+            ratings INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, example_id)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute(f'''
+        INSERT INTO coverage_users (user_id, example_id, ratings)
+        SELECT r.user_id, r.example_id, COUNT(*)
+        FROM ratings r
+        JOIN dataset_examples m ON {ACTIVE_RATING}
+        GROUP BY r.user_id, r.example_id
+    ''')
+
+
+# (version, description, function); append only
+MIGRATIONS = [
+    (1, 'initial schema', _initial_schema),
+    (2, 'ratings browser indexes', _ratings_browser_indexes),
+    (3, 'rating aggregate tables', _rating_aggregates),
+    (4, 'covering indexes for evaluator queries', _covering_indexes),
+    (5, 'example index columns', _example_index_columns),
+    (6, 'progress versions', _progress_versions),
+    (7, 'dataset generation', _dataset_generation),
+    (8, 'compressed blob store for example texts', _blob_store),
+    (9, 'incremental model leaderboard', _leaderboard),
+    (10, 'versioned datasets', _versioned_datasets),
+    (11, 'background jobs', _background_jobs),
+    (12, 'work assignment scheduler', _work_assignment),
+    (13, 'rating event log', _rating_events),
+    (14, 'dataset file fingerprints', _dataset_fingerprints),
+    (15, 'per-user coverage', _user_coverage),
+]
+
+
+def current_version(conn):
+    """Return the highest applied migration version (0 for a new database)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TEXT NOT NULL
+        )
+    ''')
+    return conn.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version').fetchone()[0]
+
+
+def migrate(conn):
+    """Apply pending migrations; returns the list of versions applied
+
+    Each migration re-checks the version under BEGIN IMMEDIATE, so several
+    processes starting at once apply every migration exactly once.
+    """
+    applied = []
+    for version, description, apply in MIGRATIONS:
+        if version <= current_version(conn):
+            continue
+
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if version > current_version(conn):
+                apply(conn)
+                conn.execute(
+                    'INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)',
+                    (version, description, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+                )
+                applied.append(version)
+            conn.execute('COMMIT')
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+    return applied
+
+
+# Representative calls for every hot query path:
+# (Database method, args, tables or aliases allowed to be scanned). Ratings
+# pages may walk the timestamp index in order since they stop after LIMIT rows.
+# Rating writes scan json_each over the responses of the one example rated.
+PLAN_CHECKS = [
+    ('get_user_by_id', (1,), ()),
+    ('get_user_identity', (1,), ()),
+    ('verify_user', ('evaluator', 'password'), ()),
+    ('get_categories', (), ()),
+    ('get_examples_by_category', ('category',), ()),
+    ('get_example_by_id', (1,), ()),
+    ('get_example_index', ('category',), ()),
+    ('get_example_etag', (1,), ()),
+    ('save_rating', (1, 1, 'model', 3), ('json_each',)),
+    ('save_ratings', (1, [(1, 'model', 4), (2, 'model', 5)]), ('json_each',)),
+    ('get_user_ratings', (1,), ()),
+    ('get_user_ratings', (1, 'category'), ()),
+    ('get_user_progress', (1, 'category'), ()),
+    ('get_progress_version', (1,), ()),
+    ('get_progress_changes', (1, 'category', 0), ()),
+    ('get_ratings_page', (50,), ('r',)),
+    ('get_ratings_page', (50, ('2024-01-01 00:00:00', 10)), ()),
+    ('get_ratings_page', (50, None, 'model'), ()),
+    ('get_ratings_page', (50, None, None, 'category'), ('r',)),
+    ('get_ratings_page', (50, None, None, None, 'evaluator'), ()),
+    ('count_ratings', (), ('stats_model',)),
+    ('count_ratings', ('model',), ()),
+    ('count_ratings', (None, 'category'), ()),
+    ('count_ratings', (None, None, 'evaluator'), ()),
+    ('count_ratings', (None, 'category', 'evaluator'), ()),
+    ('get_aggregated_stats', (), ('stats_model', 'stats_category', 'stats_category_model')),
+    ('get_leaderboard', (), ('leaderboard_models', 'leaderboard_pairs')),
+    ('iter_all_ratings', (), ()),
+    ('iter_all_ratings', (1000, 1), ()),
+    ('iter_rating_batches', (), ()),
+    ('iter_rating_batches', (1000, 1, True), ()),
+    ('get_rating_events', (), ()),
+    ('get_rating_events', (100, 50), ()),
+    ('iter_rating_events', (0, 100), ()),
+    ('get_last_event_seq', (), ()),
+    ('get_dataset_fingerprint', ('/data/dataset.json',), ('datasets',)),
+    ('get_live_version', (), ()),
+    ('get_live_state', (3,), ('stats_model', 'stats_category', 'stats_category_model',
+                              'leaderboard_models', 'leaderboard_pairs', 'coverage')),
+    ('get_dataset_versions', (), ('datasets',)),
+    ('get_assignment', (1, 'category', 3), ()),
+    ('next_example', (1, 'category', 3, 900), ()),
+    ('next_example', (1, 'category', 3, 900, 1), ()),
+    ('get_coverage_summary', (3,), ('coverage',)),
+    ('enqueue_job', ('export_ratings', {'format': 'csv'}), ()),
+    ('claim_job', ('worker', 1), ()),
+    ('report_job_progress', (1, 100), ()),
+    ('recover_jobs', (3,), ()),
+    ('get_jobs', (), ('jobs',)),
+]
+
+
+def _plan_problems(conn, sql, allowed_scans):
+    """Return EXPLAIN QUERY PLAN lines that indicate a full scan or a sort"""
+    problems = []
+    for row in conn.execute('EXPLAIN QUERY PLAN ' + sql):
+        detail = row[3]
+        if detail.startswith('SCAN ') and detail.split()[1] not in allowed_scans:
+            if 'CONSTANT ROW' not in detail:
+                problems.append(detail)
+        elif 'TEMP B-TREE' in detail:
+            problems.append(detail)
+    return problems
+
+
+def check_query_plans(db_factory):
+    """Run each PLAN_CHECKS call on a scratch database and explain every statement
+
+    `db_factory(path)` must return a Database for `path`. The calls run against
+    a freshly migrated scratch database so the check validates the migrations
+    and the queries together. Returns a list of (call, sql, problem lines).
+    """
+    tmp = tempfile.mkdtemp()
+    failures = []
+    try:
+        db = db_factory(os.path.join(tmp, 'plans.db'))
+        db.pool.close()
+
+        # A single pooled connection with tracing captures each method's SQL
+        statements = []
+        conn = db.pool.acquire()
+        conn.set_trace_callback(statements.append)
+        db.pool.release(conn)
+
+        for method, args, allowed_scans in PLAN_CHECKS:
+            statements.clear()
+            result = getattr(db, method)(*args)
+            if hasattr(result, '__next__'):
+                list(result)
+
+            call = f'{method}{args}'
+            for sql in list(statements):
+                if sql.split(None, 1)[0].upper() not in ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH'):
+                    continue
+                problems = _plan_problems(conn, sql, allowed_scans)
+                if problems:
+                    failures.append((call, ' '.join(sql.split()), problems))
+
+        conn.set_trace_callback(None)
+        db.close()
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return failures
@@ -1,237 +1,677 @@
 import sqlite3
-import json
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
+from functools import wraps
+from flask import g, has_app_context
+from app import analytics, blobs, datasets, events, jobs, leaderboard, migrations, render, scheduler, stats
+from app.datasets import ACTIVE_RATING, ACTIVE_VERSION
+from app.cache import LRUCache, TTLCache
+from app.ingest import serialize_example, source_hash
+from app.passwords import PasswordHasher
+
+# Per-connection cache of compiled statements; persistent connections keep it warm
+STATEMENT_CACHE_SIZE = 256
+
+# Upper bound for keyset pagination over INTEGER PRIMARY KEY columns
+MAX_ROWID = 2 ** 63 - 1
+
+# Examples written per transaction while building a dataset version; bounds how
+# long a load holds the write lock that rating writes also need
+DATASET_WRITE_BATCH = 250
+
+_MISSING = object()
+
+
+def _is_lock_error(error):
+    """Check whether an OperationalError was caused by lock contention"""
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
+
+
+def retry_on_locked(f):
+    """Retry a database operation with backoff while SQLite reports lock contention"""
+    @wraps(f)
+    def decorated_function(self, *args, **kwargs):
+        delay = self.retry_delay
+        for attempt in range(self.lock_retries + 1):
+            try:
+                return f(self, *args, **kwargs)
+            except sqlite3.OperationalError as e:
+                if attempt == self.lock_retries or not _is_lock_error(e):
+                    raise
+                if self.metrics is not None:
+                    self.metrics.lock_retries.inc((f.__name__,))
+                time.sleep(delay * (1 + random.random()))
+                delay *= 2
+    return decorated_function
+
+
+def _batched(items, size):
+    """Group an iterable into lists of at most `size` items"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class ConnectionPool:
+    """Thread-safe pool of persistent SQLite connections"""
+
+    def __init__(self, connect, size=8):
+        self._connect = connect
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def acquire(self):
+        """Take an idle connection or open a new one"""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def release(self, conn):
+        """Return a connection to the pool, closing it if the pool is full"""
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def idle_count(self):
+        """Number of idle connections"""
+        return self._idle.qsize()
+
+    def close(self):
+        """Close all idle connections"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            conn.close()
+
 
 class Database:
     """Database handler for SQLite operations"""
 
-    def __init__(self, db_path):
+    def __init__(self, db_path, pool_size=8, busy_timeout=5.0, synchronous='NORMAL',
+                 cache_size_kb=16384, mmap_size=268435456, lock_retries=5, retry_delay=0.01,
+                 hasher=None, user_cache_ttl=60.0, user_cache_size=4096, dataset_cache_size=1024,
+                 blob_codec='auto', blob_level=None, render_html=False, render_workers=None, metrics=None):
         self.db_path = db_path
+        self.busy_timeout = busy_timeout
+        self.synchronous = synchronous
+        self.cache_size_kb = cache_size_kb
+        self.mmap_size = mmap_size
+        self.lock_retries = lock_retries
+        self.retry_delay = retry_delay
+        self.hasher = hasher or PasswordHasher()
+        self.user_cache = TTLCache(user_cache_size, user_cache_ttl)
+        self.dataset_cache = LRUCache(dataset_cache_size)
+        self.blob_codec = blobs.resolve_codec(blob_codec)
+        self.blob_level = blob_level
+        self.render_html = render_html and render.available()
+        self.render_workers = render_workers
+        self._analytics = None
+        self._analytics_lock = threading.Lock()
+        self.metrics = metrics
+        self.pool = ConnectionPool(self.get_connection, pool_size)
+        if metrics is not None:
+            metrics.instrument_database(self)
         self.init_db()
 
     def get_connection(self):
-        """Get database connection"""
-        conn = sqlite3.connect(self.db_path)
+        """Open a new tuned database connection"""
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE
+        )
         conn.row_factory = sqlite3.Row
+        conn.execute(f'PRAGMA synchronous = {self.synchronous}')
+        conn.execute(f'PRAGMA cache_size = -{int(self.cache_size_kb)}')
+        conn.execute(f'PRAGMA mmap_size = {int(self.mmap_size)}')
+        conn.execute('PRAGMA temp_store = MEMORY')
         return conn
 
-    def init_db(self):
-        """Initialize database schema"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-
-        # Users table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                password_hash TEXT NOT NULL,
-                role TEXT NOT NULL CHECK(role IN ('evaluator', 'admin'))
-            )
-        ''')
-
-        # Examples table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS examples (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                example_id INTEGER UNIQUE NOT NULL,
-                category TEXT NOT NULL,
-                history TEXT NOT NULL,
-                responses TEXT NOT NULL
-            )
-        ''')
-
-        # Ratings table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS ratings (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                example_id INTEGER NOT NULL,
-                model_name TEXT NOT NULL,
-                rating INTEGER NOT NULL CHECK(rating >= 1 AND rating <= 5),
-                timestamp TEXT NOT NULL,
-                FOREIGN KEY (user_id) REFERENCES users(id),
-                FOREIGN KEY (example_id) REFERENCES examples(example_id),
-                UNIQUE(user_id, example_id, model_name)
-            )
-        ''')
+    @contextmanager
+    def connection(self):
+        """Borrow a pooled connection, shared for the lifetime of the Flask app context"""
+        if not has_app_context():
+            conn = self._acquire()
+            try:
+                yield conn
+            finally:
+                self.pool.release(conn)
+            return
+
+        connections = g.setdefault('_db_connections', {})
+        conn = connections.get(self)
+        if conn is None:
+            conn = connections[self] = self._acquire()
+        yield conn
+
+    def _acquire(self):
+        """Take a pooled connection, timing the wait when metrics are enabled"""
+        if self.metrics is None:
+            return self.pool.acquire()
+        start = time.perf_counter()
+        conn = self.pool.acquire()
+        self.metrics.connection_waits.observe((), time.perf_counter() - start)
+        return conn
+
+    def release_request_connection(self, exc=None):
+        """Return the app-context connection to the pool (teardown handler)"""
+        conn = g.get('_db_connections', {}).pop(self, None)
+        if conn is not None:
+            self.pool.release(conn)
 
-        conn.commit()
-        conn.close()
+    @contextmanager
+    def transaction(self):
+        """Run a block inside a BEGIN IMMEDIATE write transaction"""
+        with self.connection() as conn:
+            if self.metrics is None:
+                conn.execute('BEGIN IMMEDIATE')
+            else:
+                start = time.perf_counter()
+                conn.execute('BEGIN IMMEDIATE')
+                self.metrics.lock_waits.observe((), time.perf_counter() - start)
+            try:
+                yield conn
+                conn.execute('COMMIT')
+            except BaseException:
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                raise
+
+    def close(self):
+        """Close pooled connections and hashing workers (e.g. before forking worker processes)"""
+        self.pool.close()
+        self.hasher.close()
+
+    def init_db(self):
+        """Initialize database schema by applying pending migrations"""
+        with self.connection() as conn:
+            # WAL lets readers proceed while a rating write is in progress
+            conn.execute('PRAGMA journal_mode = WAL')
+            migrations.migrate(conn)
 
     def create_user(self, username, password, role='evaluator'):
         """Create a new user"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        password_hash = generate_password_hash(password)
+        password_hash = self.hasher.hash(password)
+        return self._insert_user(username, password_hash, role)
 
+    @retry_on_locked
+    def _insert_user(self, username, password_hash, role):
+        """Insert a user row; returns None if the username is taken"""
         try:
-            cursor.execute(
-                'INSERT INTO users (username, password_hash, role) VALUES (?, ?, ?)',
-                (username, password_hash, role)
-            )
-            conn.commit()
-            user_id = cursor.lastrowid
-            conn.close()
-            return user_id
+            with self.transaction() as conn:
+                cursor = conn.execute(
+                    'INSERT INTO users (username, password_hash, role) VALUES (?, ?, ?)',
+                    (username, password_hash, role)
+                )
+                return cursor.lastrowid
         except sqlite3.IntegrityError:
-            conn.close()
             return None
 
     def verify_user(self, username, password):
-        """Verify user credentials"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM users WHERE username = ?', (username,))
-        user = cursor.fetchone()
-        conn.close()
-
-        if user and check_password_hash(user['password_hash'], password):
-            return dict(user)
-        return None
+        """Verify user credentials, upgrading hashes made with outdated parameters"""
+        with self.connection() as conn:
+            user = conn.execute('SELECT * FROM users WHERE username = ?', (username,)).fetchone()
+
+        if not user or not self.hasher.verify(user['password_hash'], password):
+            return None
+
+        if self.hasher.needs_rehash(user['password_hash']):
+            self._replace_password_hash(user['id'], user['password_hash'], self.hasher.hash(password))
+        return dict(user)
+
+    @retry_on_locked
+    def _replace_password_hash(self, user_id, old_hash, new_hash):
+        """Swap a password hash unless it was changed concurrently"""
+        with self.transaction() as conn:
+            conn.execute(
+                'UPDATE users SET password_hash = ? WHERE id = ? AND password_hash = ?',
+                (new_hash, user_id, old_hash)
+            )
+        self.user_cache.pop(user_id)
+
+    def update_user(self, user_id, password=None, role=None):
+        """Change a user's password and/or role; returns False if the user does not exist"""
+        password_hash = self.hasher.hash(password) if password is not None else None
+        updated = self._update_user(user_id, password_hash, role)
+        self.user_cache.pop(user_id)
+        return updated
+
+    @retry_on_locked
+    def _update_user(self, user_id, password_hash, role):
+        """Write the changed user columns"""
+        with self.transaction() as conn:
+            cursor = conn.execute(
+                '''UPDATE users
+                   SET password_hash = COALESCE(?, password_hash), role = COALESCE(?, role)
+                   WHERE id = ?''',
+                (password_hash, role, user_id)
+            )
+            return cursor.rowcount > 0
 
     def get_user_by_id(self, user_id):
         """Get user by ID"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM users WHERE id = ?', (user_id,))
-        user = cursor.fetchone()
-        conn.close()
+        with self.connection() as conn:
+            user = conn.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
         return dict(user) if user else None
 
-    def load_dataset(self, dataset):
-        """Load dataset into database"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-
-        # Clear existing examples
-        cursor.execute('DELETE FROM examples')
-
-        for item in dataset:
-            cursor.execute(
-                'INSERT INTO examples (example_id, category, history, responses) VALUES (?, ?, ?, ?)',
-                (
-                    item['example_id'],
-                    item['category'],
-                    json.dumps(item['history'], ensure_ascii=False),
-                    json.dumps(item['responses'], ensure_ascii=False)
+    def get_user_identity(self, user_id):
+        """Get a user's id, username and role, cached for `user_cache_ttl` seconds"""
+        identity = self.user_cache.get(user_id)
+        if identity is None:
+            with self.connection() as conn:
+                row = conn.execute(
+                    'SELECT id, username, role FROM users WHERE id = ?', (user_id,)
+                ).fetchone()
+            if row is None:
+                return None
+            identity = dict(row)
+            self.user_cache.set(user_id, identity)
+        return identity
+
+    def load_dataset(self, dataset, batch_size=1000, progress=None, source=None, fingerprint=None):
+        """Build a new dataset version and activate it; returns the number of examples loaded
+
+        The version is written in one short transaction per batch while the
+        active version keeps serving, so evaluator reads and rating writes are
+        only ever held up by a single batch. Nothing sees the new version until
+        activate_dataset swaps it in. A failed load leaves the active version
+        untouched. `fingerprint` is the (size, mtime_ns, sha256) of the source
+        file, stored with the version so that an unchanged file is not loaded again.
+        """
+        # Not retried as a whole: `dataset` may be a one-shot stream
+        with self.transaction() as conn:
+            base = datasets.active_version(conn)
+            version = datasets.begin(conn, source)
+
+        count = changed = 0
+        try:
+            batches = _batched(dataset, batch_size)
+            if self.render_html:
+                # Markdown/LaTeX is rendered on worker processes, one batch ahead
+                batches = render.render_batches(batches, self.render_workers)
+
+            for batch in batches:
+                for chunk in _batched(batch, DATASET_WRITE_BATCH):
+                    changed += self._add_examples(version, base, chunk)
+                count += len(batch)
+                if progress:
+                    progress(count)
+
+            with self.transaction() as conn:
+                datasets.finish(conn, version, count, changed)
+                if fingerprint:
+                    datasets.record_file(conn, version, *fingerprint)
+        except BaseException:
+            with self.transaction() as conn:
+                datasets.fail(conn, version)
+            raise
+
+        self.activate_dataset(version)
+        return count
+
+    @retry_on_locked
+    def _add_examples(self, version, base, items):
+        """Add a batch of validated items to a version being built; returns how many have new content
+
+        Items whose content is unchanged from version `base` reuse its example
+        rows; only new content is stored. Serialization, the unchanged-content
+        lookup and text compression happen before the write lock is taken, so
+        the transaction only inserts rows.
+        """
+        rows = [serialize_example(item) for item in items]
+        sources = [source_hash(item, row[5]) for item, row in zip(items, rows)]
+        example_ids = [row[0] for row in rows]
+
+        def changed(current):
+            return [i for i, row in enumerate(rows) if current.get(row[0], (None, None))[1] != row[5]]
+
+        with self.connection() as conn:
+            new = changed(datasets.current_rows(conn, base, example_ids))
+        compressed = blobs.compress_texts([items[i] for i in new], self.blob_codec, self.blob_level)
+
+        with self.transaction() as conn:
+            # Re-read in case the base version was dropped meanwhile
+            current = datasets.current_rows(conn, base, example_ids)
+            new = changed(current)
+            writer = blobs.BlobWriter(conn, self.blob_codec, self.blob_level)
+
+            example_rows = {example_id: current[example_id][0] for example_id in example_ids if example_id in current}
+            packed = writer.pack([items[i] for i in new], compressed)
+            for i, (history, responses) in zip(new, packed):
+                example_id, category, _, _, num_responses, digest = rows[i]
+                cursor = conn.execute(
+                    '''INSERT INTO examples
+                       (example_id, category, history, responses, num_responses, content_hash, source_hash)
+                       VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                    (example_id, category, history, responses, num_responses, digest, sources[i])
                 )
+                example_rows[example_id] = cursor.lastrowid
+
+            conn.executemany(
+                '''INSERT INTO dataset_examples (version, example_id, category, source_hash, example_row)
+                   VALUES (?, ?, ?, ?, ?)''',
+                [(version, row[0], row[1], source, example_rows[row[0]]) for row, source in zip(rows, sources)]
             )
+        return len(new)
 
-        conn.commit()
-        conn.close()
+    def activate_dataset(self, version):
+        """Atomically make a built version the active dataset; returns False if it is not ready
+
+        The stats, leaderboard and coverage tables follow the active version:
+        the ratings of contents that the two versions do not share are removed
+        or added in the same transaction as the pointer swap. Which contents differ, and
+        the ratings of the incoming ones (which cannot be rated while they are
+        inactive), are read before the write lock is taken, so the swap itself
+        costs O(ratings of changed examples), not O(dataset).
+        """
+        with self.connection() as conn:
+            previous = datasets.active_version(conn)
+            leaving = datasets.diff(conn, previous, version)
+            contents = datasets.diff(conn, version, previous)
+            entering = datasets.ratings_of(conn, contents)
+
+        with self.transaction() as conn:
+            if datasets.status(conn, version) != 'ready':
+                return False
+            if datasets.active_version(conn) != previous:
+                # Another version was activated meanwhile
+                previous = datasets.active_version(conn)
+                leaving = datasets.diff(conn, previous, version)
+                contents = datasets.diff(conn, version, previous)
+                entering = datasets.ratings_of(conn, contents)
+
+            for ratings, sign in ((datasets.ratings_of(conn, leaving), -1), (entering, 1)):
+                stats.apply_ratings(conn, [(model, category, rating) for _, _, model, rating, category in ratings], sign)
+                leaderboard.apply_ratings(conn, [rating[:4] for rating in ratings], sign)
+            scheduler.remove_contents(conn, leaving)
+            scheduler.add_contents(conn, version, contents, entering)
+
+            # Invalidates cached examples in every process
+            datasets.activate(conn, version)
+        return True
+
+    def get_dataset_versions(self):
+        """List dataset versions, newest first"""
+        with self.connection() as conn:
+            return datasets.versions(conn)
+
+    def drop_dataset(self, version):
+        """Delete an inactive version, its unshared examples and unreferenced texts
+
+        Returns False for the active version or an unknown one. Collecting
+        unreferenced texts reads every example row, so this is a maintenance
+        operation rather than a request-path one.
+        """
+        with self.transaction() as conn:
+            if datasets.status(conn, version) is None or datasets.active_version(conn) == version:
+                return False
+            datasets.drop(conn, version)
+            blobs.collect_garbage(conn)
+        return True
+
+    def get_dataset_fingerprint(self, source):
+        """The newest ready version loaded from a file, with that file's size, mtime and hash"""
+        with self.connection() as conn:
+            return datasets.last_load(conn, source)
+
+    @retry_on_locked
+    def touch_dataset_fingerprint(self, version, size, mtime_ns):
+        """Remember the new mtime of a version's file whose content did not change"""
+        with self.transaction() as conn:
+            datasets.touch(conn, version, size, mtime_ns)
+
+    @retry_on_locked
+    def abandon_dataset_builds(self, source):
+        """Fail versions of `source` left half-built by a load whose process died"""
+        with self.transaction() as conn:
+            return datasets.abandon(conn, source)
+
+    def _dataset_cached(self, key, load):
+        """Return `load(conn)`, cached until the next dataset load
+
+        Entries are tagged with the dataset generation they were read under,
+        which activate_dataset bumps in the same transaction that swaps the
+        active version, so an entry is never served after the data it was read
+        from has changed in any process. Cached values are shared between
+        requests and must not be modified.
+        """
+        with self.connection() as conn:
+            # One read transaction: the generation and the loaded data match
+            conn.execute('BEGIN')
+            try:
+                generation = conn.execute(
+                    "SELECT value FROM meta WHERE key = 'dataset_generation'"
+                ).fetchone()[0]
+                self.dataset_cache.advance(generation)
+
+                value = self.dataset_cache.get(key, _MISSING, generation)
+                if value is _MISSING:
+                    value = load(conn)
+                    self.dataset_cache.set(key, value, generation)
+            finally:
+                conn.execute('COMMIT')
+            return value
+
+    def get_dataset_cache_stats(self):
+        """Get entry count and hit/miss counters of this process's dataset cache"""
+        return self.dataset_cache.stats()
 
     def get_categories(self):
         """Get all unique categories"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT DISTINCT category FROM examples ORDER BY category')
-        categories = [row['category'] for row in cursor.fetchall()]
-        conn.close()
-        return categories
+        return self._dataset_cached(('categories',), self._load_categories)
+
+    def _load_categories(self, conn):
+        """Read the distinct categories"""
+        rows = conn.execute(
+            f'SELECT DISTINCT category FROM dataset_examples WHERE version = {ACTIVE_VERSION} ORDER BY category'
+        ).fetchall()
+        return [row['category'] for row in rows]
 
     def get_examples_by_category(self, category):
         """Get all examples for a specific category"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            'SELECT * FROM examples WHERE category = ? ORDER BY example_id',
-            (category,)
-        )
-        examples = []
-        for row in cursor.fetchall():
-            example = dict(row)
-            example['history'] = json.loads(example['history'])
-            example['responses'] = json.loads(example['responses'])
-            examples.append(example)
-        conn.close()
-        return examples
+        return self._dataset_cached(
+            ('examples', category), lambda conn: self._load_examples_by_category(conn, category))
+
+    def _load_examples_by_category(self, conn, category):
+        """Read and parse a category's examples"""
+        rows = conn.execute(f'''
+            SELECT e.* FROM dataset_examples m
+            JOIN examples e ON e.id = m.example_row
+            WHERE m.version = {ACTIVE_VERSION} AND m.category = ?
+            ORDER BY m.example_id
+        ''', (category,)).fetchall()
+        return blobs.unpack(conn, [dict(row) for row in rows])
+
+    def get_example_index(self, category):
+        """Get example ids and response counts for a category, without loading content"""
+        return self._dataset_cached(
+            ('index', category), lambda conn: self._load_example_index(conn, category))
+
+    def _load_example_index(self, conn, category):
+        """Read a category's example ids and response counts"""
+        rows = conn.execute(f'''
+            SELECT m.example_id, e.num_responses FROM dataset_examples m
+            JOIN examples e ON e.id = m.example_row
+            WHERE m.version = {ACTIVE_VERSION} AND m.category = ?
+            ORDER BY m.example_id
+        ''', (category,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def get_example_etag(self, example_id):
+        """Get the content hash of an example (None if it does not exist)"""
+        with self.connection() as conn:
+            row = conn.execute(f'''
+                SELECT e.content_hash FROM dataset_examples m
+                JOIN examples e ON e.id = m.example_row
+                WHERE m.version = {ACTIVE_VERSION} AND m.example_id = ?
+            ''', (example_id,)).fetchone()
+        return row['content_hash'] if row else None
 
     def get_example_by_id(self, example_id):
         """Get a specific example by example_id"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM examples WHERE example_id = ?', (example_id,))
-        row = cursor.fetchone()
-        conn.close()
+        return self._dataset_cached(
+            ('example', example_id), lambda conn: self._load_example(conn, example_id))
 
+    def _load_example(self, conn, example_id):
+        """Read and parse one example"""
+        row = conn.execute(f'''
+            SELECT e.* FROM dataset_examples m
+            JOIN examples e ON e.id = m.example_row
+            WHERE m.version = {ACTIVE_VERSION} AND m.example_id = ?
+        ''', (example_id,)).fetchone()
         if row:
-            example = dict(row)
-            example['history'] = json.loads(example['history'])
-            example['responses'] = json.loads(example['responses'])
-            return example
+            return blobs.unpack(conn, [dict(row)])[0]
         return None
 
+    @retry_on_locked
     def save_rating(self, user_id, example_id, model_name, rating):
-        """Save or update a rating"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        """Save or update a rating; returns the user's new progress version
+
+        Returns None, saving nothing, if the example is not in the active
+        dataset or has no response from `model_name`.
+        """
+        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+        with self.transaction() as conn:
+            return self._write_rating(conn, user_id, example_id, model_name, rating, timestamp)
+
+    @retry_on_locked
+    def save_ratings(self, user_id, ratings):
+        """Save or update a batch of (example_id, model_name, rating) in one transaction
+
+        Returns (version, saved): the user's new progress version (None if
+        nothing was saved) and, per rating, whether it was saved. Ratings of
+        examples that are not in the active dataset, or of models the example
+        has no response from, are skipped.
+        """
         timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
-        cursor.execute(
-            '''INSERT OR REPLACE INTO ratings
-               (user_id, example_id, model_name, rating, timestamp)
-               VALUES (?, ?, ?, ?, ?)''',
-            (user_id, example_id, model_name, rating, timestamp)
+        version = None
+        saved = []
+        with self.transaction() as conn:
+            for example_id, model_name, rating in ratings:
+                written = self._write_rating(conn, user_id, example_id, model_name, rating, timestamp)
+                saved.append(written is not None)
+                version = written or version
+        return version, saved
+
+    def _write_rating(self, conn, user_id, example_id, model_name, rating, timestamp):
+        """Write one rating and update everything derived from it (inside a transaction)
+
+        The rating is tied to the example's content in the active dataset.
+        Returns the user's new progress version, or None if the example is not
+        in the active dataset or has no response from `model_name`.
+        """
+        example = conn.execute(f'''
+            SELECT m.category, m.source_hash,
+                   EXISTS (SELECT 1 FROM json_each(e.responses) WHERE json_extract(value, '$.model') = ?) AS has_model
+            FROM dataset_examples m
+            JOIN examples e ON e.id = m.example_row
+            WHERE m.version = {ACTIVE_VERSION} AND m.example_id = ?
+        ''', (model_name, example_id)).fetchone()
+        if example is None or not example['has_model']:
+            return None
+
+        old = conn.execute(
+            '''SELECT rating FROM ratings
+               WHERE user_id = ? AND example_id = ? AND source_hash = ? AND model_name = ?''',
+            (user_id, example_id, example['source_hash'], model_name)
+        ).fetchone()
+
+        conn.execute(
+            'UPDATE users SET progress_version = progress_version + 1 WHERE id = ?', (user_id,)
         )
+        version = self._progress_version(conn, user_id)
 
-        conn.commit()
-        conn.close()
+        # Updated in place: the rating keeps its id, and its earlier values stay in the event log
+        conn.execute(
+            '''INSERT INTO ratings
+               (user_id, example_id, source_hash, model_name, rating, timestamp, user_seq)
+               VALUES (?, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT (user_id, example_id, source_hash, model_name) DO UPDATE SET
+                   rating = excluded.rating, timestamp = excluded.timestamp, user_seq = excluded.user_seq''',
+            (user_id, example_id, example['source_hash'], model_name, rating, timestamp, version)
+        )
+        events.append(
+            conn, user_id, example_id, example['category'], example['source_hash'], model_name,
+            rating, old['rating'] if old else None, timestamp
+        )
+        stats.apply_rating(
+            conn, model_name, example['category'],
+            old['rating'] if old else None,
+            rating
+        )
+        leaderboard.apply_rating(
+            conn, user_id, example_id, example['source_hash'], model_name,
+            old['rating'] if old else None,
+            rating
+        )
+        if old is None:
+            scheduler.apply_rating(conn, user_id, example_id, example['source_hash'], model_name)
+        return version
 
     def get_user_ratings(self, user_id, category=None):
-        """Get all ratings for a user, optionally filtered by category"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-
-        if category:
-            cursor.execute('''
-                SELECT r.*, e.category
-                FROM ratings r
-                JOIN examples e ON r.example_id = e.example_id
-                WHERE r.user_id = ? AND e.category = ?
-            ''', (user_id, category))
-        else:
-            cursor.execute('''
-                SELECT r.*, e.category
-                FROM ratings r
-                JOIN examples e ON r.example_id = e.example_id
-                WHERE r.user_id = ?
-            ''', (user_id,))
+        """Get all of a user's ratings in the active dataset, optionally filtered by category"""
+        with self.connection() as conn:
+            if category:
+                rows = conn.execute(f'''
+                    SELECT r.*, m.category
+                    FROM ratings r
+                    JOIN dataset_examples m ON {ACTIVE_RATING}
+                    WHERE r.user_id = ? AND m.category = ?
+                ''', (user_id, category)).fetchall()
+            else:
+                rows = conn.execute(f'''
+                    SELECT r.*, m.category
+                    FROM ratings r
+                    JOIN dataset_examples m ON {ACTIVE_RATING}
+                    WHERE r.user_id = ?
+                ''', (user_id,)).fetchall()
 
-        ratings = [dict(row) for row in cursor.fetchall()]
-        conn.close()
-        return ratings
+        return [dict(row) for row in rows]
 
     def get_user_progress(self, user_id, category):
         """Get evaluation progress for a user in a specific category"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-
-        # Get all examples in category
-        cursor.execute(
-            'SELECT example_id FROM examples WHERE category = ? ORDER BY example_id',
-            (category,)
-        )
-        examples = [row['example_id'] for row in cursor.fetchall()]
+        with self.connection() as conn:
+            # Get all examples in category
+            examples = [row['example_id'] for row in conn.execute(
+                f'''SELECT example_id FROM dataset_examples
+                    WHERE version = {ACTIVE_VERSION} AND category = ? ORDER BY example_id''',
+                (category,)
+            )]
 
-        # Get ratings for this user and category
-        cursor.execute('''
-            SELECT r.example_id, r.model_name, r.rating
-            FROM ratings r
-            JOIN examples e ON r.example_id = e.example_id
-            WHERE r.user_id = ? AND e.category = ?
-        ''', (user_id, category))
+            # Get ratings for this user and category
+            rows = conn.execute(f'''
+                SELECT r.example_id, r.model_name, r.rating
+                FROM ratings r
+                JOIN dataset_examples m ON {ACTIVE_RATING}
+                WHERE r.user_id = ? AND m.category = ?
+            ''', (user_id, category)).fetchall()
 
         ratings = {}
-        for row in cursor.fetchall():
+        for row in rows:
             ex_id = row['example_id']
             if ex_id not in ratings:
                 ratings[ex_id] = {}
             ratings[ex_id][row['model_name']] = row['rating']
 
-        conn.close()
-
         progress = []
         for ex_id in examples:
             progress.append({
@@ -241,56 +681,389 @@ class Database:
 
         return progress
 
+    def _progress_version(self, conn, user_id):
+        """Read a user's progress version on the given connection"""
+        row = conn.execute('SELECT progress_version FROM users WHERE id = ?', (user_id,)).fetchone()
+        return row['progress_version'] if row else 0
+
+    def get_progress_version(self, user_id):
+        """Get the user's progress version (incremented on every rating write)"""
+        with self.connection() as conn:
+            return self._progress_version(conn, user_id)
+
+    def get_progress_changes(self, user_id, category, since):
+        """Get the user's ratings in a category written after progress version `since`
+
+        Returns (version, changes). Read the version before calling any other
+        progress query so a concurrent write is re-sent rather than missed.
+        """
+        with self.connection() as conn:
+            version = self._progress_version(conn, user_id)
+            rows = conn.execute(f'''
+                SELECT r.example_id, r.model_name, r.rating
+                FROM ratings r
+                JOIN dataset_examples m ON {ACTIVE_RATING}
+                WHERE r.user_id = ? AND r.user_seq > ? AND m.category = ?
+            ''', (user_id, since, category)).fetchall()
+        return version, [dict(row) for row in rows]
+
     def get_all_ratings(self):
-        """Get all ratings (for admin)"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT r.*, e.category, u.username as evaluator_username
+        """Get all ratings in the active dataset (for admin)"""
+        with self.connection() as conn:
+            rows = conn.execute(f'''
+                SELECT r.*, m.category, u.username as evaluator_username
+                FROM ratings r
+                JOIN dataset_examples m ON {ACTIVE_RATING}
+                JOIN users u ON r.user_id = u.id
+                ORDER BY r.timestamp DESC
+            ''').fetchall()
+        return [dict(row) for row in rows]
+
+    def iter_all_ratings(self, chunk_size=1000, version=None):
+        """Yield the ratings of a dataset version (default: the active one), most recently created first
+
+        Reads keyset-paginated chunks by rating id. Older versions keep the
+        ratings of contents that have since changed or been removed.
+        """
+        match = datasets.rating_in('r', '?') if version else ACTIVE_RATING
+        last_id = MAX_ROWID
+        while True:
+            with self.connection() as conn:
+                # CROSS JOIN keeps ratings as the outer loop, read in rating id order
+                rows = conn.execute(f'''
+                    SELECT r.*, m.category, u.username as evaluator_username
+                    FROM ratings r
+                    CROSS JOIN dataset_examples m ON {match}
+                    CROSS JOIN users u ON r.user_id = u.id
+                    WHERE r.id < ?
+                    ORDER BY r.id DESC
+                    LIMIT ?
+                ''', ((version,) if version else ()) + (last_id, chunk_size)).fetchall()
+
+            for row in rows:
+                yield dict(row)
+
+            if len(rows) < chunk_size:
+                return
+            last_id = rows[-1]['id']
+
+    def iter_rating_batches(self, batch_size=1000, version=None, metadata=False):
+        """Yield a dataset version's ratings, most recently created first, as lists of plain tuples for columnar exports
+
+        Rows follow columnar.columns(metadata): timestamps are converted to
+        epoch seconds by SQLite, and `metadata` joins each rating's example
+        content for its source hash, response count and history length.
+        """
+        match = datasets.rating_in('r', '?') if version else ACTIVE_RATING
+        extra, join = '', ''
+        if metadata:
+            extra = ', r.source_hash, e.num_responses, json_array_length(e.history)'
+            join = 'CROSS JOIN examples e ON e.id = m.example_row'
+        last_id = MAX_ROWID
+        while True:
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.row_factory = None
+                rows = cursor.execute(f'''
+                    SELECT r.id, r.example_id, m.category, r.model_name, u.username, r.rating,
+                           CAST(strftime('%s', r.timestamp) AS INTEGER){extra}
+                    FROM ratings r
+                    CROSS JOIN dataset_examples m ON {match}
+                    CROSS JOIN users u ON r.user_id = u.id
+                    {join}
+                    WHERE r.id < ?
+                    ORDER BY r.id DESC
+                    LIMIT ?
+                ''', ((version,) if version else ()) + (last_id, batch_size)).fetchall()
+
+            if rows:
+                yield rows
+            if len(rows) < batch_size:
+                return
+            last_id = rows[-1][0]
+
+    def get_rating_events(self, after=0, limit=events.PAGE_SIZE):
+        """Rating events after sequence number `after`, oldest first; returns (events, last seq read)"""
+        with self.connection() as conn:
+            rows = [dict(row) for row in events.after(conn, after, limit)]
+        return rows, rows[-1]['seq'] if rows else after
+
+    def iter_rating_events(self, after=0, until=None, chunk_size=events.PAGE_SIZE):
+        """Yield the rating events in (after, until] oldest first, one pooled read per chunk"""
+        while True:
+            with self.connection() as conn:
+                rows = events.after(conn, after, chunk_size)
+            for row in rows:
+                if until is not None and row['seq'] > until:
+                    return
+                yield dict(row)
+            if len(rows) < chunk_size:
+                return
+            after = rows[-1]['seq']
+
+    def get_last_event_seq(self):
+        """Sequence number of the newest rating event"""
+        with self.connection() as conn:
+            return events.last_seq(conn)
+
+    def _rating_filters(self, model=None, category=None, evaluator=None):
+        """Build WHERE clauses for the admin rating filters"""
+        where, params = [], []
+        if model:
+            where.append('r.model_name = ?')
+            params.append(model)
+        if category:
+            where.append('m.category = ?')
+            params.append(category)
+        if evaluator:
+            where.append('r.user_id = (SELECT id FROM users WHERE username = ?)')
+            params.append(evaluator)
+        return where, params
+
+    def get_ratings_page(self, limit=50, before=None, model=None, category=None, evaluator=None):
+        """Get one page of the active dataset's ratings newest first, keyset-paginated on (timestamp, id)
+
+        `before` is the (timestamp, id) cursor returned with the previous page.
+        Returns (ratings, next_cursor); next_cursor is None on the last page.
+        """
+        where, params = self._rating_filters(model, category, evaluator)
+        if before:
+            where.append('(r.timestamp, r.id) < (?, ?)')
+            params.extend(before)
+
+        # CROSS JOIN keeps ratings as the outer loop, so rows are read in
+        # index order and the query stops after one page
+        sql = f'''
+            SELECT r.*, m.category, u.username as evaluator_username
             FROM ratings r
-            JOIN examples e ON r.example_id = e.example_id
-            JOIN users u ON r.user_id = u.id
-            ORDER BY r.timestamp DESC
-        ''')
-        ratings = [dict(row) for row in cursor.fetchall()]
-        conn.close()
-        return ratings
+            CROSS JOIN dataset_examples m ON {ACTIVE_RATING}
+            CROSS JOIN users u ON r.user_id = u.id
+        '''
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY r.timestamp DESC, r.id DESC LIMIT ?'
+
+        with self.connection() as conn:
+            rows = conn.execute(sql, params + [limit + 1]).fetchall()
+
+        ratings = [dict(row) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            next_cursor = (ratings[-1]['timestamp'], ratings[-1]['id'])
+        return ratings, next_cursor
+
+    def count_ratings(self, model=None, category=None, evaluator=None):
+        """Count the active dataset's ratings matching the admin filters"""
+        if not evaluator:
+            # Answered from the aggregate tables in O(number of groups)
+            if model and category:
+                sql, params = 'SELECT count FROM stats_category_model WHERE category = ? AND model_name = ?', [category, model]
+            elif model:
+                sql, params = 'SELECT count FROM stats_model WHERE model_name = ?', [model]
+            elif category:
+                sql, params = 'SELECT count FROM stats_category WHERE category = ?', [category]
+            else:
+                sql, params = 'SELECT COALESCE(SUM(count), 0) FROM stats_model', []
+            with self.connection() as conn:
+                row = conn.execute(sql, params).fetchone()
+            return row[0] if row else 0
+
+        where, params = self._rating_filters(model, category, evaluator)
+
+        sql = f'SELECT COUNT(*) FROM ratings r JOIN dataset_examples m ON {ACTIVE_RATING}'
+        if category:
+            sql = f'SELECT COUNT(*) FROM dataset_examples m JOIN ratings r ON {ACTIVE_RATING}'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+
+        with self.connection() as conn:
+            return conn.execute(sql, params).fetchone()[0]
+
+    def _ratings_fingerprint(self, conn):
+        """Changes whenever a rating is written or another dataset version is activated"""
+        # Every rating write bumps its evaluator's progress_version
+        return tuple(conn.execute('''
+            SELECT (SELECT COALESCE(SUM(progress_version), 0) FROM users),
+                   (SELECT value FROM meta WHERE key = 'dataset_generation')
+        ''').fetchone())
+
+    def get_rating_analytics(self, reps=1000, confidence=0.95, workers=None, max_cells=20_000_000):
+        """Agreement and reliability analytics (see app.analytics), recomputed only after ratings change"""
+        # One computation at a time; concurrent callers wait for its result
+        with self._analytics_lock:
+            with self.connection() as conn:
+                key = (self._ratings_fingerprint(conn), reps, confidence)
+                if self._analytics is not None and self._analytics[0] == key:
+                    return self._analytics[1]
+                array = analytics.load_ratings(conn, max_cells)
+            result = analytics.analyze(array, reps, confidence, workers)
+            self._analytics = (key, result)
+            return result
+
+    def get_storage_report(self):
+        """Get logical, deduplicated and compressed sizes of example texts"""
+        with self.connection() as conn:
+            return blobs.report(conn)
 
     def get_aggregated_stats(self):
-        """Get aggregated statistics (for admin)"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-
-        # Average by model
-        cursor.execute('''
-            SELECT model_name, AVG(rating) as avg_rating, COUNT(*) as count
-            FROM ratings
-            GROUP BY model_name
-        ''')
-        by_model = [dict(row) for row in cursor.fetchall()]
-
-        # Average by category
-        cursor.execute('''
-            SELECT e.category, AVG(r.rating) as avg_rating, COUNT(*) as count
-            FROM ratings r
-            JOIN examples e ON r.example_id = e.example_id
-            GROUP BY e.category
-        ''')
-        by_category = [dict(row) for row in cursor.fetchall()]
-
-        # Average by model and category
-        cursor.execute('''
-            SELECT e.category, r.model_name, AVG(r.rating) as avg_rating, COUNT(*) as count
-            FROM ratings r
-            JOIN examples e ON r.example_id = e.example_id
-            GROUP BY e.category, r.model_name
-        ''')
-        by_model_category = [dict(row) for row in cursor.fetchall()]
-
-        conn.close()
-
-        return {
-            'by_model': by_model,
-            'by_category': by_category,
-            'by_model_category': by_model_category
-        }
+        """Get aggregated statistics (for admin) from the materialized aggregate tables"""
+        with self.connection() as conn:
+            return stats.read(conn)
+
+    def get_leaderboard(self, confidence=0.95):
+        """Ranked model leaderboard from the incrementally maintained tables"""
+        with self.connection() as conn:
+            return leaderboard.read(conn, confidence)
+
+    def get_live_state(self, target, confidence=0.95):
+        """What the live dashboard shows besides ratings, read in one snapshot
+
+        The newest rating event and the dataset generation tell the live feed
+        whether anything changed since the state it last sent.
+        """
+        with self.connection() as conn:
+            conn.execute('BEGIN')
+            try:
+                return {
+                    'seq': events.last_seq(conn),
+                    'generation': conn.execute(
+                        "SELECT value FROM meta WHERE key = 'dataset_generation'"
+                    ).fetchone()[0],
+                    'stats': stats.read(conn),
+                    'leaderboard': leaderboard.read(conn, confidence),
+                    'coverage': scheduler.summary(conn, target),
+                }
+            finally:
+                conn.execute('COMMIT')
+
+    def get_live_version(self):
+        """(newest rating event, dataset generation): cheap change detection for the live feed"""
+        with self.connection() as conn:
+            return tuple(conn.execute('''
+                SELECT (SELECT COALESCE(MAX(seq), 0) FROM rating_events),
+                       (SELECT value FROM meta WHERE key = 'dataset_generation')
+            ''').fetchone())
+
+    @retry_on_locked
+    def next_example(self, user_id, category, target, lease_seconds, skip=None):
+        """Lease the example of a category that most needs ratings to an evaluator
+
+        Returns the example id with its coverage and lease expiry, or None when
+        nothing the evaluator has not finished is below the target.
+        """
+        with self.transaction() as conn:
+            return scheduler.next_example(conn, user_id, category, target, lease_seconds, skip)
+
+    def get_assignment(self, user_id, category, target):
+        """An evaluator's current unexpired lease in a category (None if none); a read, unlike next_example"""
+        with self.connection() as conn:
+            return scheduler.current_lease(conn, user_id, category, target)
+
+    def get_coverage(self, target):
+        """Coverage per category against the per-model rating target, and rating throughput"""
+        with self.connection() as conn:
+            return scheduler.report(conn, target)
+
+    def get_coverage_summary(self, target):
+        """Example, complete-example and lease counts (cheap enough for every metrics scrape)"""
+        with self.connection() as conn:
+            return scheduler.summary(conn, target)
+
+    def rebuild_stats(self, check_only=False):
+        """Compare aggregate, leaderboard and coverage tables with a full recompute; repair them unless check_only
+
+        Returns the list of mismatched groups found before any repair.
+        """
+        with self.transaction() as conn:
+            aggregate_mismatches = stats.compare(stats.recompute(conn), stats.stored(conn))
+            leaderboard_mismatches = leaderboard.compare(leaderboard.recompute(conn), leaderboard.stored(conn))
+            coverage_mismatches = scheduler.compare(scheduler.recompute(conn), scheduler.stored(conn))
+            if not check_only:
+                if aggregate_mismatches:
+                    stats.rebuild(conn)
+                if leaderboard_mismatches:
+                    leaderboard.rebuild(conn)
+                if coverage_mismatches:
+                    scheduler.rebuild(conn)
+        return aggregate_mismatches + leaderboard_mismatches + coverage_mismatches
+
+    def enqueue_job(self, kind, params, user_id=None):
+        """Queue a background job; returns its id"""
+        with self.transaction() as conn:
+            return jobs.enqueue(conn, kind, params, user_id)
+
+    @retry_on_locked
+    def claim_job(self, worker, max_running):
+        """Take the oldest queued job for `worker`, unless `max_running` jobs already run
+
+        Idle runners poll this, so the queue is checked without the write lock first.
+        """
+        with self.connection() as conn:
+            if not jobs.has_queued(conn):
+                return None
+        with self.transaction() as conn:
+            return jobs.claim(conn, worker, max_running)
+
+    @retry_on_locked
+    def report_job_progress(self, job_id, progress, total=None):
+        """Record a running job's progress; returns whether it was asked to cancel"""
+        with self.transaction() as conn:
+            return jobs.report(conn, job_id, progress, total)
+
+    @retry_on_locked
+    def heartbeat_jobs(self, worker, job_ids):
+        """Mark the jobs `job_ids` running on `worker` as alive"""
+        with self.transaction() as conn:
+            jobs.heartbeat(conn, worker, job_ids)
+
+    @retry_on_locked
+    def finish_job(self, job_id, status, message=None, result=None, artifact=None):
+        """Record a job's outcome"""
+        with self.transaction() as conn:
+            jobs.finish(conn, job_id, status, message, result, artifact)
+
+    @retry_on_locked
+    def requeue_job(self, job_id):
+        """Put a running job back in the queue"""
+        with self.transaction() as conn:
+            jobs.requeue(conn, job_id)
+
+    @retry_on_locked
+    def recover_jobs(self, max_attempts):
+        """Requeue (or give up on) jobs whose process stopped heartbeating; returns their ids"""
+        with self.connection() as conn:
+            if not jobs.stale(conn):
+                return []
+        with self.transaction() as conn:
+            return jobs.recover(conn, max_attempts)
+
+    @retry_on_locked
+    def prune_jobs(self, days):
+        """Delete jobs finished more than `days` ago; returns them so their files can be removed"""
+        with self.connection() as conn:
+            if not jobs.expired(conn, days):
+                return []
+        with self.transaction() as conn:
+            return jobs.prune(conn, days)
+
+    @retry_on_locked
+    def cancel_job(self, job_id):
+        """Cancel a queued job or ask a running one to stop; returns its prior status (None if unknown)"""
+        with self.transaction() as conn:
+            return jobs.cancel(conn, job_id)
+
+    @retry_on_locked
+    def delete_job(self, job_id):
+        """Delete a finished job; returns it (None if unknown or still active)"""
+        with self.transaction() as conn:
+            return jobs.delete(conn, job_id)
+
+    def get_job(self, job_id):
+        """A background job (None if unknown)"""
+        with self.connection() as conn:
+            return jobs.get(conn, job_id)
+
+    def get_jobs(self, limit=20):
+        """The most recent background jobs, newest first"""
+        with self.connection() as conn:
+            return jobs.recent(conn, limit)
@@ -0,0 +1,85 @@
+"""
+Password hashing off the request thread
+
+Hashes are computed on a small process pool so a burst of logins cannot take
+every core away from rating requests. The pool is created lazily in each
+process, which keeps it safe to use from pre-forked server workers; servers
+should call start() in each worker before it spawns request threads.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+class HasherBusy(RuntimeError):
+    """Raised when too many password hashes are already queued"""
+
+
+class PasswordHasher:
+    """Bounded password hashing with rehash detection
+
+    `method` is a werkzeug hash method such as 'scrypt', 'scrypt:16384:8:1' or
+    'pbkdf2:sha256:600000'. With `workers=0` hashing runs inline.
+    """
+
+    def __init__(self, method='scrypt', workers=0, max_pending=None, timeout=30.0):
+        self.method = method
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending or max(workers, 1) * 8)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self._prefix = None
+
+    def _get_executor(self):
+        """Return this process's executor, creating it after a fork"""
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                # fork needs no importable __main__, unlike spawn/forkserver
+                method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else None
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context(method))
+                self._pid = os.getpid()
+            return self._executor
+
+    def start(self):
+        """Fork the worker processes now rather than on the first login"""
+        if self.workers > 0:
+            self._get_executor().submit(len, '').result(timeout=self.timeout)
+
+    def _run(self, fn, *args):
+        """Run a hashing function on the pool, waiting for a free queue slot"""
+        if self.workers <= 0:
+            return fn(*args)
+
+        if not self._slots.acquire(timeout=self.timeout):
+            raise HasherBusy('password hashing queue is full')
+        try:
+            return self._get_executor().submit(fn, *args).result(timeout=self.timeout)
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        """Hash a password with the configured method"""
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        """Check a password against a stored hash"""
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """Whether a stored hash was made with different method parameters"""
+        if self._prefix is None:
+            # werkzeug fills in default parameters, so normalise via a real hash
+            self._prefix = generate_password_hash('', self.method).split('$', 1)[0]
+        return password_hash.split('$', 1)[0] != self._prefix
+
+    def close(self):
+        """Shut down the worker processes"""
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
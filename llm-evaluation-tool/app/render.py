@@ -0,0 +1,159 @@
+"""
+Server-side pre-rendering of example Markdown and LaTeX
+
+When enabled, dataset loading renders every history turn and model response to
+sanitized HTML on a process pool and stores it next to the raw text as
+`content_html` / `output_html`. LaTeX becomes MathML when latex2mathml is
+installed; formulas it cannot convert are left as text for the browser's KaTeX
+auto-render. Examples without pre-rendered HTML are rendered in the browser.
+
+Requires the optional `markdown` and `nh3` packages (`latex2mathml` optional).
+"""
+import functools
+import html
+import multiprocessing
+import re
+from concurrent.futures import ProcessPoolExecutor
+from xml.etree import ElementTree
+
+try:
+    import markdown
+    import nh3
+except ImportError:
+    markdown = nh3 = None
+
+try:
+    from latex2mathml.converter import convert as latex_to_mathml
+except ImportError:
+    latex_to_mathml = None
+
+# (example list, raw text field, rendered HTML field)
+RENDER_FIELDS = (('history', 'content', 'content_html'), ('responses', 'output', 'output_html'))
+
+MARKDOWN_EXTENSIONS = ['fenced_code', 'tables', 'sane_lists']
+
+# Code is matched first so formulas inside it are left alone
+MATH_PATTERN = re.compile(
+    r'(?P<code>```.*?```|`[^`\n]+`)'
+    r'|\$\$(?P<display>.+?)\$\$'
+    r'|\\\[(?P<display_bracket>.+?)\\\]'
+    r'|\\\((?P<inline_paren>.+?)\\\)'
+    r'|(?<![\\$\w])\$(?P<inline>[^$\n]+?)\$(?!\w)',
+    re.S
+)
+
+# Formulas are swapped for private-use placeholders while Markdown runs
+PLACEHOLDER = re.compile('\ue000(\\d+)\ue001')
+
+# MathML produced by latex2mathml, allowed through the sanitizer
+MATHML_TAGS = {
+    'math', 'mrow', 'mi', 'mn', 'mo', 'ms', 'mtext', 'mspace', 'msub', 'msup', 'msubsup',
+    'mfrac', 'msqrt', 'mroot', 'mover', 'munder', 'munderover', 'mmultiscripts',
+    'mprescripts', 'none', 'mtable', 'mtr', 'mtd', 'mstyle', 'mpadded', 'mphantom',
+    'menclose', 'merror', 'semantics', 'annotation'
+}
+MATHML_ATTRIBUTES = {
+    'math': {'display', 'xmlns'},
+    'mo': {'stretchy', 'fence', 'separator', 'lspace', 'rspace', 'accent', 'largeop',
+           'movablelimits', 'form', 'minsize', 'maxsize', 'symmetric'},
+    'mstyle': {'displaystyle', 'scriptlevel'},
+    'mspace': {'width'},
+    'mtable': {'columnalign', 'rowspacing', 'columnspacing'},
+    'menclose': {'notation'},
+    'mi': {'mathvariant'},
+}
+
+
+@functools.lru_cache(maxsize=None)
+def _sanitizer_options():
+    """Tags and attributes allowed in rendered HTML"""
+    attributes = {tag: set(names) for tag, names in nh3.ALLOWED_ATTRIBUTES.items()}
+    for tag, names in MATHML_ATTRIBUTES.items():
+        attributes.setdefault(tag, set()).update(names)
+    return nh3.ALLOWED_TAGS | MATHML_TAGS, attributes
+
+
+def available():
+    """Whether the packages needed for pre-rendering are installed"""
+    return markdown is not None and nh3 is not None
+
+
+@functools.lru_cache(maxsize=4096)
+def _mathml(source, display):
+    """Convert one formula to MathML; None if it cannot be converted"""
+    if latex_to_mathml is None:
+        return None
+    try:
+        mathml = latex_to_mathml(source.strip(), display='block' if display else 'inline')
+        # Markup inside \text{} is copied through unescaped; only keep well-formed MathML
+        if all(element.tag.rsplit('}', 1)[-1] in MATHML_TAGS
+               for element in ElementTree.fromstring(mathml).iter()):
+            return mathml
+    except Exception:
+        pass
+    return None
+
+
+@functools.lru_cache(maxsize=None)
+def _markdown():
+    """Per-process Markdown converter (building one per text is costly; not thread-safe)"""
+    return markdown.Markdown(extensions=MARKDOWN_EXTENSIONS)
+
+
+def render_text(text):
+    """Render Markdown with LaTeX to sanitized HTML"""
+    formulas = []
+
+    def protect(match):
+        if match.group('code'):
+            return match.group(0)
+        display = match.group('display') is not None or match.group('display_bracket') is not None
+        source = next(group for group in match.groups()[1:] if group is not None)
+        formulas.append(_mathml(source, display) or html.escape(match.group(0)))
+        return f'\ue000{len(formulas) - 1}\ue001'
+
+    body = _markdown().reset().convert(MATH_PATTERN.sub(protect, text))
+    body = PLACEHOLDER.sub(lambda m: formulas[int(m.group(1))], body)
+    # MathML is sanitized too: \text{} and \href can carry markup through
+    tags, attributes = _sanitizer_options()
+    return nh3.clean(body, tags=tags, attributes=attributes)
+
+
+def render_item(item):
+    """Return a copy of a dataset item with rendered HTML next to each text"""
+    item = dict(item)
+    for key, field, html_field in RENDER_FIELDS:
+        item[key] = [
+            dict(entry, **{html_field: render_text(entry[field])}) if isinstance(entry.get(field), str)
+            else entry
+            for entry in item[key]
+        ]
+    return item
+
+
+def _render_chunk(items):
+    """Render a list of items (runs in a worker process)"""
+    return [render_item(item) for item in items]
+
+
+def render_batches(batches, workers=None, chunk_size=50):
+    """Yield batches of rendered items, rendering the next batch while the caller stores this one
+
+    The worker processes live only as long as the generator. Loads run on
+    job runner and server threads, so the workers are started from a fresh
+    interpreter rather than forked with locks other threads may hold.
+    """
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    context = multiprocessing.get_context(method)
+    with ProcessPoolExecutor(max_workers=workers or multiprocessing.cpu_count(), mp_context=context) as executor:
+        pending = None
+        for batch in batches:
+            futures = [
+                executor.submit(_render_chunk, batch[i:i + chunk_size])
+                for i in range(0, len(batch), chunk_size)
+            ]
+            if pending is not None:
+                yield [item for future in pending for item in future.result()]
+            pending = futures
+        if pending is not None:
+            yield [item for future in pending for item in future.result()]
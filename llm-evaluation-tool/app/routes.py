@@ -1,9 +1,14 @@
 from flask import Blueprint, render_template, request, redirect, url_for, session, flash, jsonify, current_app
 from app.auth import login_required
+from app.passwords import HasherBusy
 import json
 
 main_bp = Blueprint('main', __name__)
 
+MISSING_EXAMPLE_MESSAGE = '현재 데이터셋에 없는 예제입니다. 페이지를 새로고침하세요.'
+UNKNOWN_MODEL_MESSAGE = '이 예제에 없는 모델입니다.'
+NO_ASSIGNMENT_MESSAGE = '이 카테고리에서 더 배정할 문제가 없습니다.'
+
 @main_bp.route('/')
 def index():
     """Redirect to login or category selection"""
@@ -18,7 +23,12 @@ def login():
         username = request.form.get('username')
         password = request.form.get('password')
 
-        user = current_app.db.verify_user(username, password)
+        try:
+            user = current_app.db.verify_user(username, password)
+        except HasherBusy:
+            flash('로그인 요청이 많습니다. 잠시 후 다시 시도하세요.', 'error')
+            return render_template('login.html'), 503
+
         if user:
             session['user_id'] = user['id']
             session['username'] = user['username']
@@ -51,44 +61,178 @@ def select_category():
 @login_required
 def evaluate_category(category):
     """Evaluation interface for a specific category"""
-    examples = current_app.db.get_examples_by_category(category)
+    # Only ids are shipped with the page; content is fetched per example
+    examples = current_app.db.get_example_index(category)
     if not examples:
         flash('해당 카테고리에 문제가 없습니다.', 'error')
         return redirect(url_for('main.select_category'))
 
-    # Get user's progress for this category
+    # Get user's progress for this category (version first, so no write is missed)
+    progress_version = current_app.db.get_progress_version(session['user_id'])
     progress = current_app.db.get_user_progress(session['user_id'], category)
 
+    # Start at the example that most needs ratings rather than the first one.
+    # Reloads and back navigation keep the example already leased, so only a
+    # first visit (or an expired lease) takes the write lock
+    assignment = current_assignment(category) or assign_next(category)
+
     return render_template('evaluate.html',
                          category=category,
                          examples=examples,
-                         progress=progress)
-
-@main_bp.route('/api/rating', methods=['POST'])
+                         progress=progress,
+                         progress_version=progress_version,
+                         assignment=assignment,
+                         prefetch=current_app.config['EVALUATE_PREFETCH'],
+                         rating_batch_max=current_app.config['RATING_BATCH_MAX'])
+
+def current_assignment(category):
+    """The example the current user already has leased in a category (None if none)"""
+    return current_app.db.get_assignment(session['user_id'], category, current_app.config['ASSIGNMENT_TARGET'])
+
+def assign_next(category, skip=None):
+    """Lease the current user the next example of a category to rate (None if none is left)"""
+    return current_app.db.next_example(
+        session['user_id'], category,
+        current_app.config['ASSIGNMENT_TARGET'],
+        current_app.config['ASSIGNMENT_LEASE_SECONDS'],
+        skip
+    )
+
+@main_bp.route('/api/next/<category>', methods=['POST'])
 @login_required
-def save_rating():
-    """API endpoint to save a rating"""
-    data = request.get_json()
+def next_example(category):
+    """API endpoint assigning the example that most needs ratings (?skip=<example_id> for another one)"""
+    assignment = assign_next(category, request.args.get('skip', type=int))
+    if assignment is None:
+        return jsonify({'success': True, 'assignment': None, 'message': NO_ASSIGNMENT_MESSAGE})
+    return jsonify({'success': True, 'assignment': assignment})
+
+@main_bp.route('/api/example/<int:example_id>')
+@login_required
+def get_example(example_id):
+    """API endpoint to get a single example, revalidated by content hash"""
+    etag = current_app.db.get_example_etag(example_id)
+    if etag is None:
+        return jsonify({'success': False, 'message': '문제를 찾을 수 없습니다.'}), 404
+
+    if etag in request.if_none_match:
+        response = current_app.response_class(status=304)
+    else:
+        example = current_app.db.get_example_by_id(example_id)
+        response = jsonify({'success': True, 'example': example})
+
+    response.set_etag(etag)
+    response.cache_control.private = True
+    # Revalidate every time: a dataset version swap can change the content
+    # behind the same id, and a rating is saved against the current content
+    response.cache_control.no_cache = True
+    return response
+
+def parse_rating(data):
+    """Validate a rating payload; returns ((example_id, model_name, rating), None) or (None, message)"""
+    if not isinstance(data, dict):
+        return None, '필수 정보가 누락되었습니다.'
+
     example_id = data.get('example_id')
     model_name = data.get('model_name')
     rating = data.get('rating')
 
-    if not all([example_id, model_name, rating]):
-        return jsonify({'success': False, 'message': '필수 정보가 누락되었습니다.'}), 400
+    if not all([example_id, model_name, rating]) or not isinstance(model_name, str):
+        return None, '필수 정보가 누락되었습니다.'
 
     try:
         rating = int(rating)
         if rating < 1 or rating > 5:
             raise ValueError
     except (ValueError, TypeError):
-        return jsonify({'success': False, 'message': '평점은 1~5 사이의 숫자여야 합니다.'}), 400
+        return None, '평점은 1~5 사이의 숫자여야 합니다.'
+
+    return (example_id, model_name, rating), None
 
-    current_app.db.save_rating(session['user_id'], example_id, model_name, rating)
-    return jsonify({'success': True, 'message': '평가가 저장되었습니다.'})
+def rejection(example_id):
+    """Why a rating was not saved: (message, status)"""
+    if current_app.db.get_example_etag(example_id) is None:
+        return MISSING_EXAMPLE_MESSAGE, 404
+    return UNKNOWN_MODEL_MESSAGE, 400
+
+@main_bp.route('/api/rating', methods=['POST'])
+@login_required
+def save_rating():
+    """API endpoint to save a rating"""
+    item, error = parse_rating(request.get_json())
+    if error:
+        return jsonify({'success': False, 'message': error}), 400
+
+    version = current_app.db.save_rating(session['user_id'], *item)
+    if version is None:
+        message, status = rejection(item[0])
+        return jsonify({'success': False, 'message': message}), status
+    example_id, model_name, rating = item
+    return jsonify({
+        'success': True,
+        'message': '평가가 저장되었습니다.',
+        'version': version,
+        'changes': [{'example_id': example_id, 'model_name': model_name, 'rating': rating}]
+    })
+
+@main_bp.route('/api/ratings', methods=['POST'])
+@login_required
+def save_ratings():
+    """API endpoint to save a batch of ratings in one transaction"""
+    data = request.get_json(silent=True)
+    items = data.get('ratings') if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        return jsonify({'success': False, 'message': '평가 목록이 필요합니다.'}), 400
+    if len(items) > current_app.config['RATING_BATCH_MAX']:
+        return jsonify({
+            'success': False,
+            'message': f'한 번에 최대 {current_app.config["RATING_BATCH_MAX"]}개까지 저장할 수 있습니다.'
+        }), 400
+
+    valid = []
+    positions = []
+    results = []
+    for data in items:
+        item, error = parse_rating(data)
+        if error:
+            results.append({'success': False, 'message': error})
+        else:
+            valid.append(item)
+            positions.append(len(results))
+            results.append({'success': True})
+
+    version, saved = None, []
+    if valid:
+        version, saved = current_app.db.save_ratings(session['user_id'], valid)
+
+    changes = []
+    for item, position, ok in zip(valid, positions, saved):
+        if ok:
+            changes.append(item)
+        else:
+            results[position] = {'success': False, 'message': rejection(item[0])[0]}
+
+    # The saved entries double as a progress delta; each one bumps the version by one
+    return jsonify({
+        'success': len(changes) == len(items),
+        'saved': len(changes),
+        'results': results,
+        'version': version,
+        'changes': [
+            {'example_id': example_id, 'model_name': model_name, 'rating': rating}
+            for example_id, model_name, rating in changes
+        ]
+    })
 
 @main_bp.route('/api/progress/<category>')
 @login_required
 def get_progress(category):
-    """API endpoint to get user's progress"""
+    """API endpoint to get user's progress, or only the changes since ?since=<version>"""
+    since = request.args.get('since', type=int)
+    if since is not None:
+        version, changes = current_app.db.get_progress_changes(session['user_id'], category, since)
+        return jsonify({'success': True, 'version': version, 'changes': changes})
+
+    version = current_app.db.get_progress_version(session['user_id'])
     progress = current_app.db.get_user_progress(session['user_id'], category)
-    return jsonify({'success': True, 'progress': progress})
+    return jsonify({'success': True, 'version': version, 'progress': progress})
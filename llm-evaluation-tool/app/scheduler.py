@@ -0,0 +1,332 @@
+"""
+Redundancy-aware work assignment
+
+Instead of every evaluator walking a category in example_id order, the
+scheduler hands out the example that most needs ratings: the one whose
+least-rated model has the fewest ratings, preferring examples nobody holds a
+lease on, skipping examples the evaluator has already rated completely and
+examples that reached the target number of ratings per model.
+
+Coverage is maintained incrementally, like the rating aggregates:
+
+- `coverage_models` counts the ratings of every (example, model) of the
+  active dataset version
+- `coverage_users` counts each evaluator's ratings of every active example,
+  so examples an evaluator has finished are excluded by a primary key probe
+  instead of counting their ratings
+- `coverage` keeps one row per active example with the minimum of those
+  counts and the number of open leases, indexed by (category, ratings,
+  leases, example_id) so picking the next example is an index seek rather
+  than a scan of ratings or examples
+- `assignment_leases` holds the examples currently handed out; a lease ends
+  when the evaluator rates every model, asks for another example, or expires
+"""
+from datetime import datetime, timedelta
+from app.datasets import ACTIVE_RATING, ACTIVE_VERSION
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Ratings per (example, model) of the active version
+MODELS_QUERY = f'''
+    SELECT r.example_id, r.model_name, COUNT(*)
+    FROM ratings r
+    JOIN dataset_examples m ON {ACTIVE_RATING}
+    GROUP BY r.example_id, r.model_name
+'''
+
+# Ratings per (evaluator, example) of the active version
+USERS_QUERY = f'''
+    SELECT r.user_id, r.example_id, COUNT(*)
+    FROM ratings r
+    JOIN dataset_examples m ON {ACTIVE_RATING}
+    GROUP BY r.user_id, r.example_id
+'''
+
+# The minimum over an example's models, 0 while some model has no rating
+MIN_RATINGS = '''
+    CASE WHEN (SELECT COUNT(*) FROM coverage_models cm WHERE cm.example_id = coverage.example_id)
+              < coverage.num_responses THEN 0
+         ELSE (SELECT MIN(cm.ratings) FROM coverage_models cm WHERE cm.example_id = coverage.example_id)
+    END
+'''
+
+
+def _now(offset=0):
+    """Timestamp in the format used by every table, `offset` seconds from now"""
+    return (datetime.now() + timedelta(seconds=offset)).strftime(TIMESTAMP_FORMAT)
+
+
+def _refresh(conn, example_id):
+    """Recompute an example's minimum rating count from its per-model counts"""
+    conn.execute(f'UPDATE coverage SET ratings = {MIN_RATINGS} WHERE example_id = ?', (example_id,))
+
+
+def _release(conn, leases):
+    """End a set of (user_id, example_id) leases"""
+    for user_id, example_id in leases:
+        cursor = conn.execute(
+            'DELETE FROM assignment_leases WHERE user_id = ? AND example_id = ?', (user_id, example_id)
+        )
+        if cursor.rowcount:
+            conn.execute('UPDATE coverage SET leases = leases - 1 WHERE example_id = ?', (example_id,))
+
+
+def apply_rating(conn, user_id, example_id, source_hash, model_name):
+    """Count a new rating (not a replacement) and end the evaluator's lease once the example is done"""
+    conn.execute('''
+        INSERT INTO coverage_models (example_id, model_name, ratings) VALUES (?, ?, 1)
+        ON CONFLICT(example_id, model_name) DO UPDATE SET ratings = ratings + 1
+    ''', (example_id, model_name))
+    _refresh(conn, example_id)
+    conn.execute('''
+        INSERT INTO coverage_users (user_id, example_id, ratings) VALUES (?, ?, 1)
+        ON CONFLICT(user_id, example_id) DO UPDATE SET ratings = ratings + 1
+    ''', (user_id, example_id))
+
+    done = conn.execute('''
+        SELECT 1 FROM assignment_leases l
+        JOIN coverage c ON c.example_id = l.example_id
+        JOIN coverage_users u ON u.user_id = l.user_id AND u.example_id = l.example_id
+        WHERE l.user_id = ? AND l.example_id = ? AND u.ratings >= c.num_responses
+    ''', (user_id, example_id)).fetchone()
+    if done:
+        _release(conn, [(user_id, example_id)])
+
+
+def remove_contents(conn, contents):
+    """Drop the coverage and leases of (example_id, source_hash, ...) contents leaving the active version"""
+    for content in contents:
+        cursor = conn.execute(
+            'DELETE FROM coverage WHERE example_id = ? AND source_hash = ?',
+            (content['example_id'], content['source_hash'])
+        )
+        if cursor.rowcount:
+            conn.execute('DELETE FROM coverage_models WHERE example_id = ?', (content['example_id'],))
+            conn.execute('DELETE FROM coverage_users WHERE example_id = ?', (content['example_id'],))
+            conn.execute('DELETE FROM assignment_leases WHERE example_id = ?', (content['example_id'],))
+
+
+def add_contents(conn, version, contents, ratings):
+    """Add coverage for contents entering the active version
+
+    `ratings` are (user_id, example_id, model_name, ...) rows holding every
+    rating of those contents.
+    """
+    for content in contents:
+        conn.execute('''
+            INSERT INTO coverage (example_id, category, source_hash, num_responses)
+            SELECT m.example_id, m.category, m.source_hash, e.num_responses
+            FROM dataset_examples m
+            JOIN examples e ON e.id = m.example_row
+            WHERE m.version = ? AND m.example_id = ?
+        ''', (version, content['example_id']))
+
+    counts = {}
+    users = {}
+    for rating in ratings:
+        counts[rating[1], rating[2]] = counts.get((rating[1], rating[2]), 0) + 1
+        users[rating[0], rating[1]] = users.get((rating[0], rating[1]), 0) + 1
+    conn.executemany(
+        'INSERT INTO coverage_models (example_id, model_name, ratings) VALUES (?, ?, ?)',
+        [(example_id, model_name, count) for (example_id, model_name), count in counts.items()]
+    )
+    conn.executemany(
+        'INSERT INTO coverage_users (user_id, example_id, ratings) VALUES (?, ?, ?)',
+        [(user_id, example_id, count) for (user_id, example_id), count in users.items()]
+    )
+    for content in contents:
+        _refresh(conn, content['example_id'])
+
+
+def expire(conn):
+    """End every lease past its expiry"""
+    expired = conn.execute(
+        'SELECT user_id, example_id FROM assignment_leases WHERE expires_at < ?', (_now(),)
+    ).fetchall()
+    _release(conn, [tuple(row) for row in expired])
+
+
+def current_lease(conn, user_id, category, target):
+    """The evaluator's unexpired lease in `category`, shaped like next_example's result (None if none)
+
+    next_example ends an evaluator's other leases in a category, so there is at most one.
+    """
+    row = conn.execute('''
+        SELECT c.example_id, c.ratings, c.leases, l.expires_at
+        FROM assignment_leases l
+        JOIN coverage c ON c.example_id = l.example_id
+        WHERE l.user_id = ? AND c.category = ? AND l.expires_at >= ?
+        LIMIT 1
+    ''', (user_id, category, _now())).fetchone()
+    if row is None:
+        return None
+    # next_example reports the leases held before its own
+    return {'example_id': row['example_id'], 'ratings': row['ratings'], 'leases': row['leases'] - 1,
+            'target': target, 'lease_expires': row['expires_at']}
+
+
+def next_example(conn, user_id, category, target, lease_seconds, skip=None):
+    """Lease the example of `category` that most needs ratings to an evaluator
+
+    The evaluator's previous leases in the category end first, so asking
+    again without rating returns the same example unless it is `skip`ped.
+    Returns the coverage row of the leased example, or None when every
+    example the evaluator has not finished has reached `target`.
+    """
+    expire(conn)
+    held = conn.execute('''
+        SELECT l.user_id, l.example_id FROM assignment_leases l
+        JOIN coverage c ON c.example_id = l.example_id
+        WHERE l.user_id = ? AND c.category = ?
+    ''', (user_id, category)).fetchall()
+    _release(conn, [tuple(row) for row in held])
+
+    # Walks the priority index in order with one primary key probe of the
+    # evaluator's coverage per candidate; stops at the first one not yet finished
+    row = conn.execute('''
+        SELECT c.example_id, c.ratings, c.leases
+        FROM coverage c
+        WHERE c.category = ? AND c.ratings < ? AND c.example_id != ?
+          AND NOT EXISTS (
+              SELECT 1 FROM coverage_users u
+              WHERE u.user_id = ? AND u.example_id = c.example_id AND u.ratings >= c.num_responses
+          )
+        ORDER BY c.ratings, c.leases, c.example_id
+        LIMIT 1
+    ''', (category, target, -1 if skip is None else skip, user_id)).fetchone()
+    if row is None:
+        return None
+
+    expires_at = _now(lease_seconds)
+    conn.execute(
+        'INSERT INTO assignment_leases (user_id, example_id, expires_at) VALUES (?, ?, ?)',
+        (user_id, row['example_id'], expires_at)
+    )
+    conn.execute('UPDATE coverage SET leases = leases + 1 WHERE example_id = ?', (row['example_id'],))
+    return {'example_id': row['example_id'], 'ratings': row['ratings'], 'leases': row['leases'],
+            'target': target, 'lease_expires': expires_at}
+
+
+def recompute(conn):
+    """Compute the coverage tables from the ratings and lease tables"""
+    models = {tuple(row[:2]): row[2] for row in conn.execute(MODELS_QUERY)}
+    by_example = {}
+    for (example_id, _), count in models.items():
+        by_example.setdefault(example_id, []).append(count)
+
+    leases = dict(tuple(row) for row in conn.execute(
+        'SELECT example_id, COUNT(*) FROM assignment_leases GROUP BY example_id'))
+    coverage = {}
+    for row in conn.execute(f'''
+            SELECT m.example_id, m.category, m.source_hash, e.num_responses
+            FROM dataset_examples m
+            JOIN examples e ON e.id = m.example_row
+            WHERE m.version = {ACTIVE_VERSION}'''):
+        counts = by_example.get(row['example_id'], [])
+        ratings = min(counts) if len(counts) >= row['num_responses'] else 0
+        coverage[row['example_id']] = (row['category'], row['source_hash'], row['num_responses'],
+                                       ratings, leases.get(row['example_id'], 0))
+    users = {tuple(row[:2]): row[2] for row in conn.execute(USERS_QUERY)}
+    return {'coverage': coverage, 'coverage_models': models, 'coverage_users': users}
+
+
+def stored(conn):
+    """Read the coverage tables"""
+    return {
+        'coverage': {
+            row[0]: tuple(row[1:]) for row in conn.execute(
+                'SELECT example_id, category, source_hash, num_responses, ratings, leases FROM coverage')
+        },
+        'coverage_models': {
+            tuple(row[:2]): row[2] for row in conn.execute(
+                'SELECT example_id, model_name, ratings FROM coverage_models WHERE ratings > 0')
+        },
+        'coverage_users': {
+            tuple(row[:2]): row[2] for row in conn.execute(
+                'SELECT user_id, example_id, ratings FROM coverage_users WHERE ratings > 0')
+        },
+    }
+
+
+def compare(expected, actual):
+    """List (table, group, expected, actual) for every row that differs"""
+    mismatches = []
+    for table, rows in expected.items():
+        for key in rows.keys() | actual[table].keys():
+            if rows.get(key) != actual[table].get(key):
+                mismatches.append((table, key, rows.get(key), actual[table].get(key)))
+    return mismatches
+
+
+def rebuild(conn):
+    """Replace the coverage tables with a full recompute, dropping leases of inactive examples"""
+    conn.execute('DELETE FROM coverage_models')
+    conn.execute(f'INSERT INTO coverage_models (example_id, model_name, ratings) {MODELS_QUERY}')
+    conn.execute('DELETE FROM coverage_users')
+    conn.execute(f'INSERT INTO coverage_users (user_id, example_id, ratings) {USERS_QUERY}')
+    conn.execute('DELETE FROM coverage')
+    conn.execute(f'''
+        INSERT INTO coverage (example_id, category, source_hash, num_responses)
+        SELECT m.example_id, m.category, m.source_hash, e.num_responses
+        FROM dataset_examples m
+        JOIN examples e ON e.id = m.example_row
+        WHERE m.version = {ACTIVE_VERSION}
+    ''')
+    conn.execute('DELETE FROM assignment_leases WHERE example_id NOT IN (SELECT example_id FROM coverage)')
+    conn.execute(f'''
+        UPDATE coverage SET
+            ratings = {MIN_RATINGS},
+            leases = (SELECT COUNT(*) FROM assignment_leases l WHERE l.example_id = coverage.example_id)
+    ''')
+
+
+def summary(conn, target):
+    """Examples, examples at target and open leases of the active version (for scrapers)"""
+    row = conn.execute(
+        'SELECT COUNT(*), COALESCE(SUM(ratings >= ?), 0), COALESCE(SUM(leases), 0) FROM coverage', (target,)
+    ).fetchone()
+    return {'examples': row[0], 'complete': row[1], 'leases': row[2]}
+
+
+def report(conn, target):
+    """Coverage per category and rating throughput for the admin dashboard"""
+    categories = []
+    for row in conn.execute('''
+            SELECT c.category,
+                   COUNT(*) AS examples,
+                   SUM(c.ratings >= ?) AS complete,
+                   SUM(c.leases > 0) AS leased,
+                   SUM(c.ratings) AS min_ratings
+            FROM coverage c
+            GROUP BY c.category
+            ORDER BY c.category''', (target,)):
+        categories.append(dict(row))
+
+    # Ratings still needed to bring every (example, model) up to the target
+    remaining = dict(tuple(row) for row in conn.execute('''
+        SELECT c.category,
+               SUM(c.num_responses * ?) - COALESCE(SUM(
+                   (SELECT SUM(MIN(cm.ratings, ?)) FROM coverage_models cm WHERE cm.example_id = c.example_id)
+               ), 0)
+        FROM coverage c
+        GROUP BY c.category''', (target, target)))
+    for category in categories:
+        category['remaining'] = remaining.get(category['category'], 0)
+        category['mean_min_ratings'] = category.pop('min_ratings') / category['examples']
+
+    throughput = {}
+    for label, seconds in (('last_hour', 3600), ('last_day', 86400)):
+        row = conn.execute(
+            'SELECT COUNT(*), COUNT(DISTINCT user_id) FROM ratings WHERE timestamp >= ?', (_now(-seconds),)
+        ).fetchone()
+        throughput[label] = {'ratings': row[0], 'evaluators': row[1]}
+
+    return {
+        'target': target,
+        'categories': categories,
+        'examples': sum(category['examples'] for category in categories),
+        'complete': sum(category['complete'] for category in categories),
+        'remaining': sum(category['remaining'] for category in categories),
+        'leases': conn.execute('SELECT COUNT(*) FROM assignment_leases').fetchone()[0],
+        'throughput': throughput,
+    }
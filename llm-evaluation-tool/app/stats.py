@@ -0,0 +1,143 @@
+"""
+Incrementally maintained rating aggregates
+
+Per-model, per-category and per-(category, model) count/sum/sum-of-squares
+tables are updated in the same transaction as every rating write, so the admin
+dashboard reads statistics in O(number of groups) instead of scanning ratings.
+They cover the ratings of the active dataset version; activating another
+version applies the ratings of the contents that differ between the two.
+"""
+import math
+from app.datasets import ACTIVE_RATING
+
+# Keys of the dashboard statistics, in the order of AGGREGATES
+STAT_NAMES = ('by_model', 'by_category', 'by_model_category')
+
+# (table, group columns, query computing the same groups from scratch)
+AGGREGATES = [
+    ('stats_model', ('model_name',), f'''
+        SELECT r.model_name, COUNT(*), SUM(r.rating), SUM(r.rating * r.rating)
+        FROM ratings r
+        JOIN dataset_examples m ON {ACTIVE_RATING}
+        GROUP BY r.model_name
+    '''),
+    ('stats_category', ('category',), f'''
+        SELECT m.category, COUNT(*), SUM(r.rating), SUM(r.rating * r.rating)
+        FROM ratings r
+        JOIN dataset_examples m ON {ACTIVE_RATING}
+        GROUP BY m.category
+    '''),
+    ('stats_category_model', ('category', 'model_name'), f'''
+        SELECT m.category, r.model_name, COUNT(*), SUM(r.rating), SUM(r.rating * r.rating)
+        FROM ratings r
+        JOIN dataset_examples m ON {ACTIVE_RATING}
+        GROUP BY m.category, r.model_name
+    '''),
+]
+
+
+def _add(conn, table, keys, values, count, total, squares):
+    """Add a delta to one aggregate group"""
+    placeholders = ', '.join('?' for _ in keys)
+    conn.execute(f'''
+        INSERT INTO {table} ({', '.join(keys)}, count, rating_sum, rating_sumsq)
+        VALUES ({placeholders}, ?, ?, ?)
+        ON CONFLICT({', '.join(keys)}) DO UPDATE SET
+            count = count + excluded.count,
+            rating_sum = rating_sum + excluded.rating_sum,
+            rating_sumsq = rating_sumsq + excluded.rating_sumsq
+    ''', (*values, count, total, squares))
+
+
+def apply_rating(conn, model_name, category, old_rating, new_rating):
+    """Apply a rating insert (old_rating None) or replacement to the aggregates"""
+    count = 0 if old_rating is not None else 1
+    old_rating = old_rating or 0
+    total = new_rating - old_rating
+    squares = new_rating * new_rating - old_rating * old_rating
+
+    _add(conn, 'stats_model', ('model_name',), (model_name,), count, total, squares)
+    if category is not None:
+        _add(conn, 'stats_category', ('category',), (category,), count, total, squares)
+        _add(conn, 'stats_category_model', ('category', 'model_name'),
+             (category, model_name), count, total, squares)
+
+
+def apply_ratings(conn, ratings, sign=1):
+    """Add (sign 1) or remove (sign -1) a set of (model_name, category, rating) rows"""
+    groups = {}
+    for model_name, category, rating in ratings:
+        for group in (('stats_model', ('model_name',), (model_name,)),
+                      ('stats_category', ('category',), (category,)),
+                      ('stats_category_model', ('category', 'model_name'), (category, model_name))):
+            delta = groups.setdefault(group, [0, 0, 0])
+            delta[0] += 1
+            delta[1] += rating
+            delta[2] += rating * rating
+
+    for (table, keys, values), (count, total, squares) in groups.items():
+        _add(conn, table, keys, values, sign * count, sign * total, sign * squares)
+
+
+def recompute(conn):
+    """Compute every aggregate group from the ratings table"""
+    return {
+        table: {tuple(row)[:-3]: tuple(row)[-3:] for row in conn.execute(query)}
+        for table, _, query in AGGREGATES
+    }
+
+
+def stored(conn):
+    """Read every aggregate group from the materialized tables"""
+    result = {}
+    for table, keys, _ in AGGREGATES:
+        rows = conn.execute(
+            f'SELECT {", ".join(keys)}, count, rating_sum, rating_sumsq FROM {table} WHERE count > 0')
+        result[table] = {tuple(row)[:-3]: tuple(row)[-3:] for row in rows}
+    return result
+
+
+def compare(expected, actual):
+    """List (table, group, expected, actual) for every group that differs"""
+    mismatches = []
+    for table, groups in expected.items():
+        for key in groups.keys() | actual[table].keys():
+            if groups.get(key) != actual[table].get(key):
+                mismatches.append((table, key, groups.get(key), actual[table].get(key)))
+    return mismatches
+
+
+def rebuild(conn, tables=None):
+    """Replace aggregate tables with a full recompute"""
+    for table, keys, query in AGGREGATES:
+        if tables is not None and table not in tables:
+            continue
+        conn.execute(f'DELETE FROM {table}')
+        conn.execute(f'''
+            INSERT INTO {table} ({', '.join(keys)}, count, rating_sum, rating_sumsq)
+            {query}
+        ''')
+
+
+def _summary(row, keys):
+    """Convert an aggregate row to the dashboard's stat dict"""
+    count, total, squares = row['count'], row['rating_sum'], row['rating_sumsq']
+    mean = total / count
+    stat = {key: row[key] for key in keys}
+    stat['avg_rating'] = mean
+    stat['count'] = count
+    stat['stddev'] = math.sqrt(max(squares / count - mean * mean, 0.0))
+    return stat
+
+
+def read(conn):
+    """Read dashboard statistics from the aggregate tables"""
+    result = {}
+    for name, (table, keys, _) in zip(STAT_NAMES, AGGREGATES):
+        rows = conn.execute(f'''
+            SELECT * FROM {table}
+            WHERE count > 0
+            ORDER BY {', '.join(keys)}
+        ''')
+        result[name] = [_summary(row, keys) for row in rows]
+    return result
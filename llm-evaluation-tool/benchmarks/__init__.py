@@ -0,0 +1,7 @@
+"""
+Benchmarks for the LLM Evaluation Tool
+
+Run from the project root, e.g. ``python -m benchmarks.bench_rating_writes``.
+Shared helpers live in ``common`` (result summaries and JSON files) and
+``datagen`` (synthetic datasets and evaluator accounts).
+"""
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks for every public Database method
+
+Builds a scratch database from a synthetic dataset, seeds ratings, then times
+each method over varied arguments and reports p50/p95/p99 latency.
+
+Usage: python -m benchmarks.bench_database [--examples 2000] [--iterations 200]
+           [--only get_example_by_id,save_rating] [--cold] [--output results.json]
+"""
+import argparse
+import itertools
+import os
+import random
+import tempfile
+import time
+from app.models import Database
+from benchmarks import datagen
+from benchmarks.common import print_table, save_results, summarize
+
+
+def seed_ratings(db, user_ids, examples, models, per_user, rng):
+    """Give each evaluator `per_user` ratings"""
+    for user_id in user_ids:
+        picks = rng.sample(range(1, examples + 1), min(per_user, examples))
+        db.save_ratings(user_id, [(example_id, rng.choice(models), rng.randint(1, 5)) for example_id in picks])
+
+
+def method_calls(db, args, user_ids, models, categories, rng):
+    """(method name, iterations, zero-argument callable producing the next call)"""
+    examples = args.examples
+    usernames = datagen.evaluator_names(len(user_ids))
+    counter = itertools.count()
+    replacement = list(datagen.generate_examples(200, args.models, args.categories, seed=args.seed + 1))
+
+    def example_id():
+        return rng.randint(1, examples)
+
+    def drain(iterator):
+        for _ in iterator:
+            pass
+
+    few = max(args.iterations // 20, 3)
+    return [
+        ('create_user', few, lambda: db.create_user(f'bench{next(counter)}', 'password')),
+        ('verify_user', few, lambda: db.verify_user(rng.choice(usernames), datagen.PASSWORD)),
+        ('update_user', few, lambda: db.update_user(rng.choice(user_ids), role='evaluator')),
+        ('get_user_by_id', args.iterations, lambda: db.get_user_by_id(rng.choice(user_ids))),
+        ('get_user_identity', args.iterations, lambda: db.get_user_identity(rng.choice(user_ids))),
+        ('get_categories', args.iterations, db.get_categories),
+        ('get_examples_by_category', few, lambda: db.get_examples_by_category(rng.choice(categories))),
+        ('get_example_index', args.iterations, lambda: db.get_example_index(rng.choice(categories))),
+        ('get_example_etag', args.iterations, lambda: db.get_example_etag(example_id())),
+        ('get_example_by_id', args.iterations, lambda: db.get_example_by_id(example_id())),
+        ('save_rating', args.iterations,
+         lambda: db.save_rating(rng.choice(user_ids), example_id(), rng.choice(models), rng.randint(1, 5))),
+        ('save_ratings', args.iterations,
+         lambda: db.save_ratings(rng.choice(user_ids), [(example_id(), m, rng.randint(1, 5)) for m in models])),
+        ('get_user_ratings', args.iterations,
+         lambda: db.get_user_ratings(rng.choice(user_ids), rng.choice(categories))),
+        ('get_user_progress', args.iterations,
+         lambda: db.get_user_progress(rng.choice(user_ids), rng.choice(categories))),
+        ('get_progress_version', args.iterations, lambda: db.get_progress_version(rng.choice(user_ids))),
+        ('get_progress_changes', args.iterations,
+         lambda: db.get_progress_changes(rng.choice(user_ids), rng.choice(categories), 0)),
+        ('get_ratings_page', args.iterations, lambda: db.get_ratings_page(50)),
+        ('get_ratings_page(model)', args.iterations, lambda: db.get_ratings_page(50, model=rng.choice(models))),
+        ('get_ratings_page(evaluator)', args.iterations,
+         lambda: db.get_ratings_page(50, evaluator=rng.choice(usernames))),
+        ('count_ratings', args.iterations, db.count_ratings),
+        ('count_ratings(category)', few, lambda: db.count_ratings(category=rng.choice(categories))),
+        ('get_aggregated_stats', args.iterations, db.get_aggregated_stats),
+        ('next_example', args.iterations,
+         lambda: db.next_example(rng.choice(user_ids), rng.choice(categories), 3, 900, example_id())),
+        ('get_coverage', few, lambda: db.get_coverage(3)),
+        ('get_coverage_summary', args.iterations, lambda: db.get_coverage_summary(3)),
+        ('get_all_ratings', few, db.get_all_ratings),
+        ('iter_all_ratings', few, lambda: drain(db.iter_all_ratings())),
+        ('iter_rating_batches', few, lambda: drain(db.iter_rating_batches(65536))),
+        ('iter_rating_batches(metadata)', few, lambda: drain(db.iter_rating_batches(65536, metadata=True))),
+        ('get_rating_events', args.iterations, lambda: db.get_rating_events(0, 1000)),
+        ('get_storage_report', 3, db.get_storage_report),
+        ('rebuild_stats(check_only)', 3, lambda: db.rebuild_stats(check_only=True)),
+        ('get_dataset_cache_stats', args.iterations, db.get_dataset_cache_stats),
+        # Last: replaces the examples the other calls read
+        ('load_dataset(200)', 3, lambda: db.load_dataset(replacement)),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    datagen.add_dataset_arguments(parser)
+    parser.add_argument('--evaluators', type=int, default=20)
+    parser.add_argument('--ratings-per-evaluator', type=int, default=500)
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--only', help='comma-separated method names')
+    parser.add_argument('--cold', action='store_true', help='disable the dataset cache')
+    parser.add_argument('--output', help='JSON result path (default: benchmarks/results/)')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'bench.db'), dataset_cache_size=0 if args.cold else 1024)
+        start = time.perf_counter()
+        items = list(datagen.dataset_from_args(args))
+        db.load_dataset(items)
+        user_ids = datagen.create_accounts(db, args.evaluators)
+        models = [response['model'] for response in items[0]['responses']]
+        categories = db.get_categories()
+        seed_ratings(db, user_ids, args.examples, models, args.ratings_per_evaluator, rng)
+        print(f'setup: {args.examples} examples, {args.evaluators} evaluators, '
+              f'{args.evaluators * args.ratings_per_evaluator} ratings in {time.perf_counter() - start:.1f}s')
+
+        only = set(args.only.split(',')) if args.only else None
+        results = {}
+        for name, iterations, call in method_calls(db, args, user_ids, models, categories, rng):
+            if only and name.split('(')[0] not in only and name not in only:
+                continue
+            latencies = []
+            for _ in range(iterations):
+                start = time.perf_counter()
+                call()
+                latencies.append(time.perf_counter() - start)
+            results[name] = summarize(latencies)
+        db.close()
+
+    print_table(results)
+    params = dict(datagen.dataset_params(args), evaluators=args.evaluators,
+                  ratings_per_evaluator=args.ratings_per_evaluator,
+                  iterations=args.iterations, cold=args.cold)
+    print(f'results saved to {save_results("database", params, results, args.output)}')
+
+
+if __name__ == '__main__':
+    main()
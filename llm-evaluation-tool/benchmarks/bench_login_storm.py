@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Login storm: rating latency while many evaluators log in at once
+
+Compares hashing passwords on the request threads with the bounded hashing
+pool, measuring login throughput and the latency of concurrent rating saves.
+
+Usage: python -m benchmarks.bench_login_storm [--logins 64] [--threads 32] [--workers 2]
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+from config import Config
+from app import create_app
+from benchmarks.common import percentile
+
+
+def make_app(db_path, workers, users):
+    """Create an app with `workers` hashing processes and `users` evaluator accounts"""
+    Config.DATABASE_PATH = db_path
+    Config.PASSWORD_HASH_WORKERS = workers
+    app = create_app()
+    app.db.load_dataset([{
+        'example_id': i,
+        'category': 'bench',
+        'history': [{'role': 'user', 'content': 'q'}],
+        'responses': [{'model': 'model', 'output': 'a'}]
+    } for i in range(1, 101)])
+    for i in range(users):
+        app.db.create_user(f'user{i}', 'password')
+    return app
+
+
+def run_storm(app, logins, threads, raters):
+    """Run a login storm alongside rating writers; returns (login seconds, rating latencies)"""
+    stop = threading.Event()
+    latencies = []
+    login_queue = list(range(logins))
+    lock = threading.Lock()
+
+    def rater(user):
+        client = app.test_client()
+        client.post('/login', data={'username': f'user{user}', 'password': 'password'})
+        i = 0
+        while not stop.is_set():
+            start = time.perf_counter()
+            client.post('/api/rating', json={
+                'example_id': i % 100 + 1, 'model_name': 'model', 'rating': i % 5 + 1})
+            latencies.append(time.perf_counter() - start)
+            i += 1
+
+    def login_worker():
+        client = app.test_client()
+        while True:
+            with lock:
+                if not login_queue:
+                    return
+                n = login_queue.pop()
+            client.post('/login', data={'username': f'user{n % threads}', 'password': 'password'})
+
+    rating_threads = [threading.Thread(target=rater, args=(u,)) for u in range(raters)]
+    for t in rating_threads:
+        t.start()
+    time.sleep(0.5)
+    latencies.clear()
+
+    start = time.perf_counter()
+    login_threads = [threading.Thread(target=login_worker) for _ in range(threads)]
+    for t in login_threads:
+        t.start()
+    for t in login_threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    for t in rating_threads:
+        t.join()
+    return elapsed, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--logins', type=int, default=64, help='total logins in the storm')
+    parser.add_argument('--threads', type=int, default=32, help='concurrent login requests')
+    parser.add_argument('--raters', type=int, default=4, help='evaluators saving ratings meanwhile')
+    parser.add_argument('--workers', type=int, default=Config.PASSWORD_HASH_WORKERS,
+                        help='hashing processes for the pooled run')
+    args = parser.parse_args()
+
+    print(f'{args.logins} logins on {args.threads} threads, {args.raters} evaluators rating, '
+          f'{os.cpu_count()} CPUs, method {Config.PASSWORD_HASH_METHOD}')
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, workers in (('inline hashing', 0), (f'pool ({args.workers} workers)', args.workers)):
+            app = make_app(os.path.join(tmp, f'{workers}.db'), workers, args.threads)
+            elapsed, latencies = run_storm(app, args.logins, args.threads, args.raters)
+            app.db.close()
+            print(f'  {label:<20} {args.logins / elapsed:7.1f} logins/s   rating latency '
+                  f'p50 {statistics.median(latencies) * 1000:6.1f} ms  '
+                  f'p95 {percentile(latencies, 95) * 1000:6.1f} ms  '
+                  f'p99 {percentile(latencies, 99) * 1000:6.1f} ms  ({len(latencies)} saves)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Concurrent rating-write throughput: connection-per-call vs pooled WAL connections
+
+Usage: python -m benchmarks.bench_rating_writes [--threads 16] [--writes 200]
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime
+from app.models import Database
+
+
+def legacy_save_rating(db_path, user_id, example_id, model_name, rating):
+    """Original write path: open, write, commit and close per rating"""
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    cursor.execute(
+        '''INSERT OR REPLACE INTO ratings
+           (user_id, example_id, model_name, rating, timestamp)
+           VALUES (?, ?, ?, ?, ?)''',
+        (user_id, example_id, model_name, rating, timestamp)
+    )
+    conn.commit()
+    conn.close()
+
+
+def run_threads(save, threads, writes):
+    """Run `writes` saves on each of `threads` threads and return (seconds, errors)"""
+    errors = []
+    barrier = threading.Barrier(threads + 1)
+
+    def worker(user_id):
+        barrier.wait()
+        for i in range(writes):
+            try:
+                save(user_id, i, f'model-{i % 5}', i % 5 + 1)
+            except sqlite3.OperationalError as e:
+                errors.append(e)
+
+    workers = [threading.Thread(target=worker, args=(t + 1,)) for t in range(threads)]
+    for w in workers:
+        w.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for w in workers:
+        w.join()
+    return time.perf_counter() - start, len(errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--writes', type=int, default=200, help='writes per thread')
+    args = parser.parse_args()
+    total = args.threads * args.writes
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Before: rollback journal, one connection per write
+        legacy_path = os.path.join(tmp, 'legacy.db')
+        Database(legacy_path).close()
+        conn = sqlite3.connect(legacy_path)
+        conn.execute('PRAGMA journal_mode = DELETE')
+        conn.close()
+        legacy_time, legacy_errors = run_threads(
+            lambda *a: legacy_save_rating(legacy_path, *a), args.threads, args.writes)
+
+        # After: pooled persistent connections in WAL mode
+        db = Database(os.path.join(tmp, 'pooled.db'), pool_size=args.threads)
+        pooled_time, pooled_errors = run_threads(db.save_rating, args.threads, args.writes)
+        db.close()
+
+    print(f'{args.threads} threads x {args.writes} writes = {total} ratings')
+    print(f'  per-call connections: {total / legacy_time:10.1f} writes/s  ({legacy_errors} lock errors)')
+    print(f'  pooled WAL:           {total / pooled_time:10.1f} writes/s  ({pooled_errors} lock errors)')
+    print(f'  speedup:              {legacy_time / pooled_time:10.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Shared benchmark helpers: latency summaries and JSON result files
+"""
+import json
+import os
+import platform
+import subprocess
+from datetime import datetime
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def summarize(latencies, elapsed=None, errors=0):
+    """Summarize per-call latencies (seconds) as milliseconds and calls per second"""
+    if not latencies:
+        return {'count': 0, 'errors': errors}
+    summary = {
+        'count': len(latencies),
+        'errors': errors,
+        'mean_ms': sum(latencies) / len(latencies) * 1000,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'max_ms': max(latencies) * 1000,
+    }
+    # Sequential calls by default; pass wall time for concurrent runs
+    summary['per_second'] = len(latencies) / (elapsed if elapsed else sum(latencies))
+    return summary
+
+
+def print_table(results):
+    """Print {name: summary} as an aligned table"""
+    width = max(len(name) for name in results)
+    print(f"{'':<{width}}  {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'per sec':>10} {'errors':>6}")
+    for name, s in results.items():
+        if not s['count']:
+            print(f"{name:<{width}}  {0:>7} {'-':>9} {'-':>9} {'-':>9} {'-':>10} {s['errors']:>6}")
+            continue
+        print(f"{name:<{width}}  {s['count']:>7} {s['p50_ms']:>9.2f} {s['p95_ms']:>9.2f} "
+              f"{s['p99_ms']:>9.2f} {s['per_second']:>10.1f} {s['errors']:>6}")
+
+
+def git_revision():
+    """Current commit of the working tree, if available"""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True, cwd=os.path.dirname(RESULTS_DIR)).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(benchmark, params, results, path=None):
+    """Write a benchmark run to JSON (default: benchmarks/results/<benchmark>-<time>.json)"""
+    timestamp = datetime.now()
+    if path is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f"{benchmark}-{timestamp.strftime('%Y%m%d_%H%M%S')}.json")
+
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({
+            'benchmark': benchmark,
+            'timestamp': timestamp.isoformat(timespec='seconds'),
+            'git': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'params': params,
+            'results': results
+        }, f, ensure_ascii=False, indent=2)
+    return path
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Compare two benchmark result files
+
+Prints p50/p95/p99 and throughput for every entry present in both runs with
+the relative change; latency increases and throughput drops beyond
+--threshold are flagged.
+
+Usage: python -m benchmarks.compare benchmarks/results/load-A.json benchmarks/results/load-B.json
+           [--threshold 10]
+"""
+import argparse
+import json
+import sys
+
+# (metric, True when higher is better)
+METRICS = (('p50_ms', False), ('p95_ms', False), ('p99_ms', False), ('per_second', True))
+
+
+def load(path):
+    """Read a result file written by common.save_results"""
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def change(before, after):
+    """Relative change in percent"""
+    return (after - before) / before * 100 if before else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--threshold', type=float, default=10, help='percent change flagged as a regression')
+    args = parser.parse_args()
+
+    before, after = load(args.before), load(args.after)
+    if before['benchmark'] != after['benchmark']:
+        sys.exit(f"different benchmarks: {before['benchmark']} / {after['benchmark']}")
+    for run in (before, after):
+        print(f"{run['timestamp']}  git {run['git'] or '-'}  {run['cpus']} cpus  {run['params']}")
+    print()
+
+    names = [name for name in before['results'] if after['results'].get(name, {}).get('count')
+             and before['results'][name].get('count')]
+    width = max([len(name) for name in names] + [4])
+    print(f"{'':<{width}}  " + '  '.join(f'{metric:>24}' for metric, _ in METRICS))
+
+    regressions = 0
+    for name in names:
+        cells = []
+        for metric, higher_is_better in METRICS:
+            old, new = before['results'][name][metric], after['results'][name][metric]
+            delta = change(old, new)
+            worse = -delta if higher_is_better else delta
+            flag = '!' if worse > args.threshold else ' '
+            regressions += flag == '!'
+            cells.append(f'{old:>8.2f} → {new:>8.2f} {delta:>+5.0f}%{flag}')
+        print(f'{name:<{width}}  ' + '  '.join(cells))
+
+    for name in sorted(set(before['results']) ^ set(after['results'])):
+        print(f"{name}: only in {'before' if name in before['results'] else 'after'}")
+    print(f'\n{regressions} metric(s) worse by more than {args.threshold:g}%')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
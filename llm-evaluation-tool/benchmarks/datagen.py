@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Synthetic dataset and evaluator generator
+
+Writes N examples with M model responses each as NDJSON (or a JSON array for
+a .json path). With --database, also loads the dataset and creates K evaluator
+accounts (evaluator0..K-1) and an admin account, all with password 'password'.
+
+Usage: python -m benchmarks.datagen data/bench.ndjson --examples 10000 --models 4 \
+           [--database /tmp/bench.db --evaluators 20]
+"""
+import argparse
+import json
+import random
+
+PASSWORD = 'password'
+
+WORDS = (
+    'model answer question result value function data system user context '
+    '모델 답변 질문 결과 평가 데이터 함수 사용자 예시 설명 그러므로 따라서'
+).split()
+
+SYSTEM_PROMPT = 'You are a helpful assistant. Answer accurately and explain your reasoning step by step. ' * 4
+
+
+def _text(rng, length):
+    """Markdown-ish text of about `length` characters with occasional LaTeX"""
+    parts = []
+    size = 0
+    while size < length:
+        kind = rng.random()
+        if kind < 0.05:
+            part = f'$x_{rng.randint(1, 9)}^2 + {rng.randint(1, 99)}$'
+        elif kind < 0.08:
+            part = '\n\n- ' + ' '.join(rng.choices(WORDS, k=6))
+        elif kind < 0.10:
+            part = '**' + rng.choice(WORDS) + '**'
+        else:
+            part = rng.choice(WORDS)
+        parts.append(part)
+        size += len(part) + 1
+    return ' '.join(parts)
+
+
+def generate_examples(examples, models=4, categories=5, turns=2, history_chars=400,
+                      output_chars=1500, seed=0):
+    """Yield dataset items; every history starts with the same system prompt"""
+    rng = random.Random(seed)
+    model_names = [f'model-{m}' for m in range(models)]
+    for example_id in range(1, examples + 1):
+        history = [{'role': 'system', 'content': SYSTEM_PROMPT}]
+        for turn in range(turns):
+            role = 'user' if turn % 2 == 0 else 'assistant'
+            history.append({'role': role, 'content': _text(rng, history_chars)})
+        yield {
+            'example_id': example_id,
+            'category': f'category-{example_id % categories}',
+            'history': history,
+            'responses': [{'model': name, 'output': _text(rng, output_chars)} for name in model_names]
+        }
+
+
+def evaluator_names(count):
+    """Usernames of the generated evaluator accounts"""
+    return [f'evaluator{i}' for i in range(count)]
+
+
+def create_accounts(db, evaluators):
+    """Create evaluator accounts and an 'admin' account; returns evaluator user ids"""
+    db.create_user('admin', PASSWORD, role='admin')
+    ids = []
+    for username in evaluator_names(evaluators):
+        user_id = db.create_user(username, PASSWORD)
+        if user_id is None:
+            with db.connection() as conn:
+                user_id = conn.execute('SELECT id FROM users WHERE username = ?', (username,)).fetchone()[0]
+        ids.append(user_id)
+    return ids
+
+
+def write_dataset(path, items):
+    """Write items as a JSON array (.json) or NDJSON (anything else)"""
+    count = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        if path.endswith('.json'):
+            f.write('[')
+        for item in items:
+            if path.endswith('.json'):
+                f.write((',\n' if count else '\n') + json.dumps(item, ensure_ascii=False))
+            else:
+                f.write(json.dumps(item, ensure_ascii=False) + '\n')
+            count += 1
+        if path.endswith('.json'):
+            f.write('\n]\n')
+    return count
+
+
+def add_dataset_arguments(parser):
+    """Dataset shape options shared by the benchmark scripts"""
+    parser.add_argument('--examples', type=int, default=2000)
+    parser.add_argument('--models', type=int, default=4, help='responses per example')
+    parser.add_argument('--categories', type=int, default=5)
+    parser.add_argument('--turns', type=int, default=2, help='history turns after the system prompt')
+    parser.add_argument('--history-chars', type=int, default=400)
+    parser.add_argument('--output-chars', type=int, default=1500)
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def dataset_from_args(args):
+    """Generate the dataset described by add_dataset_arguments options"""
+    return generate_examples(args.examples, args.models, args.categories, args.turns,
+                             args.history_chars, args.output_chars, args.seed)
+
+
+def dataset_params(args):
+    """Dataset options as a dict for result files"""
+    return {key: getattr(args, key) for key in
+            ('examples', 'models', 'categories', 'turns', 'history_chars', 'output_chars', 'seed')}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('path', help='output file (.json for a JSON array, otherwise NDJSON)')
+    add_dataset_arguments(parser)
+    parser.add_argument('--database', help='also load the dataset and create accounts in this database')
+    parser.add_argument('--evaluators', type=int, default=10)
+    args = parser.parse_args()
+
+    count = write_dataset(args.path, dataset_from_args(args))
+    print(f'{count} examples written to {args.path}')
+
+    if args.database:
+        from app.models import Database
+        from app.ingest import load_dataset_file
+        db = Database(args.database)
+        loaded, elapsed = load_dataset_file(db, args.path)
+        create_accounts(db, args.evaluators)
+        db.close()
+        print(f'{loaded} examples loaded into {args.database} in {elapsed:.1f}s; '
+              f'{args.evaluators} evaluators + admin (password: {PASSWORD})')
+
+
+if __name__ == '__main__':
+    main()
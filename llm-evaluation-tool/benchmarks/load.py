@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+End-to-end load driver
+
+Simulated evaluators log in, open a category, walk through examples and save
+ratings (single and batched); simulated admins load the dashboard, page
+through ratings and export CSV. Reports latency percentiles and throughput
+per endpoint.
+
+By default the app runs in-process through the Flask test client on a scratch
+database. With --url, requests go to a running server that was loaded with
+the same generated dataset, e.g.:
+
+    python -m benchmarks.datagen /tmp/bench.ndjson --examples 2000 --database /tmp/bench.db
+    DATABASE_PATH=/tmp/bench.db DATASET_PATH=/tmp/bench.ndjson python run.py --production
+    python -m benchmarks.load --url http://127.0.0.1:8080 --dataset /tmp/bench.ndjson
+
+Usage: python -m benchmarks.load [--evaluators 8] [--admins 1] [--duration 30]
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from config import Config
+from app import create_app
+from app.ingest import iter_dataset
+from benchmarks import datagen
+from benchmarks.common import print_table, save_results, summarize
+
+
+class TestClientSession:
+    """Requests against an in-process app through the Flask test client"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, form=None, body=None):
+        response = self.client.open(path, method=method, data=form, json=body)
+        # Read streamed bodies (exports) completely, as a real client would
+        response.get_data()
+        return response.status_code
+
+
+class HttpSession:
+    """Requests against a running server, keeping the session cookie"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    def request(self, method, path, form=None, body=None):
+        data = None
+        headers = {}
+        if form is not None:
+            data = urllib.parse.urlencode(form).encode()
+        elif body is not None:
+            data = json.dumps(body).encode()
+            headers['Content-Type'] = 'application/json'
+        request = urllib.request.Request(self.base_url + path, data=data, headers=headers, method=method)
+        try:
+            with self.opener.open(request) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+
+class Recorder:
+    """Thread-safe per-endpoint latency and error collection"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def call(self, session, name, method, path, form=None, body=None):
+        start = time.perf_counter()
+        status = session.request(method, path, form=form, body=body)
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.latencies[name].append(elapsed)
+            if status >= 400:
+                self.errors[name] += 1
+        return status
+
+    def summary(self, duration):
+        return {name: summarize(self.latencies[name], duration, self.errors[name])
+                for name in sorted(self.latencies)}
+
+
+def evaluator(session, recorder, username, examples_by_category, models, stop, rng, batch_share):
+    """Log in, then keep rating examples in random categories until stopped"""
+    recorder.call(session, 'POST /login', 'POST', '/login',
+                  form={'username': username, 'password': datagen.PASSWORD})
+    while not stop.is_set():
+        recorder.call(session, 'GET /category', 'GET', '/category')
+        category = rng.choice(sorted(examples_by_category))
+        recorder.call(session, 'GET /evaluate/<category>', 'GET', '/evaluate/' + urllib.parse.quote(category))
+
+        for example_id in rng.sample(examples_by_category[category], min(5, len(examples_by_category[category]))):
+            if stop.is_set():
+                return
+            recorder.call(session, 'GET /api/example/<id>', 'GET', f'/api/example/{example_id}')
+            ratings = [{'example_id': example_id, 'model_name': model, 'rating': rng.randint(1, 5)}
+                       for model in models]
+            if rng.random() < batch_share:
+                recorder.call(session, 'POST /api/ratings', 'POST', '/api/ratings', body={'ratings': ratings})
+            else:
+                for rating in ratings:
+                    recorder.call(session, 'POST /api/rating', 'POST', '/api/rating', body=rating)
+        recorder.call(session, 'GET /api/progress/<category>', 'GET',
+                      f'/api/progress/{urllib.parse.quote(category)}?since=0')
+
+
+def admin(session, recorder, stop, rng, export_every):
+    """Log in as admin, then poll the dashboard and ratings API, exporting now and then"""
+    recorder.call(session, 'POST /login', 'POST', '/login',
+                  form={'username': 'admin', 'password': datagen.PASSWORD})
+    rounds = 0
+    while not stop.is_set():
+        recorder.call(session, 'GET /admin/', 'GET', '/admin/')
+        recorder.call(session, 'GET /admin/api/ratings', 'GET', '/admin/api/ratings?count=1')
+        rounds += 1
+        if export_every and rounds % export_every == 0:
+            recorder.call(session, 'GET /admin/export/csv', 'GET', '/admin/export/csv')
+        time.sleep(rng.uniform(0.05, 0.2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    datagen.add_dataset_arguments(parser)
+    parser.add_argument('--url', help='base URL of a running server (default: in-process test client)')
+    parser.add_argument('--dataset', help='dataset file the server was loaded with (required with --url)')
+    parser.add_argument('--evaluators', type=int, default=8, help='concurrent evaluator sessions')
+    parser.add_argument('--admins', type=int, default=1, help='concurrent admin sessions')
+    parser.add_argument('--duration', type=float, default=30, help='seconds')
+    parser.add_argument('--batch-share', type=float, default=0.5,
+                        help='fraction of examples saved through /api/ratings')
+    parser.add_argument('--export-every', type=int, default=10, help='admin rounds between CSV exports (0: never)')
+    parser.add_argument('--output', help='JSON result path (default: benchmarks/results/)')
+    args = parser.parse_args()
+
+    if args.url and not args.dataset:
+        parser.error('--url requires --dataset')
+
+    tmp = None
+    if args.url:
+        items = list(iter_dataset(args.dataset))
+        make_session = lambda: HttpSession(args.url)
+    else:
+        tmp = tempfile.TemporaryDirectory()
+        Config.DATABASE_PATH = os.path.join(tmp.name, 'load.db')
+        app = create_app()
+        items = list(datagen.dataset_from_args(args))
+        app.db.load_dataset(items)
+        datagen.create_accounts(app.db, args.evaluators)
+        make_session = lambda: TestClientSession(app)
+
+    examples_by_category = defaultdict(list)
+    for item in items:
+        examples_by_category[item['category']].append(item['example_id'])
+    models = [response['model'] for response in items[0]['responses']]
+
+    recorder = Recorder()
+    stop = threading.Event()
+    threads = [
+        threading.Thread(target=evaluator, args=(
+            make_session(), recorder, username, examples_by_category, models, stop,
+            random.Random(args.seed + i), args.batch_share))
+        for i, username in enumerate(datagen.evaluator_names(args.evaluators))
+    ] + [
+        threading.Thread(target=admin, args=(make_session(), recorder, stop, random.Random(-i), args.export_every))
+        for i in range(args.admins)
+    ]
+
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(args.duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - start
+
+    results = recorder.summary(duration)
+    print_table(results)
+    total = sum(s['count'] for s in results.values())
+    print(f'{total} requests in {duration:.1f}s = {total / duration:.1f} req/s')
+
+    params = dict(datagen.dataset_params(args), target=args.url or 'test-client',
+                  evaluators=args.evaluators, admins=args.admins, duration=args.duration,
+                  batch_share=args.batch_share, export_every=args.export_every)
+    print(f'results saved to {save_results("load", params, results, args.output)}')
+    if tmp is not None:
+        app.db.close()
+        tmp.cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -8,3 +8,81 @@ class Config:
     PORT = int(os.environ.get('PORT', 8080))
     HOST = os.environ.get('HOST', '0.0.0.0')
     DEBUG = os.environ.get('DEBUG', 'False').lower() == 'true'
+
+    # SQLite connection pool and tuning
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 8))
+    DB_BUSY_TIMEOUT = float(os.environ.get('DB_BUSY_TIMEOUT', 5.0))
+    DB_SYNCHRONOUS = os.environ.get('DB_SYNCHRONOUS', 'NORMAL')
+    DB_CACHE_SIZE_KB = int(os.environ.get('DB_CACHE_SIZE_KB', 16384))
+    DB_MMAP_SIZE = int(os.environ.get('DB_MMAP_SIZE', 268435456))
+    DB_LOCK_RETRIES = int(os.environ.get('DB_LOCK_RETRIES', 5))
+
+    # Evaluate page: examples fetched ahead of the current one
+    EVALUATE_PREFETCH = int(os.environ.get('EVALUATE_PREFETCH', 3))
+
+    # Maximum ratings accepted by one /api/ratings batch
+    RATING_BATCH_MAX = int(os.environ.get('RATING_BATCH_MAX', 200))
+
+    # Production server (python run.py --production): gunicorn processes and threads
+    WEB_WORKERS = int(os.environ.get('WEB_WORKERS', (os.cpu_count() or 1) * 2 + 1))
+    WEB_THREADS = int(os.environ.get('WEB_THREADS', 4))
+    WEB_TIMEOUT = int(os.environ.get('WEB_TIMEOUT', 60))
+    WEB_GRACEFUL_TIMEOUT = int(os.environ.get('WEB_GRACEFUL_TIMEOUT', 30))
+    WEB_KEEPALIVE = int(os.environ.get('WEB_KEEPALIVE', 5))
+    WEB_MAX_REQUESTS = int(os.environ.get('WEB_MAX_REQUESTS', 0))
+
+    # Cached categories, example lists and parsed examples (entries per process)
+    DATASET_CACHE_SIZE = int(os.environ.get('DATASET_CACHE_SIZE', 1024))
+
+    # Example text compression: auto (zstd if installed, else zlib), zstd, zlib or raw
+    BLOB_CODEC = os.environ.get('BLOB_CODEC', 'auto')
+    BLOB_LEVEL = int(os.environ['BLOB_LEVEL']) if os.environ.get('BLOB_LEVEL') else None
+
+    # Pre-render example Markdown/LaTeX to HTML at dataset load (needs markdown, nh3)
+    RENDER_HTML = os.environ.get('RENDER_HTML', 'False').lower() == 'true'
+    RENDER_WORKERS = int(os.environ['RENDER_WORKERS']) if os.environ.get('RENDER_WORKERS') else None
+
+    # Agreement analytics (needs numpy): bootstrap resamples, worker processes
+    # (empty = CPU count, 0 = in-process), largest example x model x evaluator array
+    ANALYTICS_BOOTSTRAP = int(os.environ.get('ANALYTICS_BOOTSTRAP', 1000))
+    ANALYTICS_WORKERS = int(os.environ['ANALYTICS_WORKERS']) if os.environ.get('ANALYTICS_WORKERS') else None
+    ANALYTICS_MAX_CELLS = int(os.environ.get('ANALYTICS_MAX_CELLS', 20_000_000))
+
+    # Password hashing: werkzeug method string (cost parameters included), worker
+    # processes per server process (0 = hash on the request thread)
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+    PASSWORD_HASH_QUEUE = int(os.environ.get('PASSWORD_HASH_QUEUE', 32))
+
+    # Instrumentation: request/query histograms at /admin/metrics (Prometheus text
+    # format), optional bearer token for scrapers, slow-query log threshold (0 = off)
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'False').lower() == 'true'
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+    SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 0))
+
+    # Work assignment (/api/next): ratings wanted per example and model, seconds an
+    # evaluator holds an assigned example before it is handed out as if unassigned
+    ASSIGNMENT_TARGET = int(os.environ.get('ASSIGNMENT_TARGET', 3))
+    ASSIGNMENT_LEASE_SECONDS = int(os.environ.get('ASSIGNMENT_LEASE_SECONDS', 900))
+
+    # Live admin dashboard (Server-Sent Events): seconds between change checks
+    # (updates within one interval are sent as one message), seconds between
+    # keepalive comments, newest ratings sent per update, and open streams per
+    # server process (each holds a request thread; keep it below WEB_THREADS)
+    LIVE_INTERVAL = float(os.environ.get('LIVE_INTERVAL', 1.0))
+    LIVE_KEEPALIVE = float(os.environ.get('LIVE_KEEPALIVE', 15))
+    LIVE_MAX_RATINGS = int(os.environ.get('LIVE_MAX_RATINGS', 50))
+    LIVE_MAX_SUBSCRIBERS = int(os.environ.get('LIVE_MAX_SUBSCRIBERS', 2))
+
+    # Background jobs (dataset loads, exports): jobs running at once across all
+    # server processes (0 = none in the server; run `manage.py worker` instead),
+    # export file directory, attempts for jobs whose process died, days finished
+    # jobs and their files are kept
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 1))
+    JOB_ARTIFACT_DIR = os.environ.get('JOB_ARTIFACT_DIR') or os.path.join(os.path.dirname(DATABASE_PATH), 'exports')
+    JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 3))
+    JOB_RETENTION_DAYS = float(os.environ.get('JOB_RETENTION_DAYS', 7))
+
+    # Cached user identity and role used by admin permission checks
+    USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', 60))
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 4096))
@@ -0,0 +1,61 @@
+"""pytest configuration: makes the app package importable from tests/ and provides shared fixtures"""
+import pytest
+
+from config import Config
+
+
+def make_example(example_id, category, models, text='질문'):
+    """Dataset item with one user turn and a response from each of `models`"""
+    return {
+        'example_id': example_id,
+        'category': category,
+        'history': [{'role': 'user', 'content': f'{text} {example_id}'}],
+        'responses': [{'model': model, 'output': f'{model} 답변 {example_id}'} for model in models],
+    }
+
+
+@pytest.fixture
+def dataset():
+    """Four examples in two categories, with two or three models each"""
+    return [
+        make_example(1, '번역', ['GPT-5', 'Claude', 'Gemini']),
+        make_example(2, '번역', ['GPT-5', 'Claude']),
+        make_example(3, '수학', ['GPT-5', 'Gemini']),
+        make_example(4, '수학', ['GPT-5', 'Claude']),
+    ]
+
+
+@pytest.fixture
+def db(tmp_path, dataset):
+    """Database on a temporary file holding `dataset`, hashing passwords inline"""
+    from app.models import Database
+    from app.passwords import PasswordHasher
+    db = Database(str(tmp_path / 'test.db'), hasher=PasswordHasher('pbkdf2:sha256:1000'))
+    db.load_dataset(dataset)
+    yield db
+    db.close()
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch, dataset):
+    """App on a temporary database holding `dataset`, hashing passwords inline"""
+    monkeypatch.setattr(Config, 'DATABASE_PATH', str(tmp_path / 'test.db'))
+    monkeypatch.setattr(Config, 'JOB_ARTIFACT_DIR', str(tmp_path / 'exports'))
+    monkeypatch.setattr(Config, 'PASSWORD_HASH_METHOD', 'pbkdf2:sha256:1000')
+    monkeypatch.setattr(Config, 'PASSWORD_HASH_WORKERS', 0)
+
+    from app import create_app
+    app = create_app()
+    app.config['TESTING'] = True
+    app.db.load_dataset(dataset)
+    yield app
+    app.db.close()
+
+
+@pytest.fixture
+def client(app):
+    """Test client logged in as a new evaluator"""
+    app.db.create_user('evaluator', 'password')
+    client = app.test_client()
+    client.post('/login', data={'username': 'evaluator', 'password': 'password'})
+    return client
@@ -5,6 +5,7 @@ Initialize admin user for the LLM Evaluation Tool
 import os
 import sys
 from app.models import Database
+from app.passwords import PasswordHasher
 from config import Config
 
 def main():
@@ -15,7 +16,7 @@ def main():
     if db_dir and not os.path.exists(db_dir):
         os.makedirs(db_dir)
 
-    db = Database(Config.DATABASE_PATH)
+    db = Database(Config.DATABASE_PATH, hasher=PasswordHasher(Config.PASSWORD_HASH_METHOD))
 
     print("=" * 60)
     print("LLM 평가 도구 - 초기 사용자 설정")
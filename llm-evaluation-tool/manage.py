@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+LLM Evaluation Tool - Maintenance Commands
+
+Usage: python manage.py <command> [options]
+"""
+import argparse
+import os
+import signal
+import sys
+import threading
+from app import migrations
+from app.jobs import JobRunner
+from app.models import Database
+from config import Config
+
+
+def open_database():
+    """Open the configured database"""
+    db_dir = os.path.dirname(Config.DATABASE_PATH)
+    if db_dir and not os.path.exists(db_dir):
+        os.makedirs(db_dir)
+    return Database(Config.DATABASE_PATH)
+
+
+def rebuild_stats(args):
+    """Check aggregate, leaderboard and coverage tables against a full recompute and repair them"""
+    db = open_database()
+    mismatches = db.rebuild_stats(check_only=args.check)
+
+    for table, group, expected, actual in mismatches:
+        print(f"  {table} {group}: 재계산={expected} 저장됨={actual}")
+
+    if not mismatches:
+        print("✓ 집계·리더보드·배정 현황 테이블이 전체 재계산 결과와 일치합니다.")
+        return 0
+    if args.check:
+        print(f"⚠ 불일치 {len(mismatches)}건 발견")
+        return 1
+    print(f"✓ 불일치 {len(mismatches)}건을 재계산으로 복구했습니다.")
+    return 0
+
+
+def migrate(args):
+    """Apply pending schema migrations and print the schema version"""
+    db = open_database()
+    with db.connection() as conn:
+        rows = conn.execute('SELECT * FROM schema_version ORDER BY version').fetchall()
+    for row in rows:
+        print(f"  v{row['version']:<3} {row['applied_at']}  {row['description']}")
+    print(f"✓ 스키마 버전: {rows[-1]['version'] if rows else 0}")
+    return 0
+
+
+def check_plans(args):
+    """Fail if any hot query path falls back to a full scan or a sort"""
+    failures = migrations.check_query_plans(Database)
+
+    for call, sql, problems in failures:
+        print(f"✗ {call}")
+        print(f"    {sql}")
+        for problem in problems:
+            print(f"    → {problem}")
+
+    if failures:
+        print(f"⚠ 인덱스를 사용하지 않는 쿼리 {len(failures)}건")
+        return 1
+    print(f"✓ 쿼리 계획 검사 통과 ({len(migrations.PLAN_CHECKS)}개 호출)")
+    return 0
+
+
+def format_bytes(size):
+    """Human-readable byte count"""
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+def storage(args):
+    """Report how much space deduplication and compression of example texts save"""
+    db = open_database()
+    report = db.get_storage_report()
+
+    logical = report['logical_bytes']
+    print(f"  텍스트 참조 {report['references']}개 → 고유 블롭 {report['blobs']}개 "
+          f"(코덱: {', '.join(f'{c} {n}개' for c, n in sorted(report['codecs'].items())) or '-'})")
+    print(f"  원본 텍스트:        {format_bytes(logical)}")
+    print(f"  중복 제거 후:       {format_bytes(report['unique_bytes'])}")
+    print(f"  압축 후 저장 크기:  {format_bytes(report['stored_bytes'])}")
+    print(f"  구조(JSON) 크기:    {format_bytes(report['structure_bytes'])}")
+    print(f"  DB 파일:            {format_bytes(report['file_bytes'])} "
+          f"(재사용 가능한 빈 공간 {format_bytes(report['free_bytes'])})")
+    if logical:
+        print(f"✓ 예제 텍스트 저장 공간 {100 * (1 - report['stored_bytes'] / logical):.1f}% 절감")
+
+    if args.vacuum:
+        with db.connection() as conn:
+            conn.execute('VACUUM')
+        print(f"✓ VACUUM 완료: DB 파일 {format_bytes(db.get_storage_report()['file_bytes'])}")
+    return 0
+
+
+def dataset_versions(args):
+    """List dataset versions, activate one (e.g. to roll back) or drop an inactive one"""
+    db = open_database()
+    if args.activate is not None:
+        if not db.activate_dataset(args.activate):
+            print(f"✗ 버전 {args.activate}은 활성화할 수 없습니다. (없거나 로드가 끝나지 않음)")
+            return 1
+        print(f"✓ 버전 {args.activate} 활성화")
+    if args.drop is not None:
+        if not db.drop_dataset(args.drop):
+            print(f"✗ 버전 {args.drop}은 삭제할 수 없습니다. (없거나 활성 버전)")
+            return 1
+        print(f"✓ 버전 {args.drop} 삭제")
+
+    labels = {'building': '생성 중', 'ready': '대기', 'failed': '실패'}
+    for dataset in db.get_dataset_versions():
+        status = '활성' if dataset['active'] else labels[dataset['status']]
+        print(f"  v{dataset['version']:<4} {status:<5} 예제 {dataset['examples']}개 "
+              f"(변경 {dataset['changed']}개)  {dataset['created_at']}  {dataset['source'] or '-'}")
+    return 0
+
+
+def worker(args):
+    """Run background jobs (dataset loads, exports) until interrupted"""
+    db = open_database()
+    runner = JobRunner(db, Config.JOB_ARTIFACT_DIR, workers=args.jobs or max(Config.JOB_WORKERS, 1),
+                       max_attempts=Config.JOB_MAX_ATTEMPTS, retention_days=Config.JOB_RETENTION_DAYS)
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopped.set())
+
+    runner.start()
+    print(f"✓ 작업 실행기 시작 (동시 작업 {runner.workers}개, 파일: {runner.artifact_dir})")
+    try:
+        stopped.wait()
+    except KeyboardInterrupt:
+        pass
+    # Running jobs stop at their next progress report and go back to the queue
+    runner.stop()
+    db.close()
+    print("✓ 작업 실행기 종료")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='LLM 평가 도구 관리 명령')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('rebuild-stats', help='집계 통계·리더보드·배정 현황 테이블 검증 및 재계산')
+    command.add_argument('--check', action='store_true', help='복구하지 않고 검증만 수행')
+    command.set_defaults(func=rebuild_stats)
+
+    command = commands.add_parser('migrate', help='스키마 마이그레이션 적용 및 버전 확인')
+    command.set_defaults(func=migrate)
+
+    command = commands.add_parser('check-plans', help='주요 쿼리가 인덱스를 사용하는지 EXPLAIN QUERY PLAN으로 검사')
+    command.set_defaults(func=check_plans)
+
+    command = commands.add_parser('storage', help='예제 텍스트 중복 제거·압축 절감량 보고')
+    command.add_argument('--vacuum', action='store_true', help='빈 공간을 정리해 DB 파일 크기 축소')
+    command.set_defaults(func=storage)
+
+    command = commands.add_parser('datasets', help='데이터셋 버전 목록·활성화(롤백)·삭제')
+    command.add_argument('--activate', type=int, metavar='VERSION', help='지정한 버전을 활성화')
+    command.add_argument('--drop', type=int, metavar='VERSION',
+                         help='비활성 버전 삭제 (참조되지 않는 예제 텍스트도 정리, 쓰기 잠금을 잠시 점유)')
+    command.set_defaults(func=dataset_versions)
+
+    command = commands.add_parser('worker', help='백그라운드 작업(데이터셋 로드·내보내기) 실행기')
+    command.add_argument('--jobs', type=int, help='모든 프로세스를 합친 동시 실행 작업 수 (기본: JOB_WORKERS)')
+    command.set_defaults(func=worker)
+
+    args = parser.parse_args()
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
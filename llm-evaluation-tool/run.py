@@ -1,14 +1,93 @@
 #!/usr/bin/env python3
 """
 LLM Evaluation Tool - Main Application Entry Point
+
+Usage: python run.py                    # Flask development server
+       python run.py --production       # multi-process gunicorn server
+       python run.py --reload-dataset   # load the dataset even if it is unchanged
 """
+import argparse
 import os
 import sys
 from app import create_app
+from app.ingest import load_dataset_file, sync_dataset_file
 from config import Config
 
+def report_progress(count, elapsed):
+    """Print dataset loading progress"""
+    if count % 10000 == 0:
+        print(f"  ... {count}개 예제 로드 중 ({count / max(elapsed, 1e-9):.0f}개/초)")
+
+def load_dataset(app, reload=False):
+    """Load the configured dataset into the database if it exists and changed since its last load"""
+    dataset_path = app.config['DATASET_PATH']
+    if os.path.exists(dataset_path):
+        try:
+            if reload:
+                count, elapsed = load_dataset_file(app.db, dataset_path, progress=report_progress)
+                version = None
+            else:
+                count, elapsed, version = sync_dataset_file(app.db, dataset_path, progress=report_progress)
+            if version is not None:
+                print(f"✓ 데이터셋 변경 없음: 버전 {version}의 {count}개 예제 사용 ({elapsed:.2f}초)")
+            else:
+                print(f"✓ 데이터셋 로드 완료: {count}개 예제 ({elapsed:.1f}초, {count / max(elapsed, 1e-9):.0f}개/초)")
+        except Exception as e:
+            print(f"⚠ 데이터셋 로드 실패: {e}")
+    else:
+        print(f"⚠ 데이터셋 파일을 찾을 수 없습니다: {dataset_path}")
+
+def start_worker(app):
+    """Start a server process's password hashing pool and background job threads"""
+    app.db.hasher.start()
+    app.jobs.start()
+
+def stop_worker(app):
+    """End live dashboard streams, hand running jobs back to the queue and close the process's connections"""
+    app.live.stop()
+    app.jobs.stop(app.config['WEB_GRACEFUL_TIMEOUT'] / 2)
+    app.db.close()
+
+def serve_production(app):
+    """Serve the app with gunicorn worker processes forked from this one"""
+    from gunicorn.app.base import BaseApplication
+
+    class ProductionServer(BaseApplication):
+        """Gunicorn application serving an already created Flask app"""
+
+        def load_config(self):
+            config = app.config
+            self.cfg.set('bind', f"{config['HOST']}:{config['PORT']}")
+            self.cfg.set('workers', config['WEB_WORKERS'])
+            self.cfg.set('worker_class', 'gthread')
+            self.cfg.set('threads', config['WEB_THREADS'])
+            self.cfg.set('timeout', config['WEB_TIMEOUT'])
+            self.cfg.set('graceful_timeout', config['WEB_GRACEFUL_TIMEOUT'])
+            self.cfg.set('keepalive', config['WEB_KEEPALIVE'])
+            self.cfg.set('max_requests', config['WEB_MAX_REQUESTS'])
+            self.cfg.set('max_requests_jitter', config['WEB_MAX_REQUESTS'] // 10)
+            self.cfg.set('accesslog', '-' if config['DEBUG'] else None)
+            # Hashing processes are forked before the worker starts its threads,
+            # and closed with the SQLite connections when the worker exits
+            self.cfg.set('post_fork', lambda server, worker: start_worker(app))
+            self.cfg.set('worker_exit', lambda server, worker: stop_worker(app))
+
+        def load(self):
+            return app
+
+    # SQLite connections must not cross fork(); workers open their own lazily
+    app.db.close()
+    ProductionServer().run()
+
 def main():
     """Run the Flask application"""
+    parser = argparse.ArgumentParser(description='LLM 평가 도구 서버')
+    parser.add_argument('--production', action='store_true',
+                        help='gunicorn 멀티 프로세스 서버로 실행')
+    parser.add_argument('--reload-dataset', action='store_true',
+                        help='데이터셋 파일이 바뀌지 않았어도 다시 로드')
+    args = parser.parse_args()
+
     app = create_app()
 
     print("=" * 60)
@@ -17,30 +96,29 @@ def main():
     print(f"데이터베이스 경로: {app.config['DATABASE_PATH']}")
     print(f"데이터셋 경로: {app.config['DATASET_PATH']}")
     print(f"서버 주소: http://{app.config['HOST']}:{app.config['PORT']}")
+    if args.production:
+        print(f"워커: {app.config['WEB_WORKERS']}개 프로세스 × {app.config['WEB_THREADS']}개 스레드")
     print("=" * 60)
 
-    # Load dataset if specified and exists
-    dataset_path = app.config['DATASET_PATH']
-    if os.path.exists(dataset_path):
-        try:
-            import json
-            with open(dataset_path, 'r', encoding='utf-8') as f:
-                dataset = json.load(f)
-            app.db.load_dataset(dataset)
-            print(f"✓ 데이터셋 로드 완료: {len(dataset)}개 예제")
-        except Exception as e:
-            print(f"⚠ 데이터셋 로드 실패: {e}")
-    else:
-        print(f"⚠ 데이터셋 파일을 찾을 수 없습니다: {dataset_path}")
+    # Loaded once here, before any worker process is forked
+    load_dataset(app, reload=args.reload_dataset)
 
     print("=" * 60)
     print("\n서버가 시작되었습니다. 웹 브라우저에서 접속하세요.\n")
 
-    app.run(
-        host=app.config['HOST'],
-        port=app.config['PORT'],
-        debug=app.config['DEBUG']
-    )
+    if args.production:
+        serve_production(app)
+    else:
+        # With the debug reloader, this process only watches files and restarts
+        # a child that serves requests; only the serving process runs jobs.
+        # Hashing processes are forked first, while this is the only thread
+        if not app.debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            start_worker(app)
+        app.run(
+            host=app.config['HOST'],
+            port=app.config['PORT'],
+            debug=app.config['DEBUG']
+        )
 
 if __name__ == '__main__':
     main()
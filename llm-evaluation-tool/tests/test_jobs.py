@@ -0,0 +1,106 @@
+"""
+Background job runner tests
+
+Jobs run on a JobRunner against a temporary database with short heartbeat
+and staleness intervals, so recovery happens within a test's time budget.
+"""
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from app import jobs
+from app.jobs import JobRunner
+
+
+def wait_for(condition, timeout=10.0):
+    """Poll `condition` until it is true; fails the test after `timeout` seconds"""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.05)
+
+
+@pytest.fixture
+def release(monkeypatch):
+    """Job kinds `hold` (runs until the event is set) and `quick`, with fast heartbeats"""
+    release = threading.Event()
+
+    def hold(db, job):
+        while not release.wait(0.05):
+            job.progress(0)
+        return 'held', None
+
+    monkeypatch.setitem(jobs.HANDLERS, 'hold', hold)
+    monkeypatch.setitem(jobs.HANDLERS, 'quick', lambda db, job: ('done', None))
+    monkeypatch.setattr(jobs, 'HEARTBEAT_INTERVAL', 0.05)
+    monkeypatch.setattr(jobs, 'STALE_AFTER', 1.0)
+    yield release
+    release.set()
+
+
+def test_failed_finish_is_recovered_while_another_job_runs(db, release, tmp_path):
+    held = db.enqueue_job('hold', {})
+    quick = db.enqueue_job('quick', {})
+    finish_job = db.finish_job
+    failures = []
+
+    def failing_finish(job_id, status, *args):
+        if job_id == quick and not failures:
+            failures.append(status)
+            raise sqlite3.OperationalError('database is locked')
+        finish_job(job_id, status, *args)
+
+    db.finish_job = failing_finish
+    runner = JobRunner(db, str(tmp_path / 'artifacts'), workers=2, poll_interval=0.05)
+    runner.start()
+    try:
+        # The held job keeps its worker heartbeating; the quick job's row must
+        # still go stale and be run again
+        wait_for(lambda: db.get_job(quick)['status'] == 'succeeded')
+        assert failures == ['succeeded']
+        assert db.get_job(quick)['attempts'] == 2
+        assert db.get_job(held)['status'] == 'running'
+
+        release.set()
+        wait_for(lambda: db.get_job(held)['status'] == 'succeeded')
+        assert db.get_job(held)['attempts'] == 1
+    finally:
+        runner.stop()
+
+
+def abandon(db, worker='gone:1:dead'):
+    """Claim the next job for a worker that then stops heartbeating; returns the job"""
+    job = db.claim_job(worker, 10)
+    with db.transaction() as conn:
+        conn.execute("UPDATE jobs SET heartbeat_at = '2000-01-01 00:00:00' WHERE id = ?", (job['id'],))
+    return job
+
+
+def test_job_with_a_missed_heartbeat_is_queued_again_and_run(db, release, tmp_path):
+    job_id = db.enqueue_job('quick', {})
+    abandon(db)
+    assert db.recover_jobs(3) == [job_id]
+    assert db.get_job(job_id)['status'] == 'queued'
+    assert db.recover_jobs(3) == []
+
+    runner = JobRunner(db, str(tmp_path / 'artifacts'), poll_interval=0.05)
+    runner.start()
+    try:
+        wait_for(lambda: db.get_job(job_id)['status'] == 'succeeded')
+        assert db.get_job(job_id)['attempts'] == 2
+    finally:
+        runner.stop()
+
+
+def test_abandoned_jobs_fail_past_the_attempt_limit_or_end_cancelled(db):
+    failing = db.enqueue_job('quick', {})
+    abandon(db)
+    cancelled = db.enqueue_job('quick', {})
+    abandon(db)
+    db.cancel_job(cancelled)
+
+    assert sorted(db.recover_jobs(1)) == [failing, cancelled]
+    assert db.get_job(failing)['status'] == 'failed'
+    assert db.get_job(cancelled)['status'] == 'cancelled'
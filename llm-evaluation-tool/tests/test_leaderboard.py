@@ -0,0 +1,66 @@
+"""
+Incremental leaderboard tests
+
+Per-model Welford statistics, histograms and pairwise win counts are kept up
+to date by every rating write; they are checked against values computed
+directly from the ratings.
+"""
+import statistics
+
+import pytest
+
+
+def models(db):
+    """Leaderboard entries by model name"""
+    return {entry['model_name']: entry for entry in db.get_leaderboard()['models']}
+
+
+def pair(db, winner, loser):
+    """(wins of `winner`, wins of `loser`, ties) over the pair's shared ratings"""
+    for entry in db.get_leaderboard()['pairs']:
+        if (entry['model_a'], entry['model_b']) == (winner, loser):
+            return entry['wins'], entry['losses'], entry['ties']
+        if (entry['model_a'], entry['model_b']) == (loser, winner):
+            return entry['losses'], entry['wins'], entry['ties']
+    return 0, 0, 0
+
+
+@pytest.fixture
+def rated(db):
+    """Two evaluators' ratings of the 번역 examples; returns (db, bob's user id)"""
+    alice, bob = db.create_user('alice', 'pw'), db.create_user('bob', 'pw')
+    db.save_ratings(alice, [(1, 'GPT-5', 5), (1, 'Claude', 3), (1, 'Gemini', 3), (2, 'GPT-5', 4), (2, 'Claude', 4)])
+    db.save_ratings(bob, [(1, 'GPT-5', 2), (1, 'Claude', 4)])
+    return db, bob
+
+
+def test_model_statistics_match_the_ratings(rated):
+    db, _ = rated
+    entries = models(db)
+    for model_name, ratings in (('GPT-5', [5, 2, 4]), ('Claude', [3, 4, 4]), ('Gemini', [3])):
+        entry = entries[model_name]
+        assert entry['count'] == len(ratings)
+        assert entry['mean'] == pytest.approx(statistics.mean(ratings))
+        if len(ratings) > 1:
+            assert entry['stddev'] == pytest.approx(statistics.stdev(ratings))
+        assert entry['histogram'] == {value: ratings.count(value) for value in range(1, 6)}
+
+
+def test_pairs_count_wins_of_the_same_evaluator_and_example(rated):
+    db, _ = rated
+    assert pair(db, 'GPT-5', 'Claude') == (1, 1, 1)
+    assert pair(db, 'GPT-5', 'Gemini') == (1, 0, 0)
+    assert pair(db, 'Claude', 'Gemini') == (0, 0, 1)
+
+
+def test_replacing_a_rating_moves_its_statistics_and_pairs(rated):
+    db, bob = rated
+    db.save_rating(bob, 1, 'Claude', 1)
+
+    entry = models(db)['Claude']
+    assert entry['count'] == 3
+    assert entry['mean'] == pytest.approx(statistics.mean([3, 1, 4]))
+    assert entry['stddev'] == pytest.approx(statistics.stdev([3, 1, 4]))
+    assert entry['histogram'][1] == 1
+    assert pair(db, 'GPT-5', 'Claude') == (2, 0, 1)
+    assert db.rebuild_stats(check_only=True) == []
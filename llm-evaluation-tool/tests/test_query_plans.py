@@ -0,0 +1,23 @@
+"""
+Query plan regression tests
+
+Every hot query path listed in migrations.PLAN_CHECKS must be served by an
+index on a freshly migrated database. A migration or query change that makes
+one fall back to a full scan or a temporary sort fails here.
+"""
+from app import migrations
+from app.models import Database
+
+
+def test_migrations_reach_latest_version(tmp_path):
+    db = Database(str(tmp_path / 'test.db'))
+    with db.connection() as conn:
+        assert migrations.current_version(conn) == migrations.MIGRATIONS[-1][0]
+    db.close()
+
+
+def test_hot_queries_use_indexes():
+    failures = migrations.check_query_plans(Database)
+    assert not failures, '\n'.join(
+        f'{call}: {sql}\n    ' + '\n    '.join(problems) for call, sql, problems in failures
+    )
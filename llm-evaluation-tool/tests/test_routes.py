@@ -0,0 +1,58 @@
+"""
+Evaluator API tests
+
+Requests go through the Flask test client, logged in as an evaluator, against
+the small dataset from conftest.py.
+"""
+import pytest
+
+
+def test_save_ratings_saves_a_batch(client):
+    response = client.post('/api/ratings', json={'ratings': [
+        {'example_id': 1, 'model_name': 'GPT-5', 'rating': 4},
+        {'example_id': 1, 'model_name': 'Claude', 'rating': 2},
+    ]})
+    assert response.status_code == 200
+    assert response.json['success']
+    assert response.json['saved'] == 2
+
+
+@pytest.mark.parametrize('body', [[], [{'example_id': 1}], 'ratings', 3, None])
+def test_save_ratings_rejects_bodies_that_are_not_objects(client, body):
+    response = client.post('/api/ratings', json=body)
+    assert response.status_code == 400
+    assert response.json == {'success': False, 'message': '평가 목록이 필요합니다.'}
+
+
+def test_save_ratings_rejects_unknown_models_and_examples(client):
+    response = client.post('/api/ratings', json={'ratings': [
+        {'example_id': 2, 'model_name': 'Gemini', 'rating': 3},
+        {'example_id': 99, 'model_name': 'GPT-5', 'rating': 3},
+        {'example_id': 2, 'model_name': 'GPT-5', 'rating': 3},
+    ]})
+    assert response.status_code == 200
+    assert [result['success'] for result in response.json['results']] == [False, False, True]
+    assert response.json['changes'] == [{'example_id': 2, 'model_name': 'GPT-5', 'rating': 3}]
+
+    response = client.post('/api/rating', json={'example_id': 2, 'model_name': 'Gemini', 'rating': 3})
+    assert response.status_code == 400
+    response = client.post('/api/rating', json={'example_id': 99, 'model_name': 'GPT-5', 'rating': 3})
+    assert response.status_code == 404
+
+
+def test_evaluate_page_keeps_the_current_assignment(app, client):
+    with client.session_transaction() as session:
+        user_id = session['user_id']
+    assert client.get('/evaluate/번역').status_code == 200
+    first = app.db.get_assignment(user_id, '번역', app.config['ASSIGNMENT_TARGET'])
+    assert first is not None
+
+    # A reload reads the lease instead of taking a new one
+    assert client.get('/evaluate/번역').status_code == 200
+    assert app.db.get_assignment(user_id, '번역', app.config['ASSIGNMENT_TARGET']) == first
+
+    skipped = client.post(f"/api/next/번역?skip={first['example_id']}").json['assignment']
+    assert skipped['example_id'] != first['example_id']
+    assert client.get('/evaluate/번역').status_code == 200
+    current = app.db.get_assignment(user_id, '번역', app.config['ASSIGNMENT_TARGET'])
+    assert current['example_id'] == skipped['example_id']
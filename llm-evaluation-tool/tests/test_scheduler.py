@@ -0,0 +1,72 @@
+"""
+Work assignment scheduler tests
+
+Evaluators lease the example of a category that most needs ratings. Leases
+end when the example is finished, when the evaluator asks for another one
+or when they expire.
+"""
+TARGET = 2
+LEASE_SECONDS = 900
+
+
+def next_id(db, user_id, category='번역', lease_seconds=LEASE_SECONDS, skip=None):
+    """Example id leased by next_example (None if nothing is left)"""
+    assignment = db.next_example(user_id, category, TARGET, lease_seconds, skip)
+    return assignment and assignment['example_id']
+
+
+def test_leases_spread_evaluators_and_finished_examples_are_skipped(db):
+    alice, bob = db.create_user('alice', 'pw'), db.create_user('bob', 'pw')
+    assert next_id(db, alice) == 1
+    # Example 1 is leased, so bob gets the next one
+    assert next_id(db, bob) == 2
+    assert db.get_coverage_summary(TARGET)['leases'] == 2
+
+    # Rating every model ends alice's lease; she is not given example 1 again
+    db.save_ratings(alice, [(1, 'GPT-5', 4), (1, 'Claude', 3), (1, 'Gemini', 5)])
+    assert db.get_assignment(alice, '번역', TARGET) is None
+    assert db.get_coverage_summary(TARGET)['leases'] == 1
+    assert next_id(db, alice) == 2
+
+    db.save_ratings(alice, [(2, 'GPT-5', 4), (2, 'Claude', 3)])
+    assert next_id(db, alice) is None
+    assert db.rebuild_stats(check_only=True) == []
+
+
+def test_asking_again_keeps_or_skips_the_lease(db):
+    alice = db.create_user('alice', 'pw')
+    assert next_id(db, alice) == 1
+    assert next_id(db, alice) == 1
+    assert next_id(db, alice, skip=1) == 2
+    assert db.get_assignment(alice, '번역', TARGET)['example_id'] == 2
+    assert db.get_coverage_summary(TARGET)['leases'] == 1
+
+
+def test_expired_leases_are_released(db):
+    alice, bob = db.create_user('alice', 'pw'), db.create_user('bob', 'pw')
+    assert next_id(db, alice, lease_seconds=-5) == 1
+    assert db.get_assignment(alice, '번역', TARGET) is None
+
+    # The next assignment ends the expired lease, so example 1 is free again
+    assert next_id(db, bob) == 1
+    assert db.get_coverage_summary(TARGET)['leases'] == 1
+    assert db.rebuild_stats(check_only=True) == []
+
+
+def test_examples_at_the_target_are_not_assigned(db):
+    alice, bob, carol = (db.create_user(name, 'pw') for name in ('alice', 'bob', 'carol'))
+    for user_id in (alice, bob):
+        db.save_ratings(user_id, [(3, 'GPT-5', 4), (3, 'Gemini', 3)])
+    assert next_id(db, carol, '수학') == 4
+    for user_id in (alice, bob):
+        db.save_ratings(user_id, [(4, 'GPT-5', 4), (4, 'Claude', 3)])
+    assert next_id(db, carol, '수학') is None
+
+
+def test_ratings_of_unknown_models_keep_the_lease(db):
+    alice = db.create_user('alice', 'pw')
+    assert next_id(db, alice) == 1
+    assert db.save_rating(alice, 1, 'Llama', 3) is None
+    db.save_ratings(alice, [(1, 'GPT-5', 4), (1, 'Claude', 3)])
+    assert db.get_assignment(alice, '번역', TARGET)['example_id'] == 1
+    assert db.rebuild_stats(check_only=True) == []
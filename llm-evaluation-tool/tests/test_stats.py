@@ -0,0 +1,84 @@
+"""
+Incrementally maintained aggregate tests
+
+Rating writes and dataset version swaps update the stats, leaderboard and
+coverage tables in place; after any sequence of them, rebuild_stats must find
+nothing that differs from a full recompute.
+"""
+from conftest import make_example
+
+
+def rate(db, user_id, ratings):
+    """Save (example_id, model_name, rating) tuples one by one"""
+    for example_id, model_name, rating in ratings:
+        assert db.save_rating(user_id, example_id, model_name, rating) is not None
+
+
+def by_key(rows, *keys):
+    """Index stat rows by their key columns"""
+    return {tuple(row[key] for key in keys): row for row in rows}
+
+
+def test_aggregates_follow_saves_and_replacements(db):
+    alice, bob = db.create_user('alice', 'pw'), db.create_user('bob', 'pw')
+    rate(db, alice, [(1, 'GPT-5', 5), (1, 'Claude', 2), (3, 'GPT-5', 4)])
+    rate(db, bob, [(1, 'GPT-5', 3)])
+    # Replacing a rating moves it between values without adding a count
+    rate(db, alice, [(1, 'GPT-5', 1)])
+
+    stats = db.get_aggregated_stats()
+    models = by_key(stats['by_model'], 'model_name')
+    assert (models[('GPT-5',)]['count'], models[('GPT-5',)]['avg_rating']) == (3, 8 / 3)
+    assert (models[('Claude',)]['count'], models[('Claude',)]['avg_rating']) == (1, 2.0)
+    categories = by_key(stats['by_category'], 'category')
+    assert categories[('번역',)]['count'] == 3
+    assert categories[('수학',)]['count'] == 1
+    cells = by_key(stats['by_model_category'], 'category', 'model_name')
+    assert cells[('번역', 'GPT-5')]['avg_rating'] == 2.0
+    assert db.count_ratings() == 4
+    assert db.rebuild_stats(check_only=True) == []
+
+
+def test_derived_tables_follow_dataset_swaps(db, dataset):
+    alice, bob = db.create_user('alice', 'pw'), db.create_user('bob', 'pw')
+    rate(db, alice, [(1, 'GPT-5', 5), (1, 'Claude', 4), (2, 'GPT-5', 3), (3, 'Gemini', 2)])
+    version, saved = db.save_ratings(bob, [(1, 'GPT-5', 2), (2, 'Claude', 1), (4, 'Claude', 5)])
+    assert saved == [True, True, True]
+    rate(db, bob, [(1, 'GPT-5', 4)])
+    assert db.count_ratings() == 7
+    assert db.rebuild_stats(check_only=True) == []
+
+    # Version 2 drops example 2, changes the content of example 3 and adds example 5
+    changed = [dataset[0], make_example(3, '수학', ['GPT-5', 'Gemini'], text='바뀐 질문'), dataset[3],
+               make_example(5, '수학', ['Claude', 'Gemini'])]
+    db.load_dataset(changed)
+    assert db.count_ratings() == 4
+    assert db.rebuild_stats(check_only=True) == []
+
+    # Ratings of the new contents, one of them replaced
+    rate(db, alice, [(3, 'Gemini', 5), (5, 'Claude', 3), (5, 'Claude', 1)])
+    assert db.save_rating(alice, 2, 'GPT-5', 4) is None
+    assert db.count_ratings() == 6
+    assert db.rebuild_stats(check_only=True) == []
+
+    # Rolling back brings back version 1's ratings and drops the new ones
+    assert db.activate_dataset(1)
+    assert db.count_ratings() == 7
+    assert db.rebuild_stats(check_only=True) == []
+    assert db.activate_dataset(2)
+    assert db.count_ratings() == 6
+    assert db.rebuild_stats(check_only=True) == []
+
+
+def test_rebuild_stats_repairs_drifted_tables(db):
+    alice = db.create_user('alice', 'pw')
+    rate(db, alice, [(1, 'GPT-5', 5), (2, 'Claude', 3)])
+    with db.transaction() as conn:
+        conn.execute("UPDATE stats_model SET count = count + 1 WHERE model_name = 'GPT-5'")
+        conn.execute("UPDATE leaderboard_models SET rating_5 = 0 WHERE model_name = 'GPT-5'")
+        conn.execute('DELETE FROM coverage_users')
+
+    drifted = {'stats_model', 'leaderboard_models', 'coverage_users'}
+    assert {mismatch[0] for mismatch in db.rebuild_stats(check_only=True)} == drifted
+    assert {mismatch[0] for mismatch in db.rebuild_stats()} == drifted
+    assert db.rebuild_stats(check_only=True) == []